@@ -0,0 +1,57 @@
+"""Measure the overhead of building the writer chain on chapter lookups and generation.
+
+The chain is memoized by `Writer.chain`. The "rebuilt" column invalidates it before each
+call, which is what every `self.chain` access used to cost.
+
+Usage:
+    python benchmarks/bench_chain.py [--chapters 100] [--number 200]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+# Import bookjibe from this checkout, without installing it
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_community.chat_models.fake import FakeListChatModel  # noqa: E402
+
+import bookjibe.writer  # noqa: E402
+from bookjibe.writer import Writer  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chapters", type=int, default=100)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    bookjibe.writer.llm = FakeListChatModel(responses=["Once upon a time"])
+    writer = Writer()
+    for i in range(1, args.chapters + 1):
+        writer.add_chapter_to_book_as_messages(i, f"Write chapter {i}", f"Chapter {i}")
+
+    def invalidate():
+        writer.prompt = writer.prompt
+
+    calls = {
+        "chain access": lambda: writer.chain,
+        "get_chapter_ai_message": lambda: writer.get_chapter_ai_message(1),
+        "get_last_chapter_number": writer.get_last_chapter_number,
+        "generate_chapter_versions": lambda: writer.generate_chapter_versions(
+            "A dragon", args.chapters + 1
+        ),
+    }
+    print(f"{'call':<28} {'cached (us)':>12} {'rebuilt (us)':>13}")
+    for label, call in calls.items():
+        cached = min(timeit.repeat(call, number=args.number, repeat=5)) / args.number
+        rebuilt = min(
+            timeit.repeat(
+                lambda: (invalidate(), call()), number=args.number, repeat=5
+            )
+        ) / args.number
+        print(f"{label:<28} {cached * 1e6:>12.1f} {rebuilt * 1e6:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Compare the loading of a large uploaded book: decoding and parsing it whole versus the streaming loader.
+
+A book of several megabytes is written as the data URL that dcc.Upload gives to the app, in JSON
+and in CSV. Each loader runs in its own process, and the peak resident memory (RSS) it adds on top
+of the data URL is reported, with its duration:
+    - json (whole): `parse_file_contents` then `create_writer_from_book_data`, as the app did
+      before the streaming loader,
+    - csv (whole): `parse_file_contents`, which reads the file with pandas,
+    - json (streaming) and csv (streaming): `bookjibe.loader.load_writer_from_upload`.
+
+The peak RSS is reset before each load through /proc/self/clear_refs (Linux); elsewhere the peak
+of the whole process is reported.
+
+Usage:
+    python benchmarks/bench_loader.py [--chapters 2000] [--words-per-chapter 600]
+"""
+import argparse
+import base64
+import csv
+import gc
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Import bookjibe from this checkout, without installing it
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("BOOKJIBE_LLM_BACKEND", "fake")
+os.environ.setdefault("BOOKJIBE_LLM_CACHE", "0")
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+WORDS = "le la les un une princesse dragon château forêt nuit étoile chemin secret".split()
+LOADERS = ["json (whole)", "json (streaming)", "csv (whole)", "csv (streaming)"]
+
+
+def make_book_data(number_of_chapters, words_per_chapter, seed=0):
+    rng = random.Random(seed)
+    book_data = {}
+    for i in range(number_of_chapters + 1):
+        name = "synopsis" if i == 0 else f"chapter{i}"
+        text = " ".join(rng.choice(WORDS) for _ in range(words_per_chapter))
+        book_data[name] = {"human_message": f"Write {name}.", "ai_message": text}
+    return book_data
+
+
+def to_data_url(text, content_type):
+    return f"data:{content_type};base64," + base64.b64encode(text.encode("utf-8")).decode()
+
+
+def write_data_urls(book_data, folder):
+    json_text = json.dumps(book_data, ensure_ascii=False)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["name", "human_message", "ai_message"])
+    for name, item in book_data.items():
+        writer.writerow([name, item["human_message"], item["ai_message"]])
+    paths = {}
+    for extension, text, content_type in [
+        ("json", json_text, "application/json"),
+        ("csv", buffer.getvalue(), "text/csv"),
+    ]:
+        paths[extension] = Path(folder) / f"book.{extension}.url"
+        paths[extension].write_text(to_data_url(text, content_type))
+    return paths, len(json_text.encode("utf-8"))
+
+
+def _memory_status():
+    status = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                status[key] = int(value.split()[0]) * 1024
+    return status
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS of the process and return the current RSS, or None if not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return _memory_status()["VmRSS"]
+    except OSError:
+        return None
+
+
+def parse_file_contents(contents, filename):
+    """The former parser of the uploaded files of the app: the file is decoded and parsed whole."""
+    content_type, content_string = contents.split(",")
+    decoded = base64.b64decode(content_string)
+    if "json" in filename:
+        return json.loads(decoded)
+    elif "csv" in filename:
+        import pandas as pd
+
+        return pd.read_csv(io.StringIO(decoded.decode("utf-8")))
+
+
+def run_loader(loader, data_url_path):
+    """Run a loader on a data URL file, in the current process, and print its measures as JSON."""
+    from bookjibe.loader import load_writer_from_upload
+    from bookjibe.writer import Writer, create_writer_from_book_data
+
+    # Import the modules used by the writers before measuring
+    Writer()
+    contents = Path(data_url_path).read_text()
+    filename = "book.json" if loader.startswith("json") else "book.csv"
+    gc.collect()
+    baseline = _reset_peak_rss()
+    start = time.perf_counter()
+    if loader == "json (whole)":
+        writer = create_writer_from_book_data(parse_file_contents(contents, filename))
+    elif loader == "csv (whole)":
+        # The whole path of this format stops at the parsing
+        writer = parse_file_contents(contents, filename)
+    else:
+        writer = load_writer_from_upload(contents, filename)
+    duration = time.perf_counter() - start
+    if baseline is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        baseline = 0
+    else:
+        peak = _memory_status()["VmHWM"]
+    assert writer is not None
+    print(json.dumps({"duration": duration, "peak_rss": peak - baseline}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chapters", type=int, default=2000)
+    parser.add_argument("--words-per-chapter", type=int, default=600)
+    parser.add_argument("--run", choices=LOADERS, help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_loader(args.run, args.file)
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        book_data = make_book_data(args.chapters, args.words_per_chapter)
+        paths, book_size = write_data_urls(book_data, folder)
+        del book_data
+        print(f"Book of {args.chapters} chapters, {book_size / 2**20:.1f} MiB of JSON")
+        print(f"{'loader':<18} {'time (s)':>9} {'peak RSS (MiB)':>15}")
+        for loader in LOADERS:
+            output = subprocess.run(
+                [sys.executable, __file__, "--run", loader, "--file", str(paths[loader.split()[0]])],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{loader:<18} {result['duration']:>9.2f} {result['peak_rss'] / 2**20:>15.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Compare the prompt cache hits of the default and the stable prompt layouts.
+
+A book is written chapter by chapter on the offline fake LLM, which emulates the prompt caching
+of OpenAI (see `bookjibe.fake_llm`), with 2 versions per chapter. For each memory strategy and
+each layout (`BOOKJIBE_PROMPT_LAYOUT`), it reports the prompt tokens sent, the prompt tokens
+served from the cache and the prompt tokens billed, counting the cached ones at half price.
+
+Usage:
+    python benchmarks/bench_prompt_cache.py [--chapters 30] [--words-per-chapter 600]
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+# Import bookjibe from this checkout, without installing it
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("BOOKJIBE_LLM_BACKEND", "fake")
+os.environ.setdefault("BOOKJIBE_LLM_CACHE", "0")
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+import bookjibe.writer  # noqa: E402
+from bookjibe.fake_llm import FakeChatOpenAI  # noqa: E402
+from bookjibe.memory import BookMemory  # noqa: E402
+from bookjibe.usage import UsageTracker, get_usage_handler  # noqa: E402
+from bookjibe.writer import Writer  # noqa: E402
+
+CONFIGURATIONS = [
+    ("window", {"strategy": "window", "window_chapters": 3}),
+    ("buffer, 6000 tokens", {"strategy": "buffer", "max_tokens": 6000}),
+]
+
+
+def write_book(memory, number_of_chapters, words_per_chapter):
+    tracker = UsageTracker()
+    bookjibe.writer.llm = FakeChatOpenAI(
+        output_tokens=words_per_chapter, cache=False, callbacks=[get_usage_handler(tracker)]
+    )
+    writer = Writer(memory)
+    writer.add_chapter_to_book_as_messages(0, "Write the synopsis.", "A dragon story. " * 50)
+    for chapter in range(1, number_of_chapters + 1):
+        _, ai_messages, human_messages = writer.generate_chapter_versions(
+            f"The dragon meets friend number {chapter}.", chapter, number_of_versions=2
+        )
+        writer.add_chapter_to_book_as_messages(chapter, human_messages[1], ai_messages[1])
+    return tracker.to_json()["totals"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chapters", type=int, default=30)
+    parser.add_argument("--words-per-chapter", type=int, default=600)
+    args = parser.parse_args()
+
+    print(
+        f"{'memory':<20} {'layout':<8} {'prompt tokens':>14} {'cached':>10} "
+        f"{'hit rate':>9} {'billed':>10}"
+    )
+    for name, options in CONFIGURATIONS:
+        for layout in ("default", "stable"):
+            memory = BookMemory(stable_prefix=layout == "stable", **options)
+            totals = write_book(memory, args.chapters, args.words_per_chapter)
+            prompt_tokens = totals["prompt_tokens"]
+            cached_tokens = totals["cached_tokens"]
+            print(
+                f"{name:<20} {layout:<8} {prompt_tokens:>14} {cached_tokens:>10} "
+                f"{cached_tokens / prompt_tokens:>9.1%} {prompt_tokens - cached_tokens / 2:>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Compare the serialization of a 100-chapter book: pickle + base64 versus the compact format.
+
+It runs offline: the book is built and rebuilt without creating an LLM client.
+
+Usage:
+    python benchmarks/bench_serialization.py [--chapters 100] [--repeat 20]
+"""
+import argparse
+import base64
+import pickle
+import random
+import sys
+import timeit
+from pathlib import Path
+
+# Import bookjibe from this checkout, without installing it
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from bookjibe.serialization import COMPRESSIONS, zstandard  # noqa: E402
+from bookjibe.writer import Writer, deserialize_writer, serialize_writer  # noqa: E402
+
+WORDS = "le la les un une princesse dragon château forêt nuit étoile chemin secret".split()
+
+
+def make_book(number_of_chapters, words_per_chapter=600, seed=0):
+    rng = random.Random(seed)
+    writer = Writer()
+    messages = writer.initial_memory.chat_memory.messages
+    for i in range(number_of_chapters + 1):
+        name = "synopsis" if i == 0 else f"chapter{i}"
+        text = " ".join(rng.choice(WORDS) for _ in range(words_per_chapter))
+        messages.append(HumanMessage(name=name, content=f"Write {name}."))
+        messages.append(AIMessage(name=name, content=text))
+    return writer
+
+
+def bench(label, dump, load, repeat):
+    payload = dump()
+    dump_time = min(timeit.repeat(dump, number=1, repeat=repeat))
+    load_time = min(timeit.repeat(lambda: load(payload), number=1, repeat=repeat))
+    print(
+        f"{label:<16} {len(payload) / 1024:>10.1f} {dump_time * 1000:>12.2f} "
+        f"{load_time * 1000:>12.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chapters", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    writer = make_book(args.chapters)
+    print(f"{'format':<16} {'size (KiB)':>10} {'dump (ms)':>12} {'load (ms)':>12}")
+    bench(
+        "pickle+base64",
+        lambda: base64.b64encode(pickle.dumps(writer)).decode("utf-8"),
+        lambda payload: pickle.loads(base64.b64decode(payload)),
+        args.repeat,
+    )
+    for compression in COMPRESSIONS:
+        if compression == "zstd" and zstandard is None:
+            continue
+        bench(
+            f"compact/{compression}",
+            lambda: serialize_writer(writer, compression=compression),
+            deserialize_writer,
+            args.repeat,
+        )
+
+
+if __name__ == "__main__":
+    main()
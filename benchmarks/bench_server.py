@@ -0,0 +1,298 @@
+"""Compare the throughput of the development server and of the production server of the app.
+
+The app runs on the offline fake LLM, served either by the development server
+(`python bookjibe/ui/app.py`: one process, debug tools and reloader on) or by gunicorn
+(`bookjibe.ui.wsgi` with gunicorn.conf.py: preloaded app, compression), with one worker and
+with `--workers` workers.
+Clients, in their own processes, each repeat a visit as fast as the server answers, keeping
+the files that may be cached like a browser:
+    - the page: the index, its scripts, the layout and the callbacks,
+    - a book of 10 chapters uploaded, a chapter generated (the job is polled until its
+      versions are ready), a version chosen and the chapter saved.
+The visits per second, the latency of the callback requests and the bytes received per visit
+are reported for each server.
+
+Usage:
+    python benchmarks/bench_server.py [--clients 8] [--duration 20] [--workers 4] [--threads 8]
+"""
+import argparse
+import base64
+import gzip
+import http.client
+import json
+import multiprocessing
+import os
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _server_env(port, folder, workers=1, threads=8):
+    env = dict(os.environ)
+    env.update(
+        {
+            "PYTHONPATH": str(ROOT),
+            "OPENAI_API_KEY": "sk-fake",
+            "BOOKJIBE_LLM_BACKEND": "fake",
+            "BOOKJIBE_LLM_CACHE": "0",
+            "BOOKJIBE_TOKENIZER": "estimate",
+            "BOOKJIBE_FAKE_LLM_LATENCY": "0.2",
+            "BOOKJIBE_FAKE_LLM_TOKENS_PER_SECOND": "1000",
+            "BOOKJIBE_FAKE_LLM_OUTPUT_TOKENS": "100",
+            "BOOKJIBE_PROMPT_FOLDER": str(ROOT / "init_prompts" / "french"),
+            "BOOKJIBE_PROMPT_GENERATOR_FOLDER": str(ROOT / "prompt_generators" / "french"),
+            "BOOKJIBE_TEMPORARY_FOLDER": folder,
+            "BOOKJIBE_JOURNAL_FOLDER": str(Path(folder) / "journals"),
+            "BOOKJIBE_WEB_BIND": f"127.0.0.1:{port}",
+            "BOOKJIBE_WEB_WORKERS": str(workers),
+            "BOOKJIBE_WEB_THREADS": str(threads),
+            "PORT": str(port),
+        }
+    )
+    return env
+
+
+def start_server(server, port, folder, workers, threads):
+    if server == "dev":
+        command = [sys.executable, str(ROOT / "bookjibe" / "ui" / "app.py")]
+        env = _server_env(port, folder)
+    else:
+        command = [
+            sys.executable, "-m", "gunicorn", "-c", str(ROOT / "gunicorn.conf.py"),
+            "--access-logfile", "/dev/null", "bookjibe.ui.wsgi:application",
+        ]
+        env = _server_env(port, folder, workers, threads)
+    process = subprocess.Popen(
+        command, cwd=ROOT, env=env, start_new_session=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/")
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.5)
+    stop_server(process)
+    raise RuntimeError(f"The {server} server did not start")
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGINT)
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+class Client:
+    """A browser, over one keep-alive connection.
+
+    Like a browser, it keeps the GET responses that may be cached (`Cache-Control: max-age`)
+    and does not request them again.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        self.received = 0
+        self.latencies = []
+        self.cache = {}
+
+    def request(self, method, path, body=None):
+        if method == "GET" and path in self.cache:
+            return self.cache[path]
+        headers = {"Accept-Encoding": "gzip, br"}
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The server closed the keep-alive connection
+            self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        data = response.read()
+        self.received += len(data)
+        if response.status not in (200, 204):
+            raise RuntimeError(f"{method} {path}: {response.status}")
+        max_age = re.search(r"max-age=(\d+)", response.getheader("Cache-Control") or "")
+        if method == "GET" and max_age and int(max_age.group(1)) > 0:
+            self.cache[path] = (response, data)
+        return response, data
+
+    def callback(self, dependency, inputs, state=()):
+        def values(specs, given):
+            return [
+                {"id": spec["id"], "property": spec["property"], "value": value}
+                for spec, value in zip(specs, given)
+            ]
+
+        outputs = [
+            dict(zip(("id", "property"), output.rsplit(".", 1))) for output in _outputs(dependency)
+        ]
+        body = {
+            "output": dependency["output"],
+            "outputs": outputs,
+            "inputs": values(dependency["inputs"], inputs),
+            "state": values(dependency["state"], state),
+            "changedPropIds": [f"{dependency['inputs'][0]['id']}.{dependency['inputs'][0]['property']}"],
+        }
+        start = time.perf_counter()
+        response, data = self.request("POST", "/_dash-update-component", body)
+        self.latencies.append(time.perf_counter() - start)
+        if response.status == 204:
+            return {}
+        return json.loads(_decode(response, data))["response"]
+
+
+def _decode(response, data):
+    encoding = response.getheader("Content-Encoding")
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br":
+        import brotli
+
+        return brotli.decompress(data)
+    return data
+
+
+def _outputs(dependency):
+    return [output.split("@")[0] for output in dependency["output"].strip(".").split("...")]
+
+
+def _find(dependencies, output):
+    return next(d for d in dependencies if output in _outputs(d))
+
+
+def make_book_upload():
+    book_data = {"synopsis": {"human_message": "Write a story", "ai_message": "A dragon story."}}
+    for i in range(1, 11):
+        book_data[f"chapter{i}"] = {
+            "human_message": f"Write chapter {i}",
+            "ai_message": f"The dragon meets friend number {i}. " * 50,
+        }
+    text = json.dumps(book_data)
+    return "data:application/json;base64," + base64.b64encode(text.encode()).decode()
+
+
+def visit(client, upload):
+    response, index = client.request("GET", "/")
+    for src in re.findall(rb'<script src="([^"]+)"', _decode(response, index)):
+        client.request("GET", src.decode())
+    client.request("GET", "/_dash-layout")
+    response, data = client.request("GET", "/_dash-dependencies")
+    dependencies = json.loads(_decode(response, data))
+
+    uploaded = client.callback(
+        _find(dependencies, "book_upload_status.children"), [upload], ["book.json", None]
+    )
+    session = uploaded["writer_session"]["data"]
+    started = client.callback(
+        _find(dependencies, "stream_job.data"), [1], [session, "The dragon flies"]
+    )
+    job_id = started["stream_job"]["data"]
+    stream = _find(dependencies, "versions_dict.data")
+    while True:
+        polled = client.callback(stream, [1], [job_id])
+        if "versions_dict" in polled:
+            versions_dict = polled["versions_dict"]["data"]
+            break
+        time.sleep(0.05)
+    chosen = client.callback(
+        _find(dependencies, "selected_version.data"), [1, 0], [session, versions_dict]
+    )
+    session = chosen["writer_session"]["data"]
+    save = next(d for d in dependencies if d["inputs"][0]["id"] == "save_chapter_button")
+    client.callback(save, [1], [session, "An edited chapter.", 11])
+
+
+def run_client(port, duration, queue):
+    client = Client(port)
+    upload = make_book_upload()
+    visits = 0
+    deadline = time.monotonic() + duration
+    try:
+        while time.monotonic() < deadline:
+            visit(client, upload)
+            visits += 1
+    finally:
+        queue.put({"visits": visits, "received": client.received, "latencies": client.latencies})
+
+
+def load_test(port, clients, duration):
+    queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=run_client, args=(port, duration, queue))
+        for _ in range(clients)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    results = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+    visits = sum(result["visits"] for result in results)
+    latencies = sorted(latency for result in results for latency in result["latencies"])
+    return {
+        "visits_per_second": visits / elapsed,
+        "callbacks_per_second": len(latencies) / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "kib_per_visit": sum(result["received"] for result in results) / max(visits, 1) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    print(
+        f"{args.clients} clients for {args.duration:.0f}s, {os.cpu_count()} CPUs"
+    )
+    print(
+        f"{'server':<14} {'visits/s':>9} {'callbacks/s':>12} {'p50 (ms)':>9} "
+        f"{'p95 (ms)':>9} {'KiB/visit':>10}"
+    )
+    for server, workers in [("dev", 1), ("gunicorn", 1), ("gunicorn", args.workers)]:
+        name = server if server == "dev" else f"gunicorn {workers}x{args.threads}"
+        with tempfile.TemporaryDirectory() as folder:
+            port = _free_port()
+            process = start_server(server, port, folder, workers, args.threads)
+            try:
+                result = load_test(port, args.clients, args.duration)
+            finally:
+                stop_server(process)
+        print(
+            f"{name:<14} {result['visits_per_second']:>9.2f} "
+            f"{result['callbacks_per_second']:>12.1f} {result['p50'] * 1000:>9.0f} "
+            f"{result['p95'] * 1000:>9.0f} {result['kib_per_visit']:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
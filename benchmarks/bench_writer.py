@@ -0,0 +1,189 @@
+"""End-to-end benchmark of the writer on the offline fake LLM.
+
+For books of 10, 100 and 1000 chapters, it measures the latency percentiles, the peak
+memory allocated (tracemalloc) and the payload sizes of:
+    - generate_book_story,
+    - generate_chapter_versions (prompt size in tokens as payload),
+    - add_chapter_to_book_as_messages,
+    - serialize_writer / deserialize_writer,
+    - save_history_to_file, compared to saving a chapter in the journal of the book.
+
+No network access is needed. By default the fake LLM answers instantly, so that the
+benchmark measures the overhead of bookjibe itself; use --latency and --tokens-per-second
+to simulate a real model.
+
+Usage:
+    python benchmarks/bench_writer.py [--chapters 10 100 1000] [--repeat 20] [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+# Import bookjibe from this checkout, without installing it
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("BOOKJIBE_LLM_BACKEND", "fake")
+os.environ.setdefault("BOOKJIBE_LLM_CACHE", "0")
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+import bookjibe.writer  # noqa: E402
+from bookjibe.journal import BookJournal  # noqa: E402
+from bookjibe.llm import get_fake_chat_model  # noqa: E402
+from bookjibe.tokens import count_message_tokens  # noqa: E402
+from bookjibe.utils import render_chain_messages  # noqa: E402
+from bookjibe.writer import Writer, deserialize_writer, serialize_writer  # noqa: E402
+
+
+def percentiles(durations):
+    if len(durations) == 1:
+        return durations * 3
+    quantiles = statistics.quantiles(durations, n=100, method="inclusive")
+    return quantiles[49], quantiles[94], quantiles[98]
+
+
+def measure(call, repeat):
+    """Call `call` `repeat` times and return the durations and the peak memory allocated."""
+    durations = []
+    tracemalloc.start()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return durations, peak
+
+
+def bench_book(number_of_chapters, repeat, init_prompt_file, output_folder):
+    results = []
+
+    def record(operation, durations, peak, payload=None):
+        p50, p95, p99 = percentiles(durations)
+        results.append(
+            {
+                "chapters": number_of_chapters,
+                "operation": operation,
+                "p50_ms": p50 * 1000,
+                "p95_ms": p95 * 1000,
+                "p99_ms": p99 * 1000,
+                "peak_kib": peak / 1024,
+                "payload": payload,
+            }
+        )
+
+    writer = Writer()
+    durations, peak = measure(
+        lambda: Writer().generate_book_story(init_prompt_file, "A story about a dragon"),
+        repeat,
+    )
+    record("generate_book_story", durations, peak)
+
+    writer.generate_book_story(init_prompt_file, "A story about a dragon")
+    chapter_text = writer.initial_memory.chat_memory.messages[-1].content
+    chapters = iter(range(1, number_of_chapters + 1))
+    durations, peak = measure(
+        lambda: writer.add_chapter_to_book_as_messages(
+            next(chapters), "Write the next chapter.", chapter_text
+        ),
+        number_of_chapters,
+    )
+    record("add_chapter_to_book_as_messages", durations, peak)
+
+    prompt_tokens = count_message_tokens(
+        render_chain_messages(
+            writer.chain, writer._chapter_inputs("The dragon comes back", number_of_chapters + 1)
+        )
+    )
+    durations, peak = measure(
+        lambda: writer.generate_chapter_versions(
+            "The dragon comes back", number_of_chapters + 1
+        ),
+        repeat,
+    )
+    record("generate_chapter_versions", durations, peak, f"{prompt_tokens} prompt tokens")
+
+    payload = serialize_writer(writer)
+    durations, peak = measure(lambda: serialize_writer(writer), repeat)
+    record("serialize_writer", durations, peak, f"{len(payload) / 1024:.1f} KiB")
+    durations, peak = measure(lambda: deserialize_writer(payload), repeat)
+    record("deserialize_writer", durations, peak, f"{len(payload) / 1024:.1f} KiB")
+
+    history_file = Path(output_folder) / f"book_{number_of_chapters}.json"
+    durations, peak = measure(lambda: writer.save_history_to_file(history_file), repeat)
+    record(
+        "save_history_to_file",
+        durations,
+        peak,
+        f"{history_file.stat().st_size / 1024:.1f} KiB",
+    )
+
+    journal = BookJournal(Path(output_folder) / f"book_{number_of_chapters}.jsonl")
+    journal.rewrite(writer.to_state())
+    writer.journal = journal
+    chapters = iter(range(number_of_chapters + 2, number_of_chapters + 2 + repeat))
+    durations, peak = measure(
+        lambda: writer.add_chapter_to_book_as_messages(
+            next(chapters), "Write the next chapter.", chapter_text
+        ),
+        repeat,
+    )
+    record(
+        "add_chapter_to_book_as_messages (journal)",
+        durations,
+        peak,
+        f"{journal.path.stat().st_size / 1024:.1f} KiB journal",
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chapters", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--output-tokens", type=int, default=500)
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    bookjibe.writer.llm = get_fake_chat_model(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        output_tokens=args.output_tokens,
+        cache=False,
+    )
+    results = []
+    with tempfile.TemporaryDirectory() as output_folder:
+        bookjibe.writer.init_prompt_folder = output_folder
+        init_prompt_file = "init_prompt.txt"
+        (Path(output_folder) / init_prompt_file).write_text(
+            "Write the synopsis of a children's book."
+        )
+        for number_of_chapters in args.chapters:
+            results += bench_book(
+                number_of_chapters, args.repeat, init_prompt_file, output_folder
+            )
+
+    print(
+        f"{'chapters':>8} {'operation':<42} {'p50 (ms)':>9} {'p95 (ms)':>9} "
+        f"{'p99 (ms)':>9} {'peak (KiB)':>11}  payload"
+    )
+    for result in results:
+        print(
+            f"{result['chapters']:>8} {result['operation']:<42} {result['p50_ms']:>9.3f} "
+            f"{result['p95_ms']:>9.3f} {result['p99_ms']:>9.3f} "
+            f"{result['peak_kib']:>11.1f}  {result['payload'] or ''}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
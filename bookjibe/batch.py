@@ -0,0 +1,204 @@
+"""Headless generation of books from a manifest.
+
+The manifest is a JSON file listing the books to generate:
+
+    {
+        "defaults": {"prompt_file": "children_book_prompt.txt", "versions": 2, "selection": "longest"},
+        "books": [
+            {
+                "name": "dragon",
+                "description": "A story about a dragon who is afraid of the dark",
+                "chapters": ["The dragon meets a firefly", "The firefly teaches the dragon to glow"]
+            }
+        ]
+    }
+
+Each book has:
+    - "name": the name of its output files,
+    - "prompt_file": the initial prompt, in `BOOKJIBE_PROMPT_FOLDER`,
+    - "description": the description of the story, appended to the initial prompt,
+    - "chapters": the outline of each chapter,
+    - "versions": the number of versions generated for each chapter (default 1),
+    - "selection": the policy choosing the kept version, see `SELECTION_POLICIES`,
+    - "mode": how the versions are generated, see `Writer.generate_chapter_versions`.
+The "defaults" apply to all the books that do not set the key.
+
+The state of each book (`<name>.state.json`) is checkpointed after every chapter, as returned
+by `Writer.to_state`, with the summaries of the chapters. A book that was interrupted resumes
+from its last checkpoint. Once finished, the history of the book is saved in `<name>.json`, in
+the format of `Writer.save_history_to_file`, and its text in `<name>.txt`.
+
+The LLM responses cached on disk are reused by default, so that a run that is started again
+replays the responses it already got; set `use_cache` to False to generate new texts.
+"""
+import json
+import os
+import random
+import time
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Union
+
+SELECTION_POLICIES = {
+    "first": lambda texts: 0,
+    "longest": lambda texts: max(range(len(texts)), key=lambda i: len(texts[i])),
+    "shortest": lambda texts: min(range(len(texts)), key=lambda i: len(texts[i])),
+    "random": lambda texts: random.randrange(len(texts)),
+}
+
+BOOK_DEFAULTS = {
+    "versions": 1,
+    "selection": "first",
+    "mode": "concurrent",
+}
+
+
+def load_manifest(file_path: Union[str, Path]) -> List[Dict]:
+    """Load the books of a manifest, with the defaults applied.
+
+    Args:
+        file_path (str): The path to the JSON manifest.
+
+    Returns:
+        list: The books to generate, as dicts.
+    """
+    with open(file_path, "r") as f:
+        manifest = json.load(f)
+    defaults = {**BOOK_DEFAULTS, **manifest.get("defaults", {})}
+    books = []
+    for i, book in enumerate(manifest["books"], start=1):
+        book = {**defaults, **book}
+        book.setdefault("name", f"book{i}")
+        for key in ("prompt_file", "description", "chapters"):
+            if key not in book:
+                raise ValueError(f"The book {book['name']} has no {key}")
+        if book["selection"] not in SELECTION_POLICIES:
+            raise ValueError(f"Unknown selection policy: {book['selection']}")
+        books.append(book)
+    names = [book["name"] for book in books]
+    if len(set(names)) != len(names):
+        raise ValueError("The names of the books must be unique")
+    return books
+
+
+def _checkpoint(writer, file_path: Path):
+    # Write to a temporary file first, so that a crash never leaves a truncated checkpoint
+    temporary_file_path = file_path.with_name(file_path.name + ".tmp")
+    with open(temporary_file_path, "w") as f:
+        json.dump(writer.to_state(), f)
+    os.replace(temporary_file_path, file_path)
+
+
+def _load_checkpoint(file_path: Path):
+    from bookjibe.writer import Writer
+
+    with open(file_path, "r") as f:
+        state = json.load(f)
+    state["pairs"] = [tuple(pair) for pair in state["pairs"]]
+    return Writer.from_state(state)
+
+
+def generate_book(book: Dict, output_folder: Union[str, Path], use_cache: bool = True) -> Dict:
+    """Generate a book of the manifest, resuming from its checkpoint if there is one.
+
+    Args:
+        book (dict): The book, as returned by `load_manifest`.
+        output_folder (str): The folder of the checkpoints and of the books.
+        use_cache (bool): Whether the LLM responses cached on disk are reused, see `bookjibe.cache`.
+
+    Returns:
+        dict: The name of the book, its status ("done" or "failed"), the number of
+            chapters generated by this call, the duration, the error if any and the
+            LLM usage of the book, see `bookjibe.usage.UsageTracker.book_usage`.
+    """
+    from bookjibe.cache import bypass_llm_cache
+    from bookjibe.usage import get_usage_tracker
+    from bookjibe.writer import Writer
+
+    output_folder = Path(output_folder)
+    checkpoint_file = output_folder / f"{book['name']}.state.json"
+    start = time.perf_counter()
+    generated = 0
+    try:
+        with nullcontext() if use_cache else bypass_llm_cache():
+            if checkpoint_file.exists():
+                writer = _load_checkpoint(checkpoint_file)
+                print(f"{book['name']}: resuming after chapter {writer.get_last_chapter_number()}")
+            else:
+                writer = Writer()
+            # Account the LLM calls to the book, see `bookjibe.usage`
+            writer.book_id = book["name"]
+            if not writer.initial_memory.chat_memory.messages:
+                writer.generate_book_story(book["prompt_file"], book["description"])
+                _checkpoint(writer, checkpoint_file)
+            select = SELECTION_POLICIES[book["selection"]]
+            first_chapter = writer.get_last_chapter_number() + 1
+            for chapter in range(first_chapter, len(book["chapters"]) + 1):
+                _, ai_messages, human_messages = writer.generate_chapter_versions(
+                    book["chapters"][chapter - 1],
+                    chapter,
+                    number_of_versions=book["versions"],
+                    mode=book["mode"],
+                )
+                texts = list(ai_messages.values())
+                version = list(ai_messages)[select(texts)]
+                writer.add_chapter_to_book_as_messages(
+                    chapter, human_messages[version], ai_messages[version]
+                )
+                _checkpoint(writer, checkpoint_file)
+                generated += 1
+                print(f"{book['name']}: chapter {chapter}/{len(book['chapters'])} done")
+            writer.save_history_to_file(output_folder / f"{book['name']}.json")
+            writer.save_book_to_file(output_folder / f"{book['name']}.txt")
+    except Exception as e:
+        print(f"{book['name']}: failed, {e!r}")
+        return {
+            "name": book["name"],
+            "status": "failed",
+            "chapters": generated,
+            "duration": time.perf_counter() - start,
+            "error": repr(e),
+            "usage": get_usage_tracker().book_usage(book["name"]),
+        }
+    return {
+        "name": book["name"],
+        "status": "done",
+        "chapters": generated,
+        "duration": time.perf_counter() - start,
+        "error": None,
+        "usage": get_usage_tracker().book_usage(book["name"]),
+    }
+
+
+def run_batch(
+    books: List[Dict],
+    output_folder: Union[str, Path],
+    workers: int = 4,
+    executor: str = "thread",
+    use_cache: bool = True,
+) -> List[Dict]:
+    """Generate books in parallel.
+
+    Args:
+        books (list): The books to generate, as returned by `load_manifest`.
+        output_folder (str): The folder of the checkpoints and of the books.
+        workers (int): The maximum number of books generated at the same time.
+        executor (str): "thread" to generate the books in threads of this process,
+            "process" to generate them in separate processes. Each process has its own
+            rate limiter, with the full quotas, see `bookjibe.ratelimit`.
+        use_cache (bool): Whether the LLM responses cached on disk are reused.
+
+    Returns:
+        list: The results of `generate_book`, in the order of the books.
+    """
+    Path(output_folder).mkdir(parents=True, exist_ok=True)
+    if executor == "thread":
+        pool = ThreadPoolExecutor(max_workers=workers)
+    elif executor == "process":
+        pool = ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError(f"Unknown executor: {executor}")
+    with pool:
+        futures = [pool.submit(generate_book, book, output_folder, use_cache) for book in books]
+        return [future.result() for future in futures]
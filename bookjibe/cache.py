@@ -0,0 +1,183 @@
+"""On-disk cache of the LLM responses.
+
+The responses are stored in a SQLite database, keyed by a hash of the rendered messages
+and of the parameters of the model (model name, temperature, ...). The least recently
+used responses are evicted when the database grows over `max_bytes`.
+
+The cache is used by all the chat models created with `bookjibe.llm.get_chatopenai`.
+Use `bypass_llm_cache` to regenerate a response on purpose, and `llm_cache_variant`
+to get different cached responses for the same prompt, e.g. for the versions of a chapter.
+"""
+import contextvars
+import hashlib
+import sqlite3
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Union
+
+from langchain_core._api import LangChainBetaWarning
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+from bookjibe.settings import llm_cache_max_mb, temporary_folder
+
+# The key of the `generation_info` of the generations served from the cache
+CACHE_HIT_KEY = "bookjibe_cache_hit"
+
+_bypass = contextvars.ContextVar("bookjibe_llm_cache_bypass", default=False)
+_variant = contextvars.ContextVar("bookjibe_llm_cache_variant", default=None)
+
+
+@contextmanager
+def bypass_llm_cache():
+    """Do not read the cached responses in this context. The new responses are still cached."""
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+@contextmanager
+def llm_cache_variant(variant):
+    """Cache the responses of this context separately from the responses of other variants."""
+    token = _variant.set(variant)
+    try:
+        yield
+    finally:
+        _variant.reset(token)
+
+
+class DiskResponseCache(BaseCache):
+    """LangChain cache of the LLM responses, stored in a SQLite database.
+
+    Args:
+        path (str): The path to the SQLite database.
+        max_bytes (int): The maximum size of the cached responses.
+    """
+
+    def __init__(self, path: Union[str, Path], max_bytes: int = 256 * 1024 * 1024):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        key = hashlib.sha256()
+        for part in (prompt, llm_string, repr(_variant.get())):
+            key.update(part.encode("utf-8"))
+            key.update(b"\0")
+        return key.hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if _bypass.get():
+            with self._lock:
+                self.misses += 1
+            return None
+        key = self._key(prompt, llm_string)
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE responses SET last_access = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", LangChainBetaWarning)
+            generations = loads(row[0])
+        # Mark the replayed generations, so that they are not accounted as billed calls,
+        # see `bookjibe.usage`
+        for generation in generations:
+            generation.generation_info = {**(generation.generation_info or {}), CACHE_HIT_KEY: True}
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        value = dumps(list(return_val))
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (self._key(prompt, llm_string), value, len(value), time.time()),
+            )
+            self._evict(connection)
+
+    def _evict(self, connection):
+        (total,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = connection.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def clear(self, **kwargs) -> None:
+        with self._connect() as connection:
+            connection.execute("DELETE FROM responses")
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Get the hit/miss counters and the size of the cache."""
+        with self._connect() as connection:
+            entries, size = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries,
+                "bytes": size,
+            }
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Get the response cache of the application, in `BOOKJIBE_TEMPORARY_FOLDER`."""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = DiskResponseCache(
+                Path(temporary_folder) / "llm_cache.sqlite",
+                max_bytes=int(llm_cache_max_mb * 1024 * 1024),
+            )
+        return _response_cache
@@ -0,0 +1,72 @@
+def get_chapter_number(name):
+    """Get the number of a chapter from the name of its messages, e.g. 3 for "chapter3".
+
+    Return None if the name is not the name of a chapter.
+    """
+    if name is None or not name.startswith("chapter"):
+        return None
+    try:
+        return int(name[len("chapter") :])
+    except ValueError:
+        return None
+
+
+class ChapterIndex:
+    """Index of the chapters in a list of messages.
+
+    It maps each chapter number to the positions of its human and AI messages,
+    and keeps track of the last chapter number.
+    The index is kept in sync with the list by `sync`, which only indexes the messages
+    appended since the previous call. It is rebuilt from scratch if the list was replaced
+    or if messages were removed from it.
+    """
+
+    def __init__(self):
+        self.positions = {}
+        self.ai_names = []
+        self.max_chapter = 0
+        self._messages = None
+        self._length = 0
+        self._last_message = None
+
+    def sync(self, messages):
+        """Update the index with the messages added to the list since the last call."""
+        if (
+            messages is not self._messages
+            or len(messages) < self._length
+            or (self._length and messages[self._length - 1] is not self._last_message)
+        ):
+            self.__init__()
+            self._messages = messages
+        for i in range(self._length, len(messages)):
+            self._add(i, messages[i])
+        self._length = len(messages)
+        self._last_message = messages[-1] if messages else None
+        return self
+
+    def _add(self, i, message):
+        if message.type == "ai":
+            self.ai_names.append(message.name)
+        chapter_number = get_chapter_number(getattr(message, "name", None))
+        if chapter_number is None:
+            return
+        positions = self.positions.setdefault(chapter_number, [None, None])
+        if message.type == "human" and positions[0] is None:
+            positions[0] = i
+        elif message.type == "ai" and positions[1] is None:
+            positions[1] = i
+        self.max_chapter = max(self.max_chapter, chapter_number)
+
+    def replace_message(self, i, message):
+        """Replace the message at position `i` of the indexed list with a message of the same name."""
+        self._messages[i] = message
+        if i == self._length - 1:
+            self._last_message = message
+
+    def human_message_position(self, chapter_number):
+        """Get the position of the human message of a chapter, or None if there is none."""
+        return self.positions.get(chapter_number, (None, None))[0]
+
+    def ai_message_position(self, chapter_number):
+        """Get the position of the AI message of a chapter, or None if there is none."""
+        return self.positions.get(chapter_number, (None, None))[1]
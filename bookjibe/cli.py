@@ -0,0 +1,66 @@
+"""Command line interface of bookjibe.
+
+    bookjibe batch manifest.json --output books --workers 4 [--no-cache]
+"""
+import argparse
+import sys
+import time
+
+from bookjibe.batch import load_manifest, run_batch
+
+
+def batch(args):
+    books = load_manifest(args.manifest)
+    start = time.perf_counter()
+    results = run_batch(
+        books, args.output, workers=args.workers, executor=args.executor, use_cache=args.cache
+    )
+    duration = time.perf_counter() - start
+    chapters = sum(result["chapters"] for result in results)
+    failed = [result for result in results if result["status"] == "failed"]
+    for result in results:
+        print(
+            f"{result['name']}: {result['status']}, {result['chapters']} chapters "
+            f"in {result['duration']:.1f}s, {result['usage']['prompt_tokens']} prompt tokens "
+            f"and {result['usage']['completion_tokens']} completion tokens"
+        )
+    print(
+        f"{len(results) - len(failed)}/{len(results)} books, {chapters} chapters "
+        f"in {duration:.1f}s ({chapters / duration * 60 if duration else 0:.1f} chapters/min)"
+    )
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="bookjibe")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    batch_parser = subparsers.add_parser(
+        "batch", help="Generate the books of a manifest, without the user interface."
+    )
+    batch_parser.add_argument("manifest", help="The JSON manifest of the books, see bookjibe.batch.")
+    batch_parser.add_argument(
+        "--output", default="books", help="The folder of the checkpoints and of the books."
+    )
+    batch_parser.add_argument(
+        "--workers", type=int, default=4, help="The number of books generated at the same time."
+    )
+    batch_parser.add_argument(
+        "--executor",
+        choices=("thread", "process"),
+        default="thread",
+        help="Generate the books in threads sharing one rate limiter, or in processes "
+        "each having its own rate limiter with the full quotas.",
+    )
+    batch_parser.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        help="Generate new texts instead of reusing the LLM responses cached on disk.",
+    )
+    batch_parser.set_defaults(func=batch)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
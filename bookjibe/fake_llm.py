@@ -0,0 +1,181 @@
+"""Offline, deterministic stand-in for `ChatOpenAI`.
+
+It is selected with `BOOKJIBE_LLM_BACKEND=fake` and is meant for tests and benchmarks:
+the latency, the token throughput and the size of the answers can be tuned. The answers only
+depend on the prompt, the candidate and the variant of the request (`bookjibe.cache.llm_cache_variant`),
+not on the order of the calls, so a replayed session gets the same answers, even when its
+requests are sent from several threads.
+
+The prompt caching of OpenAI is emulated in the reported usage: the longest prefix of whole
+messages already sent is counted as `cached_tokens`, in steps of 128 tokens, for the prompts of
+1024 tokens or more.
+"""
+import asyncio
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from bookjibe.tokens import count_message_tokens
+
+WORDS = (
+    "the a princess dragon castle forest night star path secret king queen river "
+    "mountain village storm door light shadow friend letter journey garden"
+).split()
+
+# Hashes of the message prefixes already sent, least recently used first
+_prefix_cache = OrderedDict()
+_prefix_cache_lock = threading.Lock()
+_prefix_cache_size = 100000
+
+
+class FakeChatOpenAI(BaseChatModel):
+    """Fake chat model writing random words.
+
+    Args:
+        latency (float): The number of seconds before the first token.
+        tokens_per_second (float): The throughput of the generation, 0 for no delay.
+        output_tokens (int): The number of tokens (words) of each answer.
+        model_name (str): The model name reported in the outputs.
+    """
+
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    output_tokens: int = 500
+    model_name: str = "fake-gpt"
+    n: int = 1
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-openai"
+
+    @property
+    def _identifying_params(self):
+        return {
+            "model_name": self.model_name,
+            "output_tokens": self.output_tokens,
+        }
+
+    def _seed(self, messages: List[BaseMessage], candidate: int) -> int:
+        from bookjibe.cache import _variant
+
+        prompt = "\n".join(f"{message.type}:{message.content}" for message in messages)
+        digest = hashlib.sha256(
+            f"{prompt}\0{candidate}\0{_variant.get()!r}".encode("utf-8")
+        )
+        return int.from_bytes(digest.digest()[:8], "little")
+
+    def _tokens(self, messages: List[BaseMessage], candidate: int) -> Iterator[str]:
+        rng = random.Random(self._seed(messages, candidate))
+        for i in range(self.output_tokens):
+            word = rng.choice(WORDS)
+            yield word if i == 0 else f" {word}"
+
+    def _token_delay(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _cached_tokens(self, messages: List[BaseMessage]) -> int:
+        digest = hashlib.sha256()
+        prompt_tokens = 0
+        cached_tokens = 0
+        with _prefix_cache_lock:
+            for message in messages:
+                digest.update(f"{message.type}:{message.content}\0".encode("utf-8"))
+                key = digest.hexdigest()
+                prompt_tokens += count_message_tokens([message])
+                if key in _prefix_cache:
+                    cached_tokens = prompt_tokens
+                    _prefix_cache.move_to_end(key)
+                else:
+                    _prefix_cache[key] = None
+            while len(_prefix_cache) > _prefix_cache_size:
+                _prefix_cache.popitem(last=False)
+        if prompt_tokens < 1024:
+            return 0
+        return cached_tokens // 128 * 128
+
+    def _usage(self, messages, completion_tokens):
+        prompt_tokens = count_message_tokens(messages)
+        return {
+            "token_usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": self._cached_tokens(messages)},
+            },
+            "model_name": self.model_name,
+        }
+
+    def _result(self, messages: List[BaseMessage], n: int) -> ChatResult:
+        generations = [
+            ChatGeneration(message=AIMessage(content="".join(self._tokens(messages, i))))
+            for i in range(n)
+        ]
+        return ChatResult(
+            generations=generations,
+            llm_output=self._usage(messages, n * self.output_tokens),
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency + self._token_delay() * self.output_tokens)
+        return self._result(messages, kwargs.get("n", self.n))
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency + self._token_delay() * self.output_tokens)
+        return self._result(messages, kwargs.get("n", self.n))
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        delay = self._token_delay()
+        for token in self._tokens(messages, 0):
+            if delay:
+                time.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        delay = self._token_delay()
+        for token in self._tokens(messages, 0):
+            if delay:
+                await asyncio.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
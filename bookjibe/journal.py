@@ -0,0 +1,177 @@
+"""Append-only on-disk journal of a book.
+
+Each book has a JSONL file where every change is appended as one record:
+    - {"op": "add", "name": ..., "human_message": ..., "ai_message": ...}: a synopsis or a chapter
+      was added to the book,
+    - {"op": "update", "name": ..., "ai_message": ...}: the text of a chapter was edited,
+    - {"op": "summary", "name": ..., "summary": ...}: the summary of a chapter was computed.
+
+Saving a change only costs the size of the change, whatever the size of the book. Each record is
+flushed and fsynced before returning; a record truncated by a crash is skipped when the journal is
+read. `compact` rewrites the journal with one record per chapter, and `export` writes the book in
+the JSON format read by `bookjibe.writer.create_writer_from_book_data`.
+"""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Union
+
+from bookjibe.settings import journal_folder
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _get_lock(path: Path):
+    # One lock per journal file, shared by all the `BookJournal` objects of the file
+    with _locks_lock:
+        return _locks.setdefault(path.resolve(), threading.RLock())
+
+
+def _fsync_folder(folder: Path):
+    # Persist the rename of a file in the folder, where supported
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class BookJournal:
+    """Journal of the changes of a book, see the module documentation.
+
+    Args:
+        path (str): The path to the JSONL file of the journal.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._lock = _get_lock(self.path)
+
+    def exists(self):
+        return self.path.exists()
+
+    def append(self, record: dict):
+        """Append a record to the journal, and wait for it to be on disk."""
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a+b") as f:
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        # End the record truncated by a crash, so that it is skipped alone
+                        line = "\n" + line
+                f.write(line.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def add(self, name, human_message: str, ai_message: str):
+        """Record a synopsis or a chapter added to the book."""
+        self.append(
+            {"op": "add", "name": name, "human_message": human_message, "ai_message": ai_message}
+        )
+
+    def update(self, name, ai_message: str):
+        """Record the new text of a chapter."""
+        self.append({"op": "update", "name": name, "ai_message": ai_message})
+
+    def summary(self, name, summary: str):
+        """Record the summary of a chapter."""
+        self.append({"op": "summary", "name": name, "summary": summary})
+
+    def records(self):
+        """Read the records of the journal, skipping the records truncated by a crash."""
+        if not self.path.exists():
+            return []
+        with self._lock, open(self.path, "r", encoding="utf-8", errors="replace") as f:
+            lines = f.readlines()
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"Skipping a truncated record of {self.path}")
+        return records
+
+    def load_state(self):
+        """Replay the journal into a book state, see `bookjibe.writer.Writer.to_state`."""
+        pairs = []
+        positions = {}
+        summaries = {}
+        for record in self.records():
+            if record["op"] == "add":
+                if record["name"] is not None:
+                    positions.setdefault(record["name"], len(pairs))
+                pairs.append((record["name"], record["human_message"], record["ai_message"]))
+            elif record["op"] == "update":
+                i = positions[record["name"]]
+                name, human_message, _ = pairs[i]
+                pairs[i] = (name, human_message, record["ai_message"])
+                # The summary of the previous text is outdated
+                summaries.pop(record["name"], None)
+            elif record["op"] == "summary":
+                summaries[record["name"]] = record["summary"]
+        metadata = {"summaries": summaries} if summaries else {}
+        return {"metadata": metadata, "pairs": pairs}
+
+    def rewrite(self, state: dict):
+        """Replace the journal with the records of a book state, atomically."""
+        temporary_path = self.path.with_name(self.path.name + ".tmp")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                for name, human_message, ai_message in state["pairs"]:
+                    record = {
+                        "op": "add",
+                        "name": name,
+                        "human_message": human_message,
+                        "ai_message": ai_message,
+                    }
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                for name, summary in state["metadata"].get("summaries", {}).items():
+                    record = {"op": "summary", "name": name, "summary": summary}
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, self.path)
+            _fsync_folder(self.path.parent)
+
+    def compact(self):
+        """Rewrite the journal with one record per synopsis or chapter, dropping the edits."""
+        with self._lock:
+            self.rewrite(self.load_state())
+
+    def export(self, file_path: Union[str, Path] = None):
+        """Export the book in the JSON format of `create_writer_from_book_data`.
+
+        Args:
+            file_path (str): The path of the JSON file. If None, the book data is only returned.
+
+        Returns:
+            dict: The book data.
+        """
+        book_data = {}
+        for i, (name, human_message, ai_message) in enumerate(self.load_state()["pairs"]):
+            if name is None:
+                name = "synopsis" if i == 0 else f"item{i}"
+            book_data[name] = {"human_message": human_message, "ai_message": ai_message}
+        if file_path is not None:
+            with open(file_path, "w", encoding="utf-8") as f:
+                json.dump(book_data, f, ensure_ascii=False)
+        return book_data
+
+    def delete(self):
+        with self._lock:
+            self.path.unlink(missing_ok=True)
+
+
+def get_book_journal(book_id: str):
+    """Get the journal of a book, in `BOOKJIBE_JOURNAL_FOLDER`."""
+    return BookJournal(Path(journal_folder) / f"{book_id}.jsonl")
@@ -1,9 +1,146 @@
-from langchain_openai import ChatOpenAI
-from bookjibe.settings import openai_model
+"""Chat models used by bookjibe.
 
+The LLM libraries are only imported, and the default chat model `llm` only created,
+on first use, so that importing bookjibe is fast and does not need an API key.
+"""
+import threading
 
-def get_chatopenai(model: str = openai_model, temperature: float = 0.3):
-    return ChatOpenAI(model=model, temperature=temperature)
+from bookjibe.settings import (
+    fake_llm_latency,
+    fake_llm_output_tokens,
+    fake_llm_tokens_per_second,
+    llm_backend,
+    llm_cache,
+    openai_model,
+)
 
 
-llm = get_chatopenai()
+def _enable_response_cache():
+    from langchain_core.globals import set_llm_cache
+    from bookjibe.cache import get_response_cache
+
+    set_llm_cache(get_response_cache())
+
+
+def get_chatopenai(model: str = openai_model, temperature: float = 0.3, cache: bool = llm_cache):
+    """Create the chat model.
+
+    Its requests go through the rate limiter shared by the application, see `bookjibe.ratelimit`,
+    which also retries the rate-limited requests and the transient errors.
+    Its calls are accounted by the usage tracker of the application, see `bookjibe.usage`.
+
+    Args:
+        model (str): The name of the OpenAI model.
+        temperature (float): The sampling temperature.
+        cache (bool): Whether the responses are cached on disk, see `bookjibe.cache`.
+    """
+    from langchain_openai import ChatOpenAI
+    from bookjibe.ratelimit import rate_limited
+    from bookjibe.usage import get_usage_handler
+
+    if cache:
+        _enable_response_cache()
+    # The rate-limited requests and the transient errors are retried by the limiter, in coordination
+    # with the other requests, rather than by the SDK
+    return rate_limited(ChatOpenAI)(
+        model=model,
+        temperature=temperature,
+        cache=cache,
+        max_retries=0,
+        callbacks=[get_usage_handler()],
+    )
+
+
+def get_fake_chat_model(
+    latency: float = fake_llm_latency,
+    tokens_per_second: float = fake_llm_tokens_per_second,
+    output_tokens: int = fake_llm_output_tokens,
+    cache: bool = llm_cache,
+):
+    """Create the offline fake chat model, see `bookjibe.fake_llm`."""
+    from bookjibe.fake_llm import FakeChatOpenAI
+    from bookjibe.usage import get_usage_handler
+
+    if cache:
+        _enable_response_cache()
+    return FakeChatOpenAI(
+        latency=latency,
+        tokens_per_second=tokens_per_second,
+        output_tokens=output_tokens,
+        cache=cache,
+        callbacks=[get_usage_handler()],
+    )
+
+
+def get_llm(backend: str = llm_backend):
+    """Create the chat model of the given backend: "openai" or "fake"."""
+    if backend == "openai":
+        return get_chatopenai()
+    elif backend == "fake":
+        return get_fake_chat_model()
+    raise ValueError(f"Unknown LLM backend: {backend}")
+
+
+_default_llm = None
+_default_llm_lock = threading.Lock()
+
+
+def preload_llm_libraries():
+    """Import the LLM libraries now rather than on first use. No chat model is created.
+
+    The production server calls it before forking its worker processes, see `bookjibe.ui.wsgi`,
+    so that the workers share the imported modules instead of each importing them on its
+    first request.
+    """
+    import langchain.chains.question_answering  # noqa: F401
+    import langchain.memory  # noqa: F401
+    import langchain_openai  # noqa: F401
+
+    import bookjibe.cache  # noqa: F401
+    import bookjibe.fake_llm  # noqa: F401
+    import bookjibe.memory  # noqa: F401
+    import bookjibe.prompts  # noqa: F401
+    import bookjibe.ratelimit  # noqa: F401
+
+
+def get_default_llm():
+    """Get the chat model shared by the application, created on first use with `get_llm`."""
+    global _default_llm
+    if _default_llm is None:
+        with _default_llm_lock:
+            if _default_llm is None:
+                _default_llm = get_llm()
+    return _default_llm
+
+
+def __getattr__(name):
+    # `bookjibe.llm.llm` is the default chat model, created on first access
+    if name == "llm":
+        return get_default_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def generate_candidates(messages, n: int, chat_model=None):
+    """Ask the chat model for `n` completions of the same messages in a single request.
+
+    The prompt is only sent (and billed) once, whatever the number of completions.
+    Chat models that do not support the `n` parameter return fewer completions.
+
+    Args:
+        messages (list): The messages sent to the chat model.
+        n (int): The number of completions to generate.
+        chat_model (BaseChatModel): The chat model to use. Defaults to `llm`.
+
+    Returns:
+        list: The text of the completions.
+    """
+    chat_model = chat_model or get_default_llm()
+    result = chat_model.generate([messages], n=n)
+    return [generation.text for generation in result.generations[0]]
+
+
+async def agenerate_candidates(messages, n: int, chat_model=None):
+    """Like `generate_candidates`, without blocking while the chat model answers."""
+    chat_model = chat_model or get_default_llm()
+    result = await chat_model.agenerate([messages], n=n)
+    return [generation.text for generation in result.generations[0]]
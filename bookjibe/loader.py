@@ -0,0 +1,133 @@
+"""Streaming loader of the book files uploaded in the app.
+
+The uploaded file comes as a base64 data URL (the `contents` of a dcc.Upload). It is decoded
+chunk by chunk and parsed incrementally, so that only one synopsis or chapter is decoded at a
+time and the messages of the writer are built in a single pass, without holding the decoded
+file nor an intermediate dict of the whole book.
+
+Two formats are supported:
+    - JSON, as written by `bookjibe.journal.BookJournal.export` and read by
+      `bookjibe.writer.create_writer_from_book_data`:
+      {"synopsis": {"human_message": ..., "ai_message": ...}, "chapter1": {...}, ...}
+    - CSV, with a header and one row per synopsis or chapter: name,human_message,ai_message
+"""
+import base64
+import codecs
+import csv
+import json
+from typing import Iterable, Iterator, Tuple
+
+# Number of base64 characters decoded at a time, a multiple of 4
+CHUNK_SIZE = 256 * 1024
+
+
+def iter_data_url_text(contents: str, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Decode the base64 payload of a data URL as UTF-8 text, chunk by chunk."""
+    start = contents.index(",") + 1
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for i in range(start, len(contents), chunk_size):
+        yield decoder.decode(base64.b64decode(contents[i : i + chunk_size]))
+    yield decoder.decode(b"", final=True)
+
+
+def iter_json_book_items(chunks: Iterable[str]) -> Iterator[Tuple[str, str, str]]:
+    """Parse a JSON book from text chunks, yielding its (name, human message, AI message) items in order."""
+    chunks = iter(chunks)
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+
+    def read_more():
+        nonlocal buffer, position
+        for chunk in chunks:
+            if chunk:
+                buffer = buffer[position:] + chunk
+                position = 0
+                return True
+        return False
+
+    def next_char():
+        # Skip the whitespaces and return the next character, without consuming it
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not read_more():
+                raise ValueError("Unexpected end of the JSON book")
+
+    def decode_value():
+        nonlocal position
+        while True:
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+                return value
+            except json.JSONDecodeError:
+                # The value may be cut by the end of the buffer
+                if not read_more():
+                    raise
+
+    if next_char() != "{":
+        raise ValueError("A JSON book must be an object")
+    position += 1
+    if next_char() == "}":
+        return
+    while True:
+        name = decode_value()
+        if next_char() != ":":
+            raise ValueError(f"Expected ':' after the name {name!r}")
+        position += 1
+        next_char()
+        item = decode_value()
+        yield name, item["human_message"], item["ai_message"]
+        separator = next_char()
+        position += 1
+        if separator == "}":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or '}}' after the item {name!r}")
+        next_char()
+
+
+def _iter_lines(chunks: Iterable[str]) -> Iterator[str]:
+    rest = ""
+    for chunk in chunks:
+        lines = (rest + chunk).splitlines(keepends=True)
+        rest = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        yield from lines
+    if rest:
+        yield rest
+
+
+def iter_csv_book_items(chunks: Iterable[str]) -> Iterator[Tuple[str, str, str]]:
+    """Parse a CSV book from text chunks, yielding its (name, human message, AI message) rows in order."""
+    reader = csv.DictReader(_iter_lines(chunks))
+    for row in reader:
+        yield row["name"] or None, row["human_message"], row["ai_message"]
+
+
+def iter_uploaded_book_items(contents: str, filename: str):
+    """Parse an uploaded book file (JSON or CSV), see `iter_json_book_items` and `iter_csv_book_items`."""
+    chunks = iter_data_url_text(contents)
+    if "json" in filename:
+        return iter_json_book_items(chunks)
+    elif "csv" in filename:
+        return iter_csv_book_items(chunks)
+    raise ValueError(f"Unsupported book file: {filename}")
+
+
+def load_writer_from_upload(contents: str, filename: str):
+    """Create a writer from an uploaded book file, in a single pass over the file.
+
+    Returns:
+        Writer: The writer of the book, or None if the file could not be parsed.
+    """
+    from bookjibe.writer import Writer
+
+    try:
+        pairs = iter_uploaded_book_items(contents, filename)
+        return Writer.from_state({"metadata": {}, "pairs": pairs})
+    except Exception as e:
+        print(e)
+        return None
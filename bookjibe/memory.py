@@ -0,0 +1,125 @@
+from typing import Dict, List, Optional
+
+from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import AIMessage, BaseMessage
+
+from bookjibe.settings import openai_model
+from bookjibe.tokens import count_message_tokens
+
+MEMORY_STRATEGIES = ("buffer", "window", "summary")
+
+
+class BookMemory(ConversationBufferMemory):
+    """Memory of a book that bounds the history sent to the LLM.
+
+    The messages of the book are all kept in `chat_memory`, but only part of them
+    is given to the prompt, depending on the strategy:
+        - "buffer": all the messages,
+        - "window": the synopsis and the last `window_chapters` chapters,
+        - "summary": like "window", with the older chapters replaced by their summaries.
+
+    The first human/AI message pair is the synopsis, it is kept when `pin_synopsis` is True.
+    If `max_tokens` or `context_tokens` is set, the oldest chapters are replaced by their summaries,
+    when they have one, or dropped (with the oldest summaries), until the history fits.
+
+    With `stable_prefix`, the start of the history only moves by whole windows of `window_chapters`
+    chapters, so that the beginning of the prompt stays byte-identical from one chapter to the next
+    and is served from the prompt cache of the provider. The history then holds between
+    `window_chapters` and `2 * window_chapters - 1` recent chapters.
+    """
+
+    memory_key: str = "chat_history"
+    input_key: Optional[str] = "input"
+    return_messages: bool = True
+    strategy: str = "buffer"
+    window_chapters: int = 3
+    pin_synopsis: bool = True
+    max_tokens: Optional[int] = None
+    summaries: Dict[str, str] = {}
+    stable_prefix: bool = False
+    # The tokens left for the history in the context window of the model, and the model counting
+    # them. They are only set on the copy of the memory used for one call, see
+    # `bookjibe.writer.Writer._fit_context`
+    context_tokens: Optional[int] = None
+    model: Optional[str] = None
+
+    def _split_chapters(self):
+        # The pinned synopsis, and the recent and the older chapters, as human/AI message pairs
+        if self.strategy not in MEMORY_STRATEGIES:
+            raise ValueError(f"Unknown memory strategy: {self.strategy}")
+        messages = self.chat_memory.messages
+        pinned = []
+        if self.pin_synopsis and len(messages) >= 2:
+            pinned = list(messages[:2])
+            messages = messages[2:]
+        chapters = [list(messages[i : i + 2]) for i in range(0, len(messages), 2)]
+        if self.strategy == "buffer":
+            return pinned, chapters, []
+        if self.window_chapters > 0:
+            start = max(0, len(chapters) - self.window_chapters)
+            if self.stable_prefix:
+                start -= start % self.window_chapters
+            return pinned, chapters[start:], chapters[:start]
+        return pinned, [], chapters
+
+    def missing_summaries(self) -> List[str]:
+        """Get the names of the chapters replaced by their summaries in the history that have none yet."""
+        if self.strategy != "summary":
+            return []
+        _, _, older = self._split_chapters()
+        names = [chapter[-1].name for chapter in older]
+        return [name for name in names if name and name not in self.summaries]
+
+    def history_messages(
+        self, context_tokens: Optional[int] = None, model: Optional[str] = None
+    ) -> List[BaseMessage]:
+        """Get the messages of the history given to the prompt.
+
+        Args:
+            context_tokens (int): The tokens left for the history in the context window of the
+                model. Defaults to `context_tokens`.
+            model (str): The model whose tokenizer counts the tokens. Defaults to `model`, or
+                to `OPENAI_MODEL`.
+        """
+        if context_tokens is None:
+            context_tokens = self.context_tokens
+        model = model or self.model or openai_model
+        limits = [limit for limit in (self.max_tokens, context_tokens) if limit is not None]
+        max_tokens = min(limits) if limits else None
+        if self.strategy == "buffer" and max_tokens is None:
+            return list(self.chat_memory.messages)
+        pinned, recent, older = self._split_chapters()
+
+        blocks = []
+        if self.strategy == "summary":
+            for chapter in older:
+                name = chapter[-1].name
+                if name in self.summaries:
+                    blocks.append([AIMessage(name=name, content=self.summaries[name])])
+        blocks += recent
+
+        if max_tokens is not None:
+            # Keep the most recent blocks that fit, counting them from the last one
+            available = max_tokens - count_message_tokens(pinned, model)
+            kept = []
+            summarizing = False
+            for block in reversed(blocks):
+                name = block[-1].name
+                if len(block) == 2 and name in self.summaries:
+                    if summarizing or count_message_tokens(block, model) > available:
+                        summarizing = True
+                        block = [AIMessage(name=name, content=self.summaries[name])]
+                tokens = count_message_tokens(block, model)
+                if tokens > available:
+                    break
+                kept.append(block)
+                available -= tokens
+            dropped = len(blocks) - len(kept)
+            blocks = kept[::-1]
+            if self.stable_prefix and self.window_chapters > 0:
+                # Drop whole windows, so that the history starts at the same place for a while
+                blocks = blocks[-dropped % self.window_chapters :]
+        return pinned + [message for block in blocks for message in block]
+
+    def load_memory_variables(self, inputs: Dict[str, object]) -> Dict[str, object]:
+        return {self.memory_key: self.history_messages()}
@@ -0,0 +1,231 @@
+"""Library of the prompt files: the initial prompts of the books (`BOOKJIBE_PROMPT_FOLDER`) and
+the prompt generators (`BOOKJIBE_PROMPT_GENERATOR_FOLDER`).
+
+The files of a folder are indexed once, with their contents read in memory and kept with their
+modification time and size, so that looking up a prompt does not touch the disk. A watcher thread
+keeps the index up to date, so that the prompt files added, changed or removed are seen without a
+restart: on Linux it waits for the inotify events of the folder, elsewhere it rescans the folder
+every `BOOKJIBE_PROMPT_POLL_INTERVAL` seconds. A rescan only reads the new and the changed files.
+`BOOKJIBE_PROMPT_WATCHER` is "auto" (the default), "inotify", "poll" or "off".
+"""
+import ctypes
+import os
+import select
+import threading
+import time
+from pathlib import Path
+from typing import List, Union
+
+from bookjibe.settings import (
+    init_prompt_folder,
+    prompt_generator_folder,
+    prompt_poll_interval,
+    prompt_watcher,
+)
+
+# The inotify events of a folder that change its files
+_IN_ATTRIB = 0x004
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_FROM = 0x040
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_INOTIFY_MASK = (
+    _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+)
+
+
+def _open_inotify(folder: Path):
+    """Watch a folder with inotify. Return the file descriptor of its events, or None if inotify is not available."""
+    try:
+        # The symbols of the C library loaded by Python
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(folder), _INOTIFY_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class PromptLibrary:
+    """Index of the prompt files of a folder, see the module documentation.
+
+    Args:
+        folder (str): The folder of the prompt files.
+        watcher (str): How the folder is watched: "auto" (inotify if available, else polling),
+            "inotify", "poll" or "off" (the index is only updated by `refresh`).
+        poll_interval (float): The number of seconds between two rescans when the folder is polled.
+    """
+
+    def __init__(
+        self, folder: Union[str, Path], watcher: str = "auto", poll_interval: float = 2.0
+    ):
+        self.folder = Path(folder)
+        self.watcher = watcher
+        self.poll_interval = poll_interval
+        # File name -> (modification time in ns, size, content)
+        self._files = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._watcher_pid = None
+        self._inotify_fd = None
+        if hasattr(os, "register_at_fork"):
+            # The lock may be held by the watcher thread of the parent, which is not forked
+            os.register_at_fork(after_in_child=self._after_fork)
+        self.refresh()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        if self._inotify_fd is not None:
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+
+    def refresh(self):
+        """Rescan the folder and read its new and changed files.
+
+        Returns:
+            bool: Whether the index changed.
+        """
+        with self._lock:
+            previous_files = self._files
+        files = {}
+        try:
+            entries = list(os.scandir(self.folder))
+        except FileNotFoundError:
+            entries = []
+        changed = False
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            cached = previous_files.get(entry.name)
+            if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                files[entry.name] = cached
+                continue
+            try:
+                with open(entry.path, "r") as f:
+                    content = f.read()
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"The prompt file {entry.path} could not be read: {e!r}")
+                continue
+            files[entry.name] = (stat.st_mtime_ns, stat.st_size, content)
+            changed = True
+        changed = changed or files.keys() != previous_files.keys()
+        with self._lock:
+            self._files = files
+        return changed
+
+    def names(self, suffix: str = "") -> List[str]:
+        """List the names of the prompt files, sorted, optionally only those ending with `suffix`."""
+        self._ensure_watching()
+        with self._lock:
+            return sorted(name for name in self._files if name.endswith(suffix))
+
+    def get(self, name: str) -> str:
+        """Get the content of a prompt file from its name in the folder.
+
+        Raises:
+            FileNotFoundError: If the folder has no such file.
+        """
+        self._ensure_watching()
+        with self._lock:
+            entry = self._files.get(name)
+        if entry is None:
+            # The file may have been created since the last rescan
+            self.refresh()
+            with self._lock:
+                entry = self._files.get(name)
+        if entry is None:
+            raise FileNotFoundError(self.folder / name)
+        return entry[2]
+
+    def _ensure_watching(self):
+        # The watcher is started on first use in each process, e.g. in each worker forked from
+        # the master process of the server, since the threads are not forked
+        pid = os.getpid()
+        if self.watcher == "off" or self._watcher_pid == pid or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._watcher_pid == pid:
+                return
+            self._watcher_pid = pid
+        fd = _open_inotify(self.folder) if self.watcher in ("auto", "inotify") else None
+        self._inotify_fd = fd
+        if fd is None and self.watcher == "inotify":
+            print(f"inotify is not available, {self.folder} is polled.")
+        threading.Thread(
+            target=self._watch, args=(fd,), name="bookjibe-prompt-watcher", daemon=True
+        ).start()
+
+    def _watch(self, fd):
+        # The files may have changed since they were indexed, e.g. before a fork
+        self.refresh()
+        try:
+            while not self._stopped.is_set():
+                if fd is None:
+                    if self._stopped.wait(self.poll_interval):
+                        break
+                else:
+                    readable, _, _ = select.select([fd], [], [], 1.0)
+                    if not readable:
+                        continue
+                    # Coalesce the events of a file being written
+                    time.sleep(0.05)
+                    try:
+                        while os.read(fd, 65536):
+                            pass
+                    except BlockingIOError:
+                        pass
+                self.refresh()
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def stop_watching(self):
+        """Stop the watcher thread. The index is then only updated by `refresh`."""
+        self._stopped.set()
+
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+
+def get_prompt_library(folder: Union[str, Path]) -> PromptLibrary:
+    """Get the library of a prompt folder, created on first use."""
+    key = os.path.abspath(folder)
+    library = _libraries.get(key)
+    if library is None:
+        with _libraries_lock:
+            library = _libraries.get(key)
+            if library is None:
+                library = _libraries[key] = PromptLibrary(
+                    key, watcher=prompt_watcher, poll_interval=prompt_poll_interval
+                )
+    return library
+
+
+def get_init_prompt_library() -> PromptLibrary:
+    """Get the library of the initial prompts of the books, in `BOOKJIBE_PROMPT_FOLDER`."""
+    return get_prompt_library(init_prompt_folder)
+
+
+def get_prompt_generator_library() -> PromptLibrary:
+    """Get the library of the prompt generators, in `BOOKJIBE_PROMPT_GENERATOR_FOLDER`."""
+    return get_prompt_library(prompt_generator_folder)
+
+
+def read_prompt_file(file_path: Union[str, Path]) -> str:
+    """Read a prompt file.
+
+    The files of the prompt folders are read from their library, the other files from the disk.
+    """
+    folder, name = os.path.split(os.path.abspath(file_path))
+    for prompt_folder in (init_prompt_folder, prompt_generator_folder):
+        if prompt_folder and os.path.abspath(prompt_folder) == folder:
+            return get_prompt_library(prompt_folder).get(name)
+    with open(file_path, "r") as f:
+        return f.read()
@@ -0,0 +1,118 @@
+"""Registry of the prompt templates of the LangChain hub.
+
+A copy of each template is bundled on disk in `bookjibe/prompt_templates`, so that no network
+round-trip is needed to use it, and the loaded templates are memoized in-process.
+The bundled copies are read-only. The templates are refreshed from the hub with:
+
+    python -m bookjibe.prompts refresh [template ...]
+
+which saves them in `BOOKJIBE_PROMPT_TEMPLATE_FOLDER` (by default `~/.cache/bookjibe/prompt_templates`),
+where they are looked up before the bundled copies.
+"""
+import argparse
+import json
+import threading
+import warnings
+from pathlib import Path
+
+from langchain_core._api import LangChainBetaWarning
+from langchain_core.load import dumpd, load
+
+from bookjibe.settings import prompt_template_folder
+
+DEFAULT_PROMPT_TEMPLATE = "hwchase17/openai-functions-agent"
+bundled_prompt_folder = Path(__file__).parent / "prompt_templates"
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def _template_file_name(name):
+    return f"{name.replace('/', '__')}.json"
+
+
+def get_template_path(name: str) -> Path:
+    """Get the path of the copy of a hub template, e.g. "hwchase17/openai-functions-agent".
+
+    The refreshed copy is used if there is one, else the bundled copy.
+    """
+    path = Path(prompt_template_folder) / _template_file_name(name)
+    if path.exists():
+        return path
+    return bundled_prompt_folder / _template_file_name(name)
+
+
+def _copy_template(template):
+    # The callers modify the list of messages and the input variables of the template they get,
+    # the message templates themselves are shared.
+    return template.copy(
+        update={
+            "messages": list(template.messages),
+            "input_variables": list(template.input_variables),
+        }
+    )
+
+
+def get_prompt_template(name: str = DEFAULT_PROMPT_TEMPLATE):
+    """Get a copy of a hub template.
+
+    The template is loaded from its refreshed or bundled copy the first time, or pulled from
+    the hub if it has no copy.
+
+    Args:
+        name (str): The name of the template on the hub.
+
+    Returns:
+        ChatPromptTemplate: A copy of the template, that can be modified by the caller.
+    """
+    template = _templates.get(name)
+    if template is None:
+        with _templates_lock:
+            template = _templates.get(name)
+            if template is None:
+                path = get_template_path(name)
+                if path.exists():
+                    with open(path, "r") as f, warnings.catch_warnings():
+                        warnings.simplefilter("ignore", LangChainBetaWarning)
+                        template = load(json.load(f))
+                else:
+                    template = _pull_template(name)
+                _templates[name] = template
+    return _copy_template(template)
+
+
+def _pull_template(name):
+    from langchain import hub
+
+    template = hub.pull(name)
+    path = Path(prompt_template_folder) / _template_file_name(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(dumpd(template), f, indent=2)
+        f.write("\n")
+    return template
+
+
+def refresh_prompt_template(name: str = DEFAULT_PROMPT_TEMPLATE):
+    """Pull a template from the hub, save it in the refreshed templates and update the in-process cache."""
+    template = _pull_template(name)
+    with _templates_lock:
+        _templates[name] = template
+    return _copy_template(template)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bookjibe.prompts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = subparsers.add_parser(
+        "refresh", help="Pull the templates from the hub and save them in the refreshed templates."
+    )
+    refresh_parser.add_argument("templates", nargs="*", default=[DEFAULT_PROMPT_TEMPLATE])
+    args = parser.parse_args(argv)
+    for name in args.templates:
+        refresh_prompt_template(name)
+        print(f"Refreshed {name} in {get_template_path(name)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+"""Client-side rate limiting of the LLM requests.
+
+All the chat models created by `bookjibe.llm.get_chatopenai` share one `RateLimiter`.
+Before each request, the limiter waits for:
+    - a concurrency slot: the number of requests in flight is adapted (AIMD), halved when the
+      API answers 429 and increased after each success, up to `max_concurrency`,
+    - the requests/min and tokens/min token buckets, the tokens being estimated from the
+      rendered prompt and the expected size of the answer, then corrected with the usage
+      reported by the API.
+The rate-limited requests are retried with an exponential backoff, honoring the Retry-After
+header, so that the throughput stays near the quota without storms of errors. The transient
+errors (connection errors, timeouts, 408, 409 and 5xx responses) are retried with the same
+backoff, without reducing the concurrency.
+
+When the app is served by several processes (`BOOKJIBE_WEB_WORKERS`), each one has its own
+limiter with an equal share of the quotas. The processes of `bookjibe batch --executor process`
+are not accounted: each of them has its own limiter with the full quotas.
+"""
+import asyncio
+import random
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+
+from bookjibe.settings import (
+    llm_expected_output_tokens,
+    llm_max_concurrency,
+    llm_max_retries,
+    openai_requests_per_minute,
+    openai_tokens_per_minute,
+    web_workers,
+)
+from bookjibe.tokens import count_message_tokens
+
+
+class RateLimitError(Exception):
+    """Raised when a request is still rate limited after all the retries."""
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `per_minute` tokens per minute.
+
+    Args:
+        per_minute (float): The capacity of the bucket and its refill rate. 0 for no limit.
+    """
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(
+            self.per_minute, self.level + (now - self._updated) * self.per_minute / 60
+        )
+        self._updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Get the number of seconds before `amount` tokens are available."""
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.per_minute)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.per_minute
+
+    def take(self, amount: float, now: float):
+        if self.per_minute:
+            self._refill(now)
+            self.level -= amount
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether a request failed with an error that may not happen again, as retried by the OpenAI SDK."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in (408, 409) or status_code >= 500
+    # The OpenAI errors can only be raised once the SDK is imported
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(error, openai.APIConnectionError)
+
+
+def get_retry_after(error: Exception):
+    """Get the Retry-After delay, in seconds, of a rate-limited response, or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1)):
+        try:
+            return float(headers[header]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+class RateLimiter:
+    """Shared limiter of the LLM requests, see the module documentation.
+
+    Args:
+        requests_per_minute (float): The requests quota, 0 for no limit.
+        tokens_per_minute (float): The tokens quota, 0 for no limit.
+        max_concurrency (int): The maximum number of requests in flight.
+        max_retries (int): The number of retries of a rate-limited request, or of a request
+            that failed with a transient error.
+        backoff (float): The delay before the first retry, in seconds, doubled at each retry.
+
+    The limiter is used from threads (`call`, `limit`) and from event loops (`acall`, `alimit`).
+    """
+
+    # Seconds between two checks for a free slot from an event loop
+    poll_interval = 0.05
+
+    def __init__(
+        self,
+        requests_per_minute: float = openai_requests_per_minute,
+        tokens_per_minute: float = openai_tokens_per_minute,
+        max_concurrency: int = llm_max_concurrency,
+        max_retries: int = llm_max_retries,
+        backoff: float = 1.0,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+        self._metrics = {
+            "requests": 0,
+            "successes": 0,
+            "rate_limited": 0,
+            "retries": 0,
+            "failures": 0,
+            "estimated_tokens": 0,
+            "used_tokens": 0,
+            "wait_seconds": 0.0,
+        }
+
+    def _try_acquire(self, tokens: int, start: float):
+        # Take a slot and the quotas if they are available and return None,
+        # else return the delay before the quotas are available (0 to wait for a slot)
+        now = time.monotonic()
+        delay = max(
+            self._paused_until - now,
+            self.requests.delay(1, now),
+            self.tokens.delay(tokens, now),
+        )
+        if self.in_flight >= int(self.concurrency) or delay > 0:
+            return max(delay, 0.0)
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+        self.in_flight += 1
+        self._metrics["requests"] += 1
+        self._metrics["estimated_tokens"] += tokens
+        self._metrics["wait_seconds"] += now - start
+        return None
+
+    def acquire(self, tokens: int):
+        """Wait for a concurrency slot and for the quotas, then take them."""
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                delay = self._try_acquire(tokens, start)
+                if delay is None:
+                    return
+                self._condition.wait(timeout=delay or None)
+
+    async def aacquire(self, tokens: int):
+        """Like `acquire`, without blocking the event loop."""
+        start = time.monotonic()
+        while True:
+            with self._condition:
+                delay = self._try_acquire(tokens, start)
+            if delay is None:
+                return
+            await asyncio.sleep(delay or self.poll_interval)
+
+    def release(self, estimated_tokens: int, used_tokens: int = None):
+        """Free the slot of a successful request, and ramp up the concurrency."""
+        with self._condition:
+            self.in_flight -= 1
+            self.concurrency = min(
+                self.max_concurrency, self.concurrency + 1 / self.concurrency
+            )
+            self._metrics["successes"] += 1
+            if used_tokens is not None:
+                # Correct the estimation with the tokens actually billed
+                self.tokens.take(used_tokens - estimated_tokens, time.monotonic())
+                self._metrics["used_tokens"] += used_tokens
+            self._condition.notify_all()
+
+    def release_failed(self, rate_limited: bool = False, retry_after: float = None):
+        """Free the slot of a failed request. A rate limit halves the concurrency and pauses the requests."""
+        with self._condition:
+            self.in_flight -= 1
+            if rate_limited:
+                self._metrics["rate_limited"] += 1
+                self.concurrency = max(1.0, self.concurrency / 2)
+                if retry_after:
+                    self._paused_until = max(
+                        self._paused_until, time.monotonic() + retry_after
+                    )
+            else:
+                self._metrics["failures"] += 1
+            self._condition.notify_all()
+
+    def _retry_delay(self, attempt: int, error: Exception):
+        # The delay before retrying a request, None if it can not be retried
+        rate_limited = is_rate_limit_error(error)
+        if not rate_limited and not is_transient_error(error):
+            return None
+        if attempt >= self.max_retries:
+            if rate_limited:
+                raise RateLimitError(
+                    f"Still rate limited after {self.max_retries} retries"
+                ) from error
+            return None
+        with self._condition:
+            self._metrics["retries"] += 1
+        retry_after = get_retry_after(error)
+        if retry_after is None:
+            # Exponential backoff with jitter, so that the retries are spread
+            retry_after = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+        return retry_after
+
+    def retry(self, attempt: int, error: Exception) -> bool:
+        """Wait before retrying a request that failed with `error` at the attempt number `attempt`.
+
+        Returns:
+            bool: False if the request can not be retried: it was neither rate limited nor failed
+                with a transient error, or it failed with a transient error `max_retries` times.
+
+        Raises:
+            RateLimitError: If the request was rate limited `max_retries` times.
+        """
+        delay = self._retry_delay(attempt, error)
+        if delay is None:
+            return False
+        time.sleep(delay)
+        return True
+
+    async def aretry(self, attempt: int, error: Exception) -> bool:
+        """Like `retry`, without blocking the event loop."""
+        delay = self._retry_delay(attempt, error)
+        if delay is None:
+            return False
+        await asyncio.sleep(delay)
+        return True
+
+    @contextmanager
+    def limit(self, tokens: int):
+        """Hold a slot for a request of `tokens` estimated tokens, see `call`."""
+        self.acquire(tokens)
+        usage = {}
+        try:
+            yield usage
+        except Exception as e:
+            self.release_failed(is_rate_limit_error(e), get_retry_after(e))
+            raise
+        except BaseException:
+            # e.g. a stream closed before its end
+            self.release(tokens)
+            raise
+        else:
+            self.release(tokens, usage.get("total_tokens"))
+
+    @asynccontextmanager
+    async def alimit(self, tokens: int):
+        """Like `limit`, without blocking the event loop."""
+        await self.aacquire(tokens)
+        usage = {}
+        try:
+            yield usage
+        except Exception as e:
+            self.release_failed(is_rate_limit_error(e), get_retry_after(e))
+            raise
+        except BaseException:
+            # e.g. a cancelled task
+            self.release(tokens)
+            raise
+        else:
+            self.release(tokens, usage.get("total_tokens"))
+
+    def call(self, function, tokens: int):
+        """Call `function` within the limits, retrying it while it is rate limited or fails with a transient error.
+
+        `function` is called with a dict where it can store the "total_tokens" used.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.limit(tokens) as usage:
+                    return function(usage)
+            except Exception as e:
+                if not self.retry(attempt, e):
+                    raise
+
+    async def acall(self, function, tokens: int):
+        """Like `call`, for a coroutine function."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.alimit(tokens) as usage:
+                    return await function(usage)
+            except Exception as e:
+                if not await self.aretry(attempt, e):
+                    raise
+
+    def metrics(self):
+        """Get the counters of the limiter, its current concurrency and requests in flight."""
+        with self._condition:
+            return {
+                **self._metrics,
+                "concurrency": self.concurrency,
+                "in_flight": self.in_flight,
+                "requests_per_minute": self.requests.per_minute,
+                "tokens_per_minute": self.tokens.per_minute,
+            }
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        metrics = self.metrics()
+        lines = []
+        for metric, kind, description in [
+            ("requests", "counter", "Number of LLM requests sent."),
+            ("successes", "counter", "Number of LLM requests that succeeded."),
+            ("rate_limited", "counter", "Number of LLM requests rate limited by the API."),
+            ("retries", "counter", "Number of LLM requests retried."),
+            ("failures", "counter", "Number of LLM requests that failed, rate limits excluded."),
+            ("estimated_tokens", "counter", "Number of tokens estimated before the requests."),
+            ("used_tokens", "counter", "Number of tokens reported by the API."),
+            ("wait_seconds", "counter", "Time spent waiting for the limits, in seconds."),
+            ("concurrency", "gauge", "Current maximum number of requests in flight."),
+            ("in_flight", "gauge", "Number of requests in flight."),
+            ("requests_per_minute", "gauge", "Requests quota of this process."),
+            ("tokens_per_minute", "gauge", "Tokens quota of this process."),
+        ]:
+            name = f"bookjibe_ratelimit_{metric}"
+            if kind == "counter":
+                name += "_total"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {metrics[metric]}")
+        return "\n".join(lines) + "\n"
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Get the rate limiter shared by the chat models of the application."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(
+                requests_per_minute=openai_requests_per_minute / web_workers,
+                tokens_per_minute=openai_tokens_per_minute / web_workers,
+                max_concurrency=max(1, llm_max_concurrency // web_workers),
+            )
+        return _rate_limiter
+
+
+class RateLimitedChatModel:
+    """Mixin routing the requests of a LangChain chat model through the shared `RateLimiter`.
+
+    The cached responses are returned before `_generate` is called, so they do not count
+    against the quotas.
+    """
+
+    def _estimate_tokens(self, messages, kwargs):
+        output_tokens = kwargs.get("max_tokens") or getattr(self, "max_tokens", None)
+        output_tokens = output_tokens or llm_expected_output_tokens
+        return count_message_tokens(messages) + output_tokens * kwargs.get("n", 1)
+
+    @staticmethod
+    def _record_usage(result, usage):
+        token_usage = (result.llm_output or {}).get("token_usage") or {}
+        if "total_tokens" in token_usage:
+            usage["total_tokens"] = token_usage["total_tokens"]
+        return result
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        generate = super(RateLimitedChatModel, self)._generate
+
+        def request(usage):
+            result = generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return self._record_usage(result, usage)
+
+        return get_rate_limiter().call(request, self._estimate_tokens(messages, kwargs))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        agenerate = super(RateLimitedChatModel, self)._agenerate
+
+        async def request(usage):
+            result = await agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return self._record_usage(result, usage)
+
+        return await get_rate_limiter().acall(
+            request, self._estimate_tokens(messages, kwargs)
+        )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        limiter = get_rate_limiter()
+        tokens = self._estimate_tokens(messages, kwargs)
+        stream = super(RateLimitedChatModel, self)._stream
+        started = False
+        for attempt in range(limiter.max_retries + 1):
+            try:
+                with limiter.limit(tokens):
+                    # The request is sent, and may be rate limited, on the first chunk
+                    for chunk in stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                        started = True
+                        yield chunk
+                return
+            except Exception as e:
+                if started or not limiter.retry(attempt, e):
+                    raise
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        limiter = get_rate_limiter()
+        tokens = self._estimate_tokens(messages, kwargs)
+        astream = super(RateLimitedChatModel, self)._astream
+        started = False
+        for attempt in range(limiter.max_retries + 1):
+            try:
+                async with limiter.alimit(tokens):
+                    async for chunk in astream(
+                        messages, stop=stop, run_manager=run_manager, **kwargs
+                    ):
+                        started = True
+                        yield chunk
+                return
+            except Exception as e:
+                if started or not await limiter.aretry(attempt, e):
+                    raise
+
+
+@lru_cache(maxsize=None)
+def rate_limited(chat_model_class):
+    """Get the subclass of a chat model class whose requests go through the shared `RateLimiter`."""
+    return type(
+        f"RateLimited{chat_model_class.__name__}",
+        (RateLimitedChatModel, chat_model_class),
+        {"__module__": __name__},
+    )
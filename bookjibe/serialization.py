@@ -0,0 +1,120 @@
+"""Compact, versioned binary format for the state of a book.
+
+A book state is a dict with:
+    - "metadata": a JSON-serializable dict,
+    - "pairs": the ordered list of (name, human message, AI message) tuples of the book,
+      the name being e.g. "synopsis", "chapter1" or None.
+
+Layout of the payload:
+    - header: the magic bytes b"BJB", the format version (1 byte), the compression (1 byte),
+    - body (compressed or not): the metadata as a JSON string, the number of pairs (uint32),
+      then for each pair its name, human message and AI message.
+
+Each string is stored as UTF-8 prefixed by its length (uint32, little-endian).
+A `None` name is stored with the length 0xFFFFFFFF.
+"""
+import json
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"BJB"
+FORMAT_VERSION = 1
+COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+
+_header = struct.Struct("<3sBB")
+_length = struct.Struct("<I")
+_none_length = 0xFFFFFFFF
+
+
+def _compress(body: bytes, compression: str) -> bytes:
+    if compression == "none":
+        return body
+    elif compression == "zlib":
+        return zlib.compress(body, 1)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def _decompress(body: bytes, compression_code: int) -> bytes:
+    if compression_code == COMPRESSIONS["none"]:
+        return body
+    elif compression_code == COMPRESSIONS["zlib"]:
+        return zlib.decompress(body)
+    elif compression_code == COMPRESSIONS["zstd"]:
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(body)
+    raise ValueError(f"Unknown compression code: {compression_code}")
+
+
+def dump_book_state(state: dict, compression: str = "none") -> bytes:
+    """Encode a book state.
+
+    Args:
+        state (dict): The book state, as returned by `Writer.to_state`.
+        compression (str): "none" (the default, the fastest to dump and load), "zlib" or "zstd".
+
+    Returns:
+        bytes: The encoded book state.
+    """
+    parts = []
+
+    def add_string(value):
+        if value is None:
+            parts.append(_length.pack(_none_length))
+        else:
+            encoded = value.encode("utf-8")
+            parts.append(_length.pack(len(encoded)))
+            parts.append(encoded)
+
+    add_string(json.dumps(state.get("metadata", {}), separators=(",", ":")))
+    parts.append(_length.pack(len(state["pairs"])))
+    for name, human_message, ai_message in state["pairs"]:
+        add_string(name)
+        add_string(human_message)
+        add_string(ai_message)
+    body = _compress(b"".join(parts), compression)
+    return _header.pack(MAGIC, FORMAT_VERSION, COMPRESSIONS[compression]) + body
+
+
+def load_book_state(data: bytes) -> dict:
+    """Decode a book state encoded with `dump_book_state`.
+
+    Raises:
+        ValueError: If the data is not a book state or has an unsupported version.
+    """
+    if len(data) < _header.size:
+        raise ValueError("Not a bookjibe book state")
+    magic, version, compression_code = _header.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a bookjibe book state")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported book state version: {version}")
+    body = memoryview(_decompress(data[_header.size :], compression_code))
+    offset = 0
+
+    def read_string():
+        nonlocal offset
+        (length,) = _length.unpack_from(body, offset)
+        offset += _length.size
+        if length == _none_length:
+            return None
+        value = str(body[offset : offset + length], "utf-8")
+        offset += length
+        return value
+
+    metadata = json.loads(read_string())
+    (number_of_pairs,) = _length.unpack_from(body, offset)
+    offset += _length.size
+    pairs = [
+        (read_string(), read_string(), read_string()) for _ in range(number_of_pairs)
+    ]
+    return {"metadata": metadata, "pairs": pairs}
@@ -1,4 +1,3 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
 import locale
@@ -6,10 +5,57 @@ import locale
 load_dotenv()
 
 openai_model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+llm_backend = os.getenv("BOOKJIBE_LLM_BACKEND", "openai")
+fake_llm_latency = float(os.getenv("BOOKJIBE_FAKE_LLM_LATENCY", 0.5))
+fake_llm_tokens_per_second = float(os.getenv("BOOKJIBE_FAKE_LLM_TOKENS_PER_SECOND", 50))
+fake_llm_output_tokens = int(os.getenv("BOOKJIBE_FAKE_LLM_OUTPUT_TOKENS", 500))
 init_prompt_folder = os.getenv("BOOKJIBE_PROMPT_FOLDER")
 prompt_generator_folder = os.getenv("BOOKJIBE_PROMPT_GENERATOR_FOLDER")
 user_language = os.getenv("BOOKJIBE_USER_LANGUAGE")
 temporary_folder = os.getenv("BOOKJIBE_TEMPORARY_FOLDER", "/tmp/bookjibe")
+llm_cache = os.getenv("BOOKJIBE_LLM_CACHE", "1") == "1"
+llm_cache_max_mb = float(os.getenv("BOOKJIBE_LLM_CACHE_MAX_MB", 256))
+# The whole history is sent by default, "window" and "summary" bound it, see `bookjibe.memory.BookMemory`
+memory_strategy = os.getenv("BOOKJIBE_MEMORY_STRATEGY", "buffer")
+memory_window_chapters = int(os.getenv("BOOKJIBE_MEMORY_WINDOW_CHAPTERS", 3))
+# 0 for no limit
+memory_max_tokens = int(os.getenv("BOOKJIBE_MEMORY_MAX_TOKENS", 0)) or None
+# "stable" keeps the beginning of the prompts identical across chapters, see `bookjibe.memory.BookMemory`
+prompt_layout = os.getenv("BOOKJIBE_PROMPT_LAYOUT", "default")
+# The hub templates refreshed by `python -m bookjibe.prompts refresh`, used before the bundled ones
+prompt_template_folder = os.getenv("BOOKJIBE_PROMPT_TEMPLATE_FOLDER") or os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "bookjibe", "prompt_templates"
+)
+session_db = os.getenv("BOOKJIBE_SESSION_DB")
+session_ttl = float(os.getenv("BOOKJIBE_SESSION_TTL", 24 * 3600))
+session_max = int(os.getenv("BOOKJIBE_SESSION_MAX", 100))
+openai_requests_per_minute = float(os.getenv("BOOKJIBE_OPENAI_RPM", 500))
+openai_tokens_per_minute = float(os.getenv("BOOKJIBE_OPENAI_TPM", 200000))
+llm_max_concurrency = int(os.getenv("BOOKJIBE_LLM_MAX_CONCURRENCY", 8))
+llm_max_retries = int(os.getenv("BOOKJIBE_LLM_MAX_RETRIES", 6))
+llm_expected_output_tokens = int(os.getenv("BOOKJIBE_LLM_EXPECTED_OUTPUT_TOKENS", 500))
+job_workers = int(os.getenv("BOOKJIBE_JOB_WORKERS", 8))
+tokenizer = os.getenv("BOOKJIBE_TOKENIZER", "tiktoken")
+# The context window of the model in tokens, 0 to get it from the name of the model
+context_window = int(os.getenv("BOOKJIBE_CONTEXT_WINDOW", 0))
+context_output_tokens = int(os.getenv("BOOKJIBE_CONTEXT_OUTPUT_TOKENS", 1000))
+context_trim_policy = os.getenv("BOOKJIBE_CONTEXT_TRIM_POLICY", "drop")
+journal_folder = os.getenv("BOOKJIBE_JOURNAL_FOLDER", os.path.join(temporary_folder, "journals"))
+# How the prompt folders are watched for new prompt files, see `bookjibe.prompt_library`
+prompt_watcher = os.getenv("BOOKJIBE_PROMPT_WATCHER", "auto")
+prompt_poll_interval = float(os.getenv("BOOKJIBE_PROMPT_POLL_INTERVAL", 2))
+# Seconds between two refreshes of the lists of prompt files in the page
+prompt_refresh_interval = float(os.getenv("BOOKJIBE_PROMPT_REFRESH_INTERVAL", 5))
+# Processes and threads of the production server, see gunicorn.conf.py
+web_workers = int(os.getenv("BOOKJIBE_WEB_WORKERS", 1))
+web_threads = int(os.getenv("BOOKJIBE_WEB_THREADS", 8))
+web_bind = os.getenv("BOOKJIBE_WEB_BIND", "0.0.0.0:8050")
+# Seconds the browsers may cache the static files of the production server
+static_max_age = int(os.getenv("BOOKJIBE_STATIC_MAX_AGE", 3600))
+# The states of the jobs are shared by the processes of the server in this SQLite database
+job_db = os.getenv("BOOKJIBE_JOB_DB") or (
+    os.path.join(temporary_folder, "jobs.sqlite") if web_workers > 1 else None
+)
 
 user_language = locale.getdefaultlocale()[0]
 user_language_part = user_language.split("_")[0]
@@ -0,0 +1,67 @@
+"""Counting of the tokens of the prompts, and context windows of the models.
+
+The tokens are counted with tiktoken (`BOOKJIBE_TOKENIZER=tiktoken`, the default), with the
+encoding of the model loaded once. If tiktoken or its encoding is not available (e.g. offline,
+when the encoding was never downloaded), or with `BOOKJIBE_TOKENIZER=estimate`, the tokens are
+estimated at about 4 characters per token.
+"""
+import functools
+
+from bookjibe.settings import context_window, openai_model, tokenizer
+
+# Context windows of the OpenAI models in tokens, matched by the longest prefix of the model name
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-0613": 4096,
+    "gpt-3.5-turbo-instruct": 4096,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4o": 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 16385
+
+
+class ContextWindowError(ValueError):
+    """Raised when a prompt cannot fit in the context window of the model, even trimmed."""
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    if tokenizer != "tiktoken":
+        return None
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"The tiktoken encoding is not available, the tokens are estimated: {e!r}")
+        return None
+
+
+def count_tokens(text: str, model: str = openai_model) -> int:
+    """Count the tokens of a text for a model."""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, model: str = openai_model) -> int:
+    """Count the tokens of a list of messages, including a small overhead per message."""
+    return sum(count_tokens(message.content, model) + 4 for message in messages)
+
+
+def get_context_window(model: str = openai_model) -> int:
+    """Get the context window of a model in tokens, or `BOOKJIBE_CONTEXT_WINDOW` if set."""
+    if context_window:
+        return context_window
+    prefixes = [prefix for prefix in CONTEXT_WINDOWS if model.startswith(prefix)]
+    if not prefixes:
+        return DEFAULT_CONTEXT_WINDOW
+    return CONTEXT_WINDOWS[max(prefixes, key=len)]
@@ -4,6 +4,10 @@ from dash import html
 import dash_bootstrap_components as dbc
 from pathlib import Path
 from dotenv import load_dotenv
+from flask import Response, jsonify
+from bookjibe.settings import static_max_age
+from bookjibe.ratelimit import get_rate_limiter
+from bookjibe.usage import get_usage_tracker
 from bookjibe.ui.prompt_generator import (
     get_prompt_generator_components,
     build_prompt_generator_callbacks,
@@ -18,57 +22,107 @@ from bookjibe.ui.book_creator import (
     build_book_creator_callbacks,
 )
 
-app = dash.Dash(
-    __name__,
-    prevent_initial_callbacks=True,
-    external_stylesheets=[
-        "https://stackpath.bootstrapcdn.com/bootswatch/4.5.2/darkly/bootstrap.min.css"
-    ],
-)
-# app = dash.Dash(__name__, external_stylesheets=['https://stackpath.bootstrapcdn.com/bootswatch/4.5.2/litera/bootstrap.min.css'])
-
 dotenv_path = os.getenv("BOOKJIBE_CONFIG_FILE") or Path(".") / ".env"
 load_dotenv(dotenv_path)
-prompt_folder = os.getenv("BOOKJIBE_PROMPT_FOLDER")
-prompt_files = [
-    file for file in os.listdir(prompt_folder) if file.endswith("prompt.txt")
-]
 
 select_prompt_file_txt = "Select a prompt file to start the story"
 
 
-collapse_book_initializer = html.Div(
-    [
-        dbc.Button(
-            "Book Initializer",
-            id="collapse_book_initializer_button",
-            className="mb-3",
-            color="primary",
-        ),
-        dbc.Collapse(get_book_initializer_components(), id="collapse_book_initializer"),
-    ]
-)
+def create_app(production: bool = False):
+    """Create the Dash app.
+
+    Args:
+        production (bool): Whether the app is served by a production server, see
+            `bookjibe.ui.wsgi`. The responses are then compressed (if flask-compress is
+            installed) and the static files are cached by the browsers for
+            `BOOKJIBE_STATIC_MAX_AGE` seconds.
+
+    Returns:
+        dash.Dash: The app. Its Flask server is `app.server`.
+    """
+    compress = False
+    if production:
+        try:
+            import flask_compress  # noqa: F401
+
+            compress = True
+        except ImportError:
+            print("flask-compress is not installed, the responses are not compressed.")
+    app = dash.Dash(
+        __name__,
+        prevent_initial_callbacks=True,
+        compress=compress,
+        external_stylesheets=[
+            "https://stackpath.bootstrapcdn.com/bootswatch/4.5.2/darkly/bootstrap.min.css"
+        ],
+    )
+    # app = dash.Dash(__name__, external_stylesheets=['https://stackpath.bootstrapcdn.com/bootswatch/4.5.2/litera/bootstrap.min.css'])
+    if production:
+        # The scripts of the Dash components have fingerprinted URLs and are cached for a year anyway
+        app.server.config["SEND_FILE_MAX_AGE_DEFAULT"] = static_max_age
+
+    collapse_book_initializer = html.Div(
+        [
+            dbc.Button(
+                "Book Initializer",
+                id="collapse_book_initializer_button",
+                className="mb-3",
+                color="primary",
+            ),
+            dbc.Collapse(get_book_initializer_components(), id="collapse_book_initializer"),
+        ]
+    )
+
+    app.layout = html.Div(
+        [
+            html.H1("Book Generator", className="text-center my-4"),
+            dbc.Tabs([
+                dbc.Tab(label="Prompt generator", children=get_prompt_generator_components()),
+                dbc.Tab(label="Book Creator", children=[
+                    collapse_book_initializer,
+                    get_book_creator_components(),
+                    ]),
+            ]),
+        ],
+        className="container",
+    )
+
+    build_book_initializer_callbacks(app)
+    build_book_creator_callbacks(app)
+    build_prompt_generator_callbacks(app)
+
+    # Usage of the LLM calls (tokens, latency) per call site, book and session, see `bookjibe.usage`,
+    # and the counters of the rate limiter, see `bookjibe.ratelimit`
+    @app.server.route("/metrics")
+    def metrics():
+        return Response(
+            get_usage_tracker().to_prometheus() + get_rate_limiter().to_prometheus(),
+            mimetype="text/plain; version=0.0.4",
+        )
+
+    @app.server.route("/metrics.json")
+    def metrics_json():
+        return jsonify(
+            {**get_usage_tracker().to_json(), "rate_limiter": get_rate_limiter().metrics()}
+        )
+
+    return app
+
+
+_app = None
 
-app.layout = html.Div(
-    [
-        html.H1("Book Generator", className="text-center my-4"),
-        dbc.Tabs([
-            dbc.Tab(label="Prompt generator", children=get_prompt_generator_components()),
-            dbc.Tab(label="Book Creator", children=[
-                collapse_book_initializer,
-                get_book_creator_components(),
-                ]),
-        ]),
-    ],
-    className="container",
-)
 
-build_book_initializer_callbacks(app)
-build_book_creator_callbacks(app)
-build_prompt_generator_callbacks(app)
+def __getattr__(name):
+    # The development app is only created when it is used
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
-    app.run_server(debug=True)
+    create_app().run_server(debug=True)
 
 # https://medium.com/@helpedbyanerd/using-outputs-multiple-times-in-dash-callbacks-378202308c4a
@@ -3,9 +3,15 @@ from dash import dcc, html
 import dash_bootstrap_components as dbc
 from dash import Input, Output, State
 import json
-from bookjibe.writer import deserialize_writer, serialize_writer
-from bookjibe.ui.component import make_chapter_drop_down_list, render_chapter_versions
-from bookjibe.writer import get_writer
+from bookjibe.ui.component import (
+    make_chapter_cache_entry,
+    make_chapter_drop_down_list,
+    make_chapter_option,
+    render_chapter_versions,
+    render_job_status,
+)
+from bookjibe.ui.jobs import start_chapter_stream, get_job, remove_job, cancel_job
+from bookjibe.ui.store import export_session_book, get_session_writer, save_session_writer
 
 global previous_values
 previous_values = None
@@ -47,11 +53,16 @@ def get_book_creator_components():
             ),
             html.Div(
                 id="chapter_list",
-                children=make_chapter_drop_down_list(get_writer()),
+                # No book yet, the list is filled when a book is loaded or started
+                children=make_chapter_drop_down_list(None),
             ),
             html.Br(),
+            dcc.Download(id="book_download"),
+            dcc.Download(id="book_text_download"),
             dcc.Store(id="versions_dict", data={}),
             dcc.Store(id="selected_version", data=0),
+            dcc.Store(id="stream_job", data=None),
+            dcc.Interval(id="stream_interval", interval=250, disabled=True),
             dbc.Modal(
                 [
                     dbc.ModalHeader("Choose one of the versions"),
@@ -89,10 +100,16 @@ def get_book_creator_components():
                                 id="versioncard2_container",
                                 style={"margin-bottom": "10px"},
                             ),
+                            html.Div(id="stream_progress"),
                         ]
                     ),
                     dbc.ModalFooter(
-                        dbc.Button("Close", id="close", className="ml-auto")
+                        [
+                            dbc.Button(
+                                "Cancel", id="cancel_generation_button", color="secondary"
+                            ),
+                            dbc.Button("Close", id="close", className="ml-auto"),
+                        ]
                     ),
                 ],
                 id="modal",
@@ -102,10 +119,12 @@ def get_book_creator_components():
             html.Div(
                 id="chapter_table",
                 children=[
-                    render_chapter_versions("current_chapter_text", get_writer(), 1)
+                    render_chapter_versions("current_chapter_text", None, 1)
                 ],
             ),
             dcc.Store("selected_chapter", data=1),
+            # The texts of the chapters, see `bookjibe.ui.component.make_chapter_cache`
+            dcc.Store(id="chapter_cache", data={}),
             html.Script("""
                 // JavaScript code to refresh the page
                 function refreshPage() {
@@ -128,32 +147,42 @@ def build_book_creator_callbacks(app):
             # Call the JavaScript function to refresh the page
             return html.Script("refreshPage();")
 
-    @app.callback(
-        Output("chapter_table", "children"),
+    # The selected chapter is shown from the chapter cache, in the browser
+    app.clientside_callback(
+        """
+        function(chapterNumber, chapterCache) {
+            var chapter = (chapterCache || {})[chapterNumber];
+            if (!chapter) {
+                return [chapterNumber, null, ""];
+            }
+            return [chapterNumber, chapter.human_message, chapter.ai_message];
+        }
+        """,
+        Output("current_chapter_number", "children"),
+        Output("current_chapter_human_message", "children"),
+        Output("current_chapter_text", "value"),
         Input("chapter_dropdown", "value"),
-        State("serialized_writer", "data"),
+        State("chapter_cache", "data"),
     )
-    def render_chapter_table(chapter_number, serialized_writer):
-        return render_chapter_versions(
-            "current_chapter_text",
-            deserialize_writer(serialized_writer=serialized_writer),
-            chapter_number,
-        )
 
     @app.callback(
-        Output("serialized_writer", "data", allow_duplicate=True),
+        Output("writer_session", "data", allow_duplicate=True),
+        Output("chapter_cache", "data", allow_duplicate=True),
         Input("save_chapter_button", "n_clicks"),
-        State("serialized_writer", "data"),
+        State("writer_session", "data"),
         State("current_chapter_text", "value"),
         State("chapter_dropdown", "value"),
     )
-    def save_chapter(n_clicks, serialized_writer, current_chapter_text, chapter_number):
+    def save_chapter(n_clicks, writer_session, current_chapter_text, chapter_number):
         if n_clicks > 0:
-            writer = deserialize_writer(serialized_writer=serialized_writer)
+            writer = get_session_writer(writer_session)
             writer.update_chapter_ai_message(chapter_number, current_chapter_text)
-            return serialize_writer(writer)
+            chapter_cache = dash.Patch()
+            if writer.get_chapter_ai_message(chapter_number) is not None:
+                chapter_cache[str(chapter_number)]["ai_message"] = current_chapter_text
+            return save_session_writer(writer_session, writer), chapter_cache
         else:
-            return serialized_writer
+            return writer_session, dash.no_update
 
     @app.callback(
         Output("prompt_file_dropdown", "disabled"),
@@ -169,54 +198,94 @@ def build_book_creator_callbacks(app):
 
     @app.callback(
         Output("save_book_button", "disabled"),
+        Output("book_download", "data"),
+        Output("book_text_download", "data"),
         Input("save_book_button", "n_clicks"),
-        State("serialized_writer", "data"),
+        State("writer_session", "data"),
     )
-    def save_book(n_clicks, serialized_writer):
-        if n_clicks > 0:
-            writer = deserialize_writer(serialized_writer=serialized_writer)
-            writer.save_history_to_file("mybook.json")
-            writer.save_book_to_file("mybook.txt")
-            return True
+    def save_book(n_clicks, writer_session):
+        """Download the book, as a JSON file that can be loaded back and as a text file.
+
+        The book is already saved chapter by chapter in its journal, it is only compacted and exported here.
+        """
+        if n_clicks > 0 and writer_session:
+            book_data = export_session_book(writer_session)
+            if book_data is None:
+                return False, dash.no_update, dash.no_update
+            book_text = "\n".join(item["ai_message"] for item in book_data.values())
+            return (
+                True,
+                dcc.send_string(json.dumps(book_data), "mybook.json"),
+                dcc.send_string(book_text, "mybook.txt"),
+            )
         else:
-            return False
+            return False, dash.no_update, dash.no_update
 
     @app.callback(
-        Output("versions_dict", "data"),
+        Output("stream_job", "data"),
+        Output("stream_interval", "disabled"),
+        Output("modal", "is_open", allow_duplicate=True),
+        Output("version1_card", "children", allow_duplicate=True),
+        Output("version2_card", "children", allow_duplicate=True),
         Input("generate_button", "n_clicks"),
-        State("serialized_writer", "data"),
-        State("chapter_list", "children"),
+        State("writer_session", "data"),
         State("chapter_description", "value"),
     )
-    def generate_new_chapter(
-        n_clicks, serialized_writer, chapter_list, chapter_description
-    ):
+    def generate_new_chapter(n_clicks, writer_session, chapter_description):
+        """Start streaming the chapter versions.
+
+        The versions are generated in a background thread and `stream_chapter_versions`
+        polls them, so that the version cards of the modal fill in token by token.
+        """
         if n_clicks > 0:
-            writer = deserialize_writer(serialized_writer=serialized_writer)
-            _, ai_messages, human_messages = writer.generate_chapter_versions(
+            writer = get_session_writer(writer_session)
+            job_id = start_chapter_stream(
+                writer,
                 chapter_prompt=chapter_description,
                 chapter=writer.get_last_chapter_number() + 1,
+                session=writer_session,
             )
-            versions_dict = {
-                "ai_messages": ai_messages,
-                "human_messages": human_messages,
-            }
-            # ONLY FOR TESTING
-            # from langchain_core.messages import AIMessage, HumanMessage
-
-            # versions_dict = {
-            #     "ai_messages": {
-            #         1: "Chapitre 3 : Révélation des dessins mystérieux\n\nSarah était assise à son bureau.",
-            #         2: "Chapitre 3 : Ceci est la 2ème version",
-            #     },
-            #     "human_messages": {
-            #         1: "Ecris le chapitre 3 de l'histoire. Sarah va découvrir à quoi font référence ces dessins mystérieux. ",
-            #         2: "Ecris le chapitre 3 de l'histoire. Sarah va découvrir à quoi font référence ces dessins mystérieux. ",
-            #     },
-            # }
-            return json.dumps(versions_dict)
+            return job_id, False, True, "", ""
         else:
-            return {}
+            return dash.no_update, True, dash.no_update, dash.no_update, dash.no_update
+
+    @app.callback(
+        Output("version1_card", "children", allow_duplicate=True),
+        Output("version2_card", "children", allow_duplicate=True),
+        Output("versions_dict", "data"),
+        Output("stream_interval", "disabled", allow_duplicate=True),
+        Output("stream_progress", "children"),
+        Input("stream_interval", "n_intervals"),
+        State("stream_job", "data"),
+    )
+    def stream_chapter_versions(n_intervals, job_id):
+        job = get_job(job_id)
+        if job is None:
+            return dash.no_update, dash.no_update, dash.no_update, True, None
+        done = job.done.is_set()
+        texts = job.snapshot()
+        if not done:
+            return texts[1], texts[2], dash.no_update, False, render_job_status(job.state())
+        remove_job(job_id)
+        if job.status == "cancelled":
+            return "Cancelled", "Cancelled", dash.no_update, True, None
+        if job.error is not None:
+            return f"Error: {job.error}", f"Error: {job.error}", dash.no_update, True, None
+        versions_dict = job.result
+        ai_messages = versions_dict["ai_messages"]
+        return ai_messages["1"], ai_messages["2"], json.dumps(versions_dict), True, None
+
+    @app.callback(
+        Output("modal", "is_open", allow_duplicate=True),
+        Input("cancel_generation_button", "n_clicks"),
+        State("stream_job", "data"),
+    )
+    def cancel_generation(n_clicks, job_id):
+        """Stop the generation of the chapter versions. The streamed texts are discarded."""
+        if n_clicks:
+            cancel_job(job_id)
+            return False
+        return dash.no_update
 
     @app.callback(
         Output("save_book_button", "disabled", allow_duplicate=True),
@@ -257,23 +326,26 @@ def build_book_creator_callbacks(app):
             return False, "", ""
 
     @app.callback(
-        Output("serialized_writer", "data"),
+        Output("writer_session", "data"),
         Output("selected_version", "data"),
         Output("version1_button", "n_clicks"),
         Output("version2_button", "n_clicks"),
         Output("chapter_dropdown", "value"),
+        Output("chapter_dropdown", "options"),
+        Output("chapter_cache", "data", allow_duplicate=True),
         [Input("version1_button", "n_clicks"), Input("version2_button", "n_clicks")],
-        State("serialized_writer", "data"),
+        State("writer_session", "data"),
         State("versions_dict", "data"),
-        State("chapter_dropdown", "value"),
     )
-    def return_value(
-        card1_clicks,
-        card2_clicks,
-        serialized_writer,
-        versions_dict,
-        chapter_dropdown_value,
-    ):
+    def return_value(card1_clicks, card2_clicks, writer_session, versions_dict):
+        """Add the chosen version to the book.
+
+        Only the new chapter is sent to the browser: one option appended to the chapter
+        drop-down list and one entry added to the chapter cache, as `dash.Patch` updates.
+        """
+        if not versions_dict:
+            # The versions are still being generated
+            return dash.no_update, 0, 0, 0, dash.no_update, dash.no_update, dash.no_update
         versions_dict = json.loads(versions_dict)
         if card1_clicks:
             # add human message and ai message from version 1 to the writer
@@ -287,33 +359,39 @@ def build_book_creator_callbacks(app):
             selected_version = 2
         else:
             selected_version = 0
-            return serialized_writer, selected_version, 0, 0
-        writer = deserialize_writer(serialized_writer=serialized_writer)
+            return (
+                writer_session,
+                selected_version,
+                0,
+                0,
+                dash.no_update,
+                dash.no_update,
+                dash.no_update,
+            )
+        writer = get_session_writer(writer_session)
+        chapter_number = writer.get_last_chapter_number() + 1
         writer.add_chapter_to_book_as_messages(
-            chapter_number=writer.get_last_chapter_number() + 1,
+            chapter_number=chapter_number,
             human_message=human_message,
             ai_message=ai_message,
         )
+        chapter_options = dash.Patch()
+        chapter_options.append(make_chapter_option(chapter_number))
+        chapter_cache = dash.Patch()
+        chapter_cache[str(chapter_number)] = make_chapter_cache_entry(human_message, ai_message)
         return (
-            serialize_writer(writer),
+            save_session_writer(writer_session, writer),
             selected_version,
             0,
             0,
-            chapter_dropdown_value + 1,
+            chapter_number,
+            chapter_options,
+            chapter_cache,
         )
 
-    @app.callback(
-        Output("chapter_list", "children", allow_duplicate=True),
-        Input("serialized_writer", "data"),
-        State("chapter_dropdown", "value"),
-    )
-    def update_chapter_list(serialized_writer, chapter_number):
-        writer = deserialize_writer(serialized_writer=serialized_writer)
-        return make_chapter_drop_down_list(writer, chapter_number)
-
     # @app.callback(
     #     Output("chapter_dropdown", "value", allow_duplicate=True),
-    #     Output("serialized_writer", "data", allow_duplicate=True),
+    #     Output("writer_session", "data", allow_duplicate=True),
     #     Input("restart_button", "n_clicks"),
     #     State("chapter_dropdown", "value"),
     # )
@@ -321,7 +399,7 @@ def build_book_creator_callbacks(app):
 
     #     if n_clicks > 0:
     #         writer = get_writer()
-    #         return None, serialize_writer(writer)
+    #         return None, save_session_writer(None, writer)
     #     else:
     #         return dash.no_update, dash.no_update
 
@@ -1,30 +1,33 @@
-import os
 import dash
 from dash import dcc, html
 from dash import Input, Output, State
-from bookjibe.writer import (
-    get_serialized_writer, 
-    create_writer_from_book_data, 
-    serialize_writer,
-    deserialize_writer,
+from bookjibe.writer import get_writer
+from bookjibe.loader import load_writer_from_upload
+from bookjibe.ui.store import get_session_writer, save_session_writer
+from bookjibe.ui.component import (
+    make_chapter_cache,
+    make_chapter_drop_down_list,
+    render_job_status,
 )
-from bookjibe.ui.component import make_chapter_drop_down_list
-from bookjibe.utils import parse_file_contents
+from bookjibe.ui.jobs import cancel_job, get_job, remove_job, start_book_story
+from bookjibe.prompt_library import get_init_prompt_library
+from bookjibe.settings import prompt_refresh_interval
 
-prompt_folder = os.getenv("BOOKJIBE_PROMPT_FOLDER")
-prompt_files = [
-    file for file in os.listdir(prompt_folder) if file.endswith("prompt.txt")
-]
+# The initial prompts listed in the page, the other files of the folder are their specifications
+prompt_file_suffix = "prompt.txt"
 select_prompt_file_txt = "Select a prompt file to start the story"
 
 
 def get_book_initializer_components():
+    prompt_files = get_init_prompt_library().names(prompt_file_suffix)
     layout = html.Div(
         [
-            dcc.Store(id="serialized_writer", data=get_serialized_writer()),
+            # The writer is kept on the server, see `bookjibe.ui.store`
+            dcc.Store(id="writer_session", data=None),
             dcc.Store(id="current_chapter", data=1),
             # This upload button allows to load a book data file.
             # The file is a json file with the structure defined in method `bookjibe.writer.create_writer_from_book_data`"
+            # or a csv file, see `bookjibe.loader`
             dcc.Upload(
                 id="book_data",
                 children=html.Div(
@@ -53,6 +56,9 @@ def get_book_initializer_components():
                 options=[{"label": file, "value": file} for file in prompt_files],
                 placeholder="Select a file",
             ),
+            # The prompt files added or removed are shown without reloading the page
+            dcc.Store(id="prompt_files", data=prompt_files),
+            dcc.Interval(id="prompt_files_interval", interval=prompt_refresh_interval * 1000),
             html.Div(id="init_prompt_file_text", children=select_prompt_file_txt),
             dcc.Input(
                 id="book_description",
@@ -72,6 +78,16 @@ def get_book_initializer_components():
                     )
                 ],
             ),
+            # The story is written by a background job, see `bookjibe.ui.jobs`
+            dcc.Store(id="init_story_job", data=None),
+            dcc.Interval(id="init_story_interval", interval=500, disabled=True),
+            html.Div(id="init_story_status"),
+            html.Button(
+                "Cancel",
+                id="init_story_cancel_button",
+                n_clicks=0,
+                className="btn btn-secondary mt-2",
+            ),
         ],
         className="container text-center my-4",
         #style={"display": "flex", "justify-content": "center", "align-items": "center", "height": "100vh"}
@@ -91,46 +107,113 @@ def build_book_initializer_callbacks(app):
         return is_open
 
 
+    @app.callback(
+        Output("prompt_file_dropdown", "options"),
+        Output("prompt_files", "data"),
+        Input("prompt_files_interval", "n_intervals"),
+        State("prompt_files", "data"),
+    )
+    def refresh_prompt_files(n_intervals, prompt_files):
+        """Update the list of the initial prompts when prompt files are added or removed.
+
+        The prompt files are listed from memory, see `bookjibe.prompt_library`.
+        """
+        current_prompt_files = get_init_prompt_library().names(prompt_file_suffix)
+        if current_prompt_files == prompt_files:
+            return dash.no_update, dash.no_update
+        options = [{"label": file, "value": file} for file in current_prompt_files]
+        return options, current_prompt_files
+
     @app.callback(
         Output("book_upload_status", "children"),
         Output("chapter_list", "children", allow_duplicate=True),
-        Output("serialized_writer", "data", allow_duplicate=True),
+        Output("writer_session", "data", allow_duplicate=True),
+        Output("chapter_cache", "data", allow_duplicate=True),
         Input("book_data", "contents"),
         State("book_data", "filename"),
+        State("writer_session", "data"),
     )
-    def upload_book_data(contents, filename):
+    def upload_book_data(contents, filename, writer_session):
         if contents is not None:
-            book_items = parse_file_contents(contents, filename)
-            if book_items is None:
-                return f"Book {filename} not loaded", [], get_serialized_writer()
-            writer = create_writer_from_book_data(book_items)
-            serialized_writer = serialize_writer(writer)
+            # The file is parsed as it is decoded, see `bookjibe.loader`
+            writer = load_writer_from_upload(contents, filename)
+            if writer is None:
+                return (
+                    f"Book {filename} not loaded",
+                    [],
+                    save_session_writer(writer_session, get_writer()),
+                    {},
+                )
             dropdown_chapter_list = make_chapter_drop_down_list(writer)
             return (
                 f"Book {filename} loaded successfully!",
                 dropdown_chapter_list,
-                serialized_writer,
+                save_session_writer(writer_session, writer),
+                make_chapter_cache(writer),
             )
         else:
-            return "No book loaded", [], get_serialized_writer()
+            return "No book loaded", [], save_session_writer(writer_session, get_writer()), {}
 
     @app.callback(
-        Output("serialized_writer", "data", allow_duplicate=True),
+        Output("init_story_job", "data"),
+        Output("init_story_interval", "disabled"),
         Output("init_story_button", "disabled", allow_duplicate=True),
+        Output("init_story_status", "children"),
         Input("init_story_button", "n_clicks"),
-        State("serialized_writer", "data"),
+        State("writer_session", "data"),
         State("book_description", "value"),
         State("prompt_file_dropdown", "value"),
     )
-    def init_story(n_clicks, serialized_writer, book_description, init_prompt_file):
+    def init_story(n_clicks, writer_session, book_description, init_prompt_file):
         """This callback is triggered when the user clicks the init_story_button.
         
-
+        It starts writing the story in a background job, polled by `poll_init_story`.
         """
         if n_clicks > 0:
-            writer = deserialize_writer(serialized_writer)
-            response = writer.generate_book_story(init_prompt_file, book_description)
-            return serialize_writer(writer), True
+            job_id = start_book_story(writer_session, init_prompt_file, book_description)
+            return job_id, False, True, render_job_status(get_job(job_id).state())
 
         
-        return dash.no_update, dash.no_update
\ No newline at end of file
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+    @app.callback(
+        Output("writer_session", "data", allow_duplicate=True),
+        Output("init_story_interval", "disabled", allow_duplicate=True),
+        Output("init_story_button", "disabled", allow_duplicate=True),
+        Output("init_story_status", "children", allow_duplicate=True),
+        Output("chapter_cache", "data", allow_duplicate=True),
+        Output("chapter_list", "children", allow_duplicate=True),
+        Input("init_story_interval", "n_intervals"),
+        State("init_story_job", "data"),
+    )
+    def poll_init_story(n_intervals, job_id):
+        job = get_job(job_id)
+        unchanged = (dash.no_update, dash.no_update)
+        if job is None:
+            return (dash.no_update, True, False, None) + unchanged
+        if not job.done.is_set():
+            return (dash.no_update, False, True, render_job_status(job.state())) + unchanged
+        remove_job(job_id)
+        if job.status == "done":
+            writer = get_session_writer(job.result)
+            return (
+                job.result,
+                True,
+                True,
+                "The story is ready.",
+                make_chapter_cache(writer),
+                make_chapter_drop_down_list(writer),
+            )
+        if job.status == "cancelled":
+            return (dash.no_update, True, False, "The story was cancelled.") + unchanged
+        return (dash.no_update, True, False, f"Error: {job.error}") + unchanged
+
+    @app.callback(
+        Output("init_story_status", "children", allow_duplicate=True),
+        Input("init_story_cancel_button", "n_clicks"),
+        State("init_story_job", "data"),
+    )
+    def cancel_init_story(n_clicks, job_id):
+        if n_clicks > 0 and cancel_job(job_id):
+            return "Cancelling..."
+        return dash.no_update
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 from dash import dcc, html
 import dash_bootstrap_components as dbc
 from bookjibe.writer import Writer
@@ -21,12 +21,16 @@ def generate_drop_down_list(
     )
 
 
-def render_chapter_versions(id: str, writer: Writer, chapter_number: int):
+def render_chapter_versions(id: str, writer: Optional[Writer], chapter_number: int):
     """Render the chapter versions.
 
     It creates a table with 3 columns: name of the chapter,
     the HumanMessage as a string and the AIMessage as a string.
+    The cells are then filled in the browser when another chapter is selected,
+    from the chapter cache, see `make_chapter_cache`. If `writer` is None, the cells are empty.
     """
+    human_message = writer.get_chapter_human_message(chapter_number) if writer else None
+    ai_message = writer.get_chapter_ai_message(chapter_number) if writer else None
     return html.Table(
         id="chapter-versions",
         children=[
@@ -41,8 +45,11 @@ def render_chapter_versions(id: str, writer: Writer, chapter_number: int):
         + [
             html.Tr(
                 [
-                    html.Td(chapter_number),
-                    html.Td(writer.get_chapter_human_message(chapter_number)),
+                    html.Td(chapter_number, id="current_chapter_number"),
+                    html.Td(
+                        human_message,
+                        id="current_chapter_human_message",
+                    ),
                     html.Td(
                         # dcc.Input(
                         #     id=id,
@@ -52,7 +59,7 @@ def render_chapter_versions(id: str, writer: Writer, chapter_number: int):
                         # )
                         dcc.Textarea(
                             id=id,
-                            value=writer.get_chapter_ai_message(chapter_number),
+                            value=ai_message,
                             style={
                                 "width": "100%",
                                 "height": "100px",
@@ -65,16 +72,54 @@ def render_chapter_versions(id: str, writer: Writer, chapter_number: int):
     )
 
 
-def make_chapter_drop_down_list(writer: Writer, default_value: int = 0):
-    """Make a drop-down list of chapters."""
-    last_chapter_number = writer.get_last_chapter_number()
-    chapters = []
-    for i in range(1, last_chapter_number + 1):
-        chapter = f"Chapter {i}"
-        chapters.append({"label": chapter, "value": i})
+def make_chapter_cache_entry(human_message: str, ai_message: str):
+    """Make the entry of a chapter in the chapter cache, see `make_chapter_cache`."""
+    return {"human_message": human_message, "ai_message": ai_message}
+
+
+def make_chapter_cache(writer: Writer):
+    """Make the chapter cache of the browser: the texts of the chapters, keyed by chapter number.
+
+    It is kept in the `chapter_cache` dcc.Store, so that switching chapters needs no server work.
+    """
+    return {
+        str(i): make_chapter_cache_entry(
+            writer.get_chapter_human_message(i), writer.get_chapter_ai_message(i)
+        )
+        for i in range(1, writer.get_last_chapter_number() + 1)
+    }
+
+
+def make_chapter_option(chapter_number: int):
+    """Make the option of a chapter in the drop-down list of chapters."""
+    return {"label": f"Chapter {chapter_number}", "value": chapter_number}
+
+
+def make_chapter_drop_down_list(writer: Optional[Writer], default_value: int = 0):
+    """Make a drop-down list of chapters. If `writer` is None, the list is empty."""
+    last_chapter_number = writer.get_last_chapter_number() if writer is not None else 0
+    chapters = [make_chapter_option(i) for i in range(1, last_chapter_number + 1)]
     return generate_drop_down_list(
         id="chapter_dropdown",
         item_list=chapters,
         item_label="chapter",
         default_value=default_value,
     )
+
+
+def render_job_status(job_state: Dict):
+    """Render the progress bar and the message of a background job, see `bookjibe.ui.jobs.Job.state`."""
+    if job_state is None:
+        return None
+    running = job_state["status"] in ("pending", "running")
+    return html.Div(
+        [
+            dbc.Progress(
+                value=int(job_state["progress"] * 100),
+                striped=running,
+                animated=running,
+                className="mt-2",
+            ),
+            html.Small(job_state["message"]),
+        ]
+    )
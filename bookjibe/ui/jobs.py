@@ -0,0 +1,450 @@
+"""In-process manager of the long-running jobs of the Dash app.
+
+The LLM calls of the callbacks (book story, chapter versions, prompt generation) run in a
+pool of worker threads, so that the request threads of the server are freed at once and the
+other users are not kept waiting. A callback starts a job and keeps its id in a dcc.Store,
+then a dcc.Interval polls the progress and the result of the job.
+
+A job can be cancelled. It stops at its next checkpoint (the next streamed token, or the next
+step of the job) and its result is discarded.
+
+The jobs are started when the user asks for a new text, so they never read the LLM responses
+cached on disk, see `bookjibe.cache.bypass_llm_cache`.
+
+When the app is served by several processes (`BOOKJIBE_WEB_WORKERS`), the polls of a job may
+reach another process than the one running it: the states of the jobs are then shared in a
+SQLite database (`BOOKJIBE_JOB_DB`), see `SharedJobStates`.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Union
+
+from bookjibe.cache import bypass_llm_cache
+from bookjibe.llm import get_default_llm
+from bookjibe.prompt_library import get_init_prompt_library
+from bookjibe.settings import (
+    init_prompt_folder,
+    job_db,
+    job_workers,
+    language,
+    llm_expected_output_tokens,
+)
+from bookjibe.ui.store import get_session_writer, save_session_writer
+from bookjibe.usage import usage_context
+from bookjibe.utils import generate_prompt_logic
+from bookjibe.writer import Writer
+
+
+class JobCancelled(Exception):
+    """Raised in a job when it has been cancelled."""
+
+
+class Job:
+    """The state of a job, updated by the worker thread and read by the polling callbacks.
+
+    Args:
+        number_of_versions (int): The number of texts streamed by the job, if any.
+        on_change (callable): Called with the job, and whether the change must not be
+            throttled, after each change of its state.
+    """
+
+    def __init__(self, number_of_versions: int = 0, on_change=None):
+        self.id = uuid.uuid4().hex
+        self.status = "pending"
+        self.progress = 0.0
+        self.message = ""
+        self.texts = {i: "" for i in range(1, number_of_versions + 1)}
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.finished_at = None
+        self._cancelled = threading.Event()
+        self._streamed_tokens = 0
+        self._lock = threading.Lock()
+        self._on_change = on_change
+        self._published_at = 0.0
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Ask the job to stop at its next checkpoint."""
+        self._cancelled.set()
+
+    def check_cancelled(self):
+        """Raise `JobCancelled` if the job has been cancelled."""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def set_progress(self, progress: float, message: str = None):
+        """Report the progress of the job, between 0 and 1. It is also a cancellation checkpoint."""
+        self.check_cancelled()
+        with self._lock:
+            self.progress = progress
+            if message is not None:
+                self.message = message
+        self._changed()
+
+    def append(self, version: int, token: str):
+        """Append a streamed token to the text of a version. It is also a cancellation checkpoint."""
+        self.check_cancelled()
+        with self._lock:
+            self.texts[version] += token
+            self._streamed_tokens += 1
+            # The progress is estimated from the expected size of the answers
+            self.progress = min(
+                0.99, self._streamed_tokens / (llm_expected_output_tokens * len(self.texts))
+            )
+        self._changed()
+
+    def snapshot(self):
+        """Return a copy of the texts generated so far."""
+        with self._lock:
+            return dict(self.texts)
+
+    def state(self):
+        """Return the status, the progress and the message of the job."""
+        with self._lock:
+            return {"status": self.status, "progress": self.progress, "message": self.message}
+
+    def _finish(self, status, result=None, error=None):
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            if status == "done":
+                self.progress = 1.0
+            self.finished_at = time.monotonic()
+        self._changed(force=True)
+        self.done.set()
+
+    def _changed(self, force=False):
+        if self._on_change is not None:
+            self._on_change(self, force)
+
+
+class RemoteJob:
+    """A job run by another process of the server, read from its shared state, see `SharedJobStates`.
+
+    It has the attributes and the methods of `Job` read by the polling callbacks.
+    """
+
+    def __init__(self, job_id, row, shared_states):
+        status, progress, message, texts, result, error = row
+        self.id = job_id
+        self.status = status
+        self.progress = progress
+        self.message = message
+        self.texts = {int(version): text for version, text in json.loads(texts).items()}
+        self.result = json.loads(result) if result is not None else None
+        self.error = error
+        self.done = threading.Event()
+        if status in ("done", "failed", "cancelled"):
+            self.done.set()
+        self._shared_states = shared_states
+
+    @property
+    def cancelled(self):
+        return self.status == "cancelled"
+
+    def cancel(self):
+        """Ask the process running the job to stop it at its next checkpoint."""
+        self._shared_states.request_cancel(self.id)
+
+    def snapshot(self):
+        return dict(self.texts)
+
+    def state(self):
+        return {"status": self.status, "progress": self.progress, "message": self.message}
+
+
+class SharedJobStates:
+    """States of the jobs shared by the processes of the server, in a SQLite database.
+
+    The process running a job publishes its state at most every `publish_interval` seconds,
+    and at once when it starts or finishes. The results are stored as JSON. A job cancelled
+    from another process is stopped when its state is next published.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        ttl (float): The number of seconds after which the state of a job is forgotten.
+        publish_interval (float): The minimum number of seconds between two publications of
+            the state of a job.
+    """
+
+    def __init__(
+        self, db_path: Union[str, Path], ttl: float = 3600, publish_interval: float = 0.1
+    ):
+        self.db_path = Path(db_path)
+        self.ttl = ttl
+        self.publish_interval = publish_interval
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                "progress REAL NOT NULL, message TEXT NOT NULL, texts TEXT NOT NULL, "
+                "result TEXT, error TEXT, cancelled INTEGER NOT NULL DEFAULT 0, "
+                "updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        # The states of the jobs do not need to survive a crash of the machine
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def publish(self, job: Job, force: bool = False):
+        """Publish the state of a job run by this process."""
+        now = time.monotonic()
+        if not force and now - job._published_at < self.publish_interval:
+            return
+        job._published_at = now
+        with job._lock:
+            result = json.dumps(job.result) if job.status == "done" else None
+            error = None if job.error is None else str(job.error)
+            row = (
+                job.id,
+                job.status,
+                job.progress,
+                job.message,
+                json.dumps(job.texts),
+                result,
+                error,
+                time.time(),
+            )
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, status, progress, message, texts, result, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+                "status = excluded.status, progress = excluded.progress, "
+                "message = excluded.message, texts = excluded.texts, result = excluded.result, "
+                "error = excluded.error, updated_at = excluded.updated_at",
+                row,
+            )
+            (cancelled,) = connection.execute(
+                "SELECT cancelled FROM jobs WHERE id = ?", (job.id,)
+            ).fetchone()
+            if force:
+                connection.execute(
+                    "DELETE FROM jobs WHERE updated_at < ?", (time.time() - self.ttl,)
+                )
+        if cancelled:
+            job.cancel()
+
+    def load(self, job_id):
+        """Load the state of a job. Return None if the job does not exist."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT status, progress, message, texts, result, error FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return RemoteJob(job_id, row, self)
+
+    def request_cancel(self, job_id):
+        with self._connect() as connection:
+            connection.execute("UPDATE jobs SET cancelled = 1 WHERE id = ?", (job_id,))
+
+    def delete(self, job_id):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+class JobManager:
+    """Run jobs in a pool of worker threads and keep their state until it is collected.
+
+    Args:
+        max_workers (int): The maximum number of jobs running at the same time, the others wait.
+        ttl (float): The number of seconds after which a finished job that was not collected is forgotten.
+        db_path (str): The path to the SQLite database where the states of the jobs are shared
+            with the other processes of the server, see `SharedJobStates`. If None, the jobs
+            are only known to this process.
+    """
+
+    def __init__(
+        self, max_workers: int = 8, ttl: float = 3600, db_path: Union[str, Path] = None
+    ):
+        self.ttl = ttl
+        self.shared_states = SharedJobStates(db_path, ttl) if db_path is not None else None
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="bookjibe-job"
+        )
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args, number_of_versions: int = 0, **kwargs):
+        """Run `function(job, *args, **kwargs)` in a worker thread.
+
+        Returns:
+            str: The id of the job, to be given to `get`.
+        """
+        on_change = self.shared_states.publish if self.shared_states is not None else None
+        job = Job(number_of_versions, on_change=on_change)
+
+        def run():
+            if job.cancelled:
+                job._finish("cancelled")
+                return
+            with job._lock:
+                job.status = "running"
+            job._changed(force=True)
+            try:
+                result = function(job, *args, **kwargs)
+                job.check_cancelled()
+            except JobCancelled:
+                job._finish("cancelled")
+            except Exception as e:
+                print(e)
+                job._finish("failed", error=e)
+            else:
+                job._finish("done", result=result)
+
+        with self._lock:
+            self._forget_expired()
+            self._jobs[job.id] = job
+        # The job is known to the other processes before its id is returned
+        job._changed(force=True)
+        self._executor.submit(run)
+        return job.id
+
+    def get(self, job_id):
+        """Get a job from its id. Return None if the job does not exist.
+
+        A job run by another process is returned as a `RemoteJob`.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and job_id is not None and self.shared_states is not None:
+            return self.shared_states.load(job_id)
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a job. Return False if the job does not exist."""
+        job = self.get(job_id)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+    def remove(self, job_id):
+        """Forget a job once its result has been collected."""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        if self.shared_states is not None:
+            self.shared_states.delete(job_id)
+
+    def _forget_expired(self):
+        now = time.monotonic()
+        for job_id in [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at + self.ttl < now
+        ]:
+            del self._jobs[job_id]
+
+
+job_manager = JobManager(max_workers=job_workers, db_path=job_db)
+
+
+def get_job(job_id):
+    """Get a job of the app from its id. Return None if the job does not exist."""
+    return job_manager.get(job_id)
+
+
+def cancel_job(job_id):
+    """Cancel a job of the app."""
+    return job_manager.cancel(job_id)
+
+
+def remove_job(job_id):
+    """Forget a job of the app once its result has been collected."""
+    job_manager.remove(job_id)
+
+
+def _session_id(session):
+    return session["id"] if session else None
+
+
+def start_chapter_stream(writer, chapter_prompt, chapter, number_of_versions=2, session=None):
+    """Start streaming the versions of a chapter.
+
+    The texts of the versions are filled in as the tokens are received, see `Job.snapshot`.
+    The LLM calls are accounted to `session`, if given, see `bookjibe.usage`.
+    The result of the job is a dict of the AI messages and of the human messages of the versions,
+    keyed by the version number as a string, so that it can be shared as JSON with the other
+    processes of the server.
+
+    Returns:
+        str: The id of the job.
+    """
+
+    def run(job):
+        with usage_context(session=_session_id(session)), bypass_llm_cache():
+            _, ai_messages, human_messages = writer.stream_chapter_versions(
+                chapter_prompt=chapter_prompt,
+                chapter=chapter,
+                number_of_versions=number_of_versions,
+                on_token=job.append,
+            )
+        return {
+            "ai_messages": {str(i): text for i, text in ai_messages.items()},
+            "human_messages": {str(i): text for i, text in human_messages.items()},
+        }
+
+    return job_manager.submit(run, number_of_versions=number_of_versions)
+
+
+def start_book_story(session, init_prompt_file, book_description):
+    """Start generating the story of the book of a session.
+
+    The result of the job is the new session dict, see `bookjibe.ui.store.save_session_writer`.
+    The book of the session is only updated if the job was not cancelled.
+
+    Returns:
+        str: The id of the job.
+    """
+    def run(job):
+        job.set_progress(0.1, "Writing the story...")
+        # Work on a copy, so that a cancelled job leaves the book untouched
+        session_writer = get_session_writer(session)
+        writer = Writer.from_state(session_writer.to_state())
+        writer.book_id = session_writer.book_id
+        with usage_context(session=_session_id(session)), bypass_llm_cache():
+            writer.generate_book_story(init_prompt_file, book_description)
+        job.set_progress(0.9, "Saving the story...")
+        return save_session_writer(session, writer)
+
+    return job_manager.submit(run)
+
+
+def start_prompt_generation(prompt_generator_file, prompt_text, output_name):
+    """Start generating a prompt file with the prompt generator, see `bookjibe.utils.generate_prompt_logic`.
+
+    Returns:
+        str: The id of the job.
+    """
+    def run(job):
+        job.set_progress(0.1, "Writing the specifications...")
+        with bypass_llm_cache():
+            generate_prompt_logic(
+                prompt_generator_file,
+                prompt_text,
+                init_prompt_folder=init_prompt_folder,
+                output_name=output_name,
+                llm=get_default_llm(),
+                language=language,
+                on_progress=job.set_progress,
+            )
+        # List the new prompt at once, without waiting for the watcher of the folder
+        get_init_prompt_library().refresh()
+        return f"{output_name}_prompt.txt"
+
+    return job_manager.submit(run)
@@ -1,20 +1,17 @@
-import os
 from pathlib import Path
 from dash import dcc, html, Input, Output, State
 import dash_bootstrap_components as dbc
 
-from bookjibe.utils import generate_prompt_logic
-from bookjibe.llm import llm
-from bookjibe.settings import language, init_prompt_folder, prompt_generator_folder
-
-
-prompt_files = [
-    file for file in os.listdir(prompt_generator_folder)
-]
+import dash
+from bookjibe.ui.component import render_job_status
+from bookjibe.ui.jobs import cancel_job, get_job, remove_job, start_prompt_generation
+from bookjibe.prompt_library import get_prompt_generator_library
+from bookjibe.settings import prompt_generator_folder, prompt_refresh_interval
 
 
 def get_prompt_generator_components():
     """Returns the components for the prompt generator tab."""
+    prompt_files = get_prompt_generator_library().names()
     # Components for the new tab
     prompt_generator_content = dbc.Card(
         dbc.CardBody(
@@ -26,6 +23,9 @@ def get_prompt_generator_components():
                     options=[{"label": file, "value": file} for file in prompt_files],
                     value=None,
                 ),
+                # The prompt generators added or removed are shown without reloading the page
+                dcc.Store(id="prompt-files", data=prompt_files),
+                dcc.Interval(id="prompt-files-interval", interval=prompt_refresh_interval * 1000),
                 html.Br(),
                 html.Label("What kind of book do you want to write?"),
                 dcc.Input(id="prompt-text-input", type="text", style={'width': '100%'}),
@@ -40,6 +40,11 @@ def get_prompt_generator_components():
                     dbc.Button("Generate Prompt", id="generate-prompt-button", color="primary"),
                 ]
                 ),
+                dbc.Button("Cancel", id="cancel-prompt-button", color="secondary", className="mt-2"),
+                # The prompt is written by a background job, see `bookjibe.ui.jobs`
+                dcc.Store(id="prompt-job", data=None),
+                dcc.Interval(id="prompt-interval", interval=500, disabled=True),
+                html.Div(id="prompt-status"),
                 
             ]
         ),
@@ -52,15 +57,63 @@ def build_prompt_generator_callbacks(app):
     """Builds the callbacks for the prompt generator tab."""
 
     @app.callback(
-        Output("generate-prompt-button", "n_clicks"),
+        Output("prompt-file-dropdown", "options"),
+        Output("prompt-files", "data"),
+        Input("prompt-files-interval", "n_intervals"),
+        State("prompt-files", "data"),
+    )
+    def refresh_prompt_files(n_intervals, prompt_files):
+        """Update the list of the prompt generators when prompt files are added or removed."""
+        current_prompt_files = get_prompt_generator_library().names()
+        if current_prompt_files == prompt_files:
+            return dash.no_update, dash.no_update
+        options = [{"label": file, "value": file} for file in current_prompt_files]
+        return options, current_prompt_files
+
+    @app.callback(
+        Output("prompt-job", "data"),
+        Output("prompt-interval", "disabled"),
+        Output("generate-prompt-button", "disabled"),
+        Output("prompt-status", "children"),
         [Input("generate-prompt-button", "n_clicks")],
         [State("prompt-file-dropdown", "value"), State("prompt-text-input", "value")], State("prompt-filename-input", "value")
     )
     def generate_prompt(n_clicks, selected_file, prompt_text, prompt_filename):
-        if n_clicks > 0: # and selected_file is not None and prompt_text is not None and prompt_filename is not None:
+        if n_clicks: # and selected_file is not None and prompt_text is not None and prompt_filename is not None:
             prompt_generator_file = Path(prompt_generator_folder) / selected_file
-            # Assuming you have the prompt generation logic ready
             print("Generating prompt...")
-            generate_prompt_logic(prompt_generator_file, prompt_text, init_prompt_folder=init_prompt_folder, output_name=prompt_filename, llm=llm, language=language)
+            job_id = start_prompt_generation(prompt_generator_file, prompt_text, output_name=prompt_filename)
+            return job_id, False, True, render_job_status(get_job(job_id).state())
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+    @app.callback(
+        Output("prompt-interval", "disabled", allow_duplicate=True),
+        Output("generate-prompt-button", "disabled", allow_duplicate=True),
+        Output("prompt-status", "children", allow_duplicate=True),
+        Input("prompt-interval", "n_intervals"),
+        State("prompt-job", "data"),
+    )
+    def poll_prompt_generation(n_intervals, job_id):
+        job = get_job(job_id)
+        if job is None:
+            return True, False, None
+        if not job.done.is_set():
+            return False, True, render_job_status(job.state())
+        remove_job(job_id)
+        if job.status == "done":
+            return True, False, f"The prompt is saved in {job.result}."
+        if job.status == "cancelled":
+            return True, False, "The prompt generation was cancelled."
+        return True, False, f"Error: {job.error}"
+
+    @app.callback(
+        Output("prompt-status", "children", allow_duplicate=True),
+        Input("cancel-prompt-button", "n_clicks"),
+        State("prompt-job", "data"),
+    )
+    def cancel_prompt_generation(n_clicks, job_id):
+        if n_clicks and cancel_job(job_id):
+            return "Cancelling..."
+        return dash.no_update
 
 
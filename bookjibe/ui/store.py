@@ -0,0 +1,196 @@
+"""Server-side store of the writers of the Dash sessions.
+
+The browser only holds a small session dict, e.g. `{"id": "Yx3k9QeLp2A", "revision": 4}`,
+in the `writer_session` dcc.Store. The writer itself stays on the server, in an in-process
+LRU cache with a time-to-live, optionally backed by a SQLite database so that sessions
+survive restarts and evictions.
+
+The changes of the book of a session are also saved as they happen in its journal,
+see `bookjibe.journal`, from which the book is restored if the session has expired.
+
+When the app is served by several processes, each one has its own cache: a writer cached at an
+older revision than the one of the session was changed by another process, and is reloaded
+from the database or the journal.
+"""
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Union
+
+from bookjibe.journal import get_book_journal
+from bookjibe.settings import session_db, session_max, session_ttl
+from bookjibe.writer import Writer, serialize_writer, deserialize_writer
+
+
+class WriterSessionStore:
+    """Store writers by session id.
+
+    Args:
+        max_sessions (int): The maximum number of writers kept in memory.
+        ttl (float): The number of seconds after which an unused session expires.
+        db_path (str): The path to the SQLite database backing the store. If None,
+            the sessions are only kept in memory.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 100,
+        ttl: float = 24 * 3600,
+        db_path: Union[str, Path] = None,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.db_path = db_path
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        if db_path is not None:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            with self._connect() as connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS sessions "
+                    "(id TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+                )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @staticmethod
+    def new_id():
+        """Generate a short random session id."""
+        return secrets.token_urlsafe(8)
+
+    def get(self, session_id: str, revision: int = 0):
+        """Get the writer of a session at `revision` or later.
+
+        Return None if the session is unknown or expired, or if this process only has an
+        older revision of it and the store has no database.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                writer, expires_at, cached_revision = entry
+                if expires_at > now and cached_revision >= revision:
+                    self._sessions[session_id] = (writer, now + self.ttl, cached_revision)
+                    self._sessions.move_to_end(session_id)
+                    return writer
+                del self._sessions[session_id]
+        writer = self._load(session_id)
+        if writer is not None:
+            # The database is saved before a revision is given to the browser
+            self._remember(session_id, writer, revision)
+        return writer
+
+    def put(self, session_id: str, writer: Writer, revision: int = 0):
+        """Store the writer of a session at a revision."""
+        self._remember(session_id, writer, revision)
+        self._save(session_id, writer)
+
+    def delete(self, session_id: str):
+        """Forget a session."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        if self.db_path is not None:
+            with self._connect() as connection:
+                connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _remember(self, session_id, writer, revision):
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session_id] = (writer, now + self.ttl, revision)
+            self._sessions.move_to_end(session_id)
+            for expired_id in [
+                key for key, (_, expires_at, _) in self._sessions.items() if expires_at <= now
+            ]:
+                del self._sessions[expired_id]
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def _save(self, session_id, writer):
+        if self.db_path is None:
+            return
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, updated_at) VALUES (?, ?, ?)",
+                (session_id, serialize_writer(writer), time.time()),
+            )
+            connection.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,)
+            )
+
+    def _load(self, session_id):
+        if self.db_path is None:
+            return None
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT data FROM sessions WHERE id = ? AND updated_at >= ?",
+                (session_id, time.time() - self.ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        return deserialize_writer(row[0])
+
+
+writer_store = WriterSessionStore(
+    max_sessions=session_max, ttl=session_ttl, db_path=session_db
+)
+
+
+def get_session_writer(session: dict):
+    """Get the writer of a session.
+
+    If the browser has no session yet, or if the session has expired, an empty writer is returned.
+    """
+    if session:
+        journal = get_book_journal(session["id"])
+        writer = writer_store.get(session["id"], session["revision"])
+        if writer is None and journal.exists():
+            print(f"Session {session['id']} restored from its journal.")
+            writer = Writer.from_journal(journal)
+            writer_store.put(session["id"], writer, session["revision"])
+        if writer is not None:
+            writer.journal = journal
+            writer.book_id = session["id"]
+            return writer
+        print(f"Session {session['id']} not found, starting a new book.")
+    return Writer()
+
+
+def save_session_writer(session: dict, writer: Writer):
+    """Store the writer of a session and return the session dict to send to the browser.
+
+    The revision is bumped so that the callbacks depending on the session are triggered.
+    If the writer is not attached to the journal of the session yet (a new or uploaded book),
+    the journal is started from the current state of the book.
+    """
+    if session:
+        session_id, revision = session["id"], session["revision"] + 1
+    else:
+        session_id, revision = writer_store.new_id(), 0
+    journal = get_book_journal(session_id)
+    if writer.journal is None or writer.journal.path != journal.path:
+        journal.rewrite(writer.to_state())
+        writer.journal = journal
+    writer_store.put(session_id, writer, revision)
+    return {"id": session_id, "revision": revision}
+
+
+def export_session_book(session: dict):
+    """Compact the journal of the book of a session and export the book, see `BookJournal.export`.
+
+    Returns:
+        dict: The book data, or None if the session has no book, e.g. it expired before its book was journaled.
+    """
+    writer = get_session_writer(session)
+    if writer.journal is None:
+        print(f"Session {session['id']} has no book to save.")
+        return None
+    writer.journal.compact()
+    return writer.journal.export()
@@ -0,0 +1,15 @@
+"""WSGI entry point of the app for production servers.
+
+The app is created once when this module is imported, with the production options of
+`bookjibe.ui.app.create_app` and without the debug tools of the development server, and the
+LLM libraries are imported with it. With gunicorn, see gunicorn.conf.py at the root of the
+repository:
+
+    gunicorn bookjibe.ui.wsgi:application
+"""
+from bookjibe.llm import preload_llm_libraries
+from bookjibe.ui.app import create_app
+
+app = create_app(production=True)
+preload_llm_libraries()
+application = app.server
@@ -0,0 +1,338 @@
+"""Accounting of the tokens, the latency and the cost drivers of the LLM calls.
+
+Every call of the chat models created by `bookjibe.llm` is reported to `UsageCallbackHandler`,
+which records its prompt and completion tokens, its latency, its model and its call site
+(`generate_book_story`, `generate_chapter_versions`, `generate_prompt_logic`, ...). The calls
+are aggregated per call site and model, per book and per session, by the `UsageTracker` of the
+application, see `get_usage_tracker`. It is exported as JSON and in the Prometheus text format,
+on the /metrics.json and /metrics endpoints of the app.
+
+The call site, the book and the session of the calls are taken from the context, see
+`track_usage` and `usage_context`. The token counts are the ones returned by the API; when it
+does not return them (streamed responses), they are estimated with `bookjibe.tokens`. The prompt
+tokens served from the prompt cache of the provider are also counted (`cached_tokens`), see
+`BOOKJIBE_PROMPT_LAYOUT` in `bookjibe.memory.BookMemory`. The responses replayed from the
+response cache of `bookjibe.cache` are not billed: they are only counted as `cache_hits`.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from bookjibe.tokens import count_message_tokens, count_tokens
+
+_call_site = contextvars.ContextVar("bookjibe_usage_call_site", default=None)
+_book = contextvars.ContextVar("bookjibe_usage_book", default=None)
+_session = contextvars.ContextVar("bookjibe_usage_session", default=None)
+
+COUNTERS = [
+    "calls",
+    "prompt_tokens",
+    "cached_tokens",
+    "completion_tokens",
+    "latency_seconds",
+    "cache_hits",
+]
+
+
+@contextmanager
+def usage_context(call_site: str = None, book: str = None, session: str = None):
+    """Account the LLM calls of this context to a call site, a book and a session.
+
+    The arguments left to None keep the value of the enclosing context.
+    """
+    tokens = [
+        (variable, variable.set(value))
+        for variable, value in [(_call_site, call_site), (_book, book), (_session, session)]
+        if value is not None
+    ]
+    try:
+        yield
+    finally:
+        for variable, token in reversed(tokens):
+            variable.reset(token)
+
+
+def track_usage(call_site: str):
+    """Decorator accounting the LLM calls of a function, or a coroutine function, to `call_site`.
+
+    If the function is a method of an object with a `book_id` (e.g. a `bookjibe.writer.Writer`),
+    the calls are also accounted to that book.
+    """
+
+    def decorator(function):
+        def context(args):
+            book = getattr(args[0], "book_id", None) if args else None
+            return usage_context(call_site=call_site, book=book)
+
+        if asyncio.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with context(args):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with context(args):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _empty_counters():
+    return dict.fromkeys(COUNTERS, 0)
+
+
+def _add(counters, call):
+    if call["cache_hit"]:
+        counters["cache_hits"] += 1
+        return
+    counters["calls"] += 1
+    counters["prompt_tokens"] += call["prompt_tokens"]
+    counters["cached_tokens"] += call["cached_tokens"]
+    counters["completion_tokens"] += call["completion_tokens"]
+    counters["latency_seconds"] += call["latency_seconds"]
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class UsageTracker:
+    """Aggregate the usage of the LLM calls.
+
+    Args:
+        max_calls (int): The number of most recent calls kept in detail.
+        max_keys (int): The maximum number of books and of sessions with their own
+            aggregates; the least recently used ones are forgotten.
+    """
+
+    def __init__(self, max_calls: int = 1000, max_keys: int = 1000):
+        self.max_keys = max_keys
+        self._calls = deque(maxlen=max_calls)
+        self._totals = _empty_counters()
+        self._call_sites = {}
+        self._books = OrderedDict()
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _counters_of(self, aggregates, key):
+        if key not in aggregates:
+            aggregates[key] = _empty_counters()
+            if len(aggregates) > self.max_keys:
+                aggregates.popitem(last=False)
+        aggregates.move_to_end(key)
+        return aggregates[key]
+
+    def record(
+        self,
+        prompt_tokens: int,
+        completion_tokens: int,
+        latency_seconds: float,
+        model: str = None,
+        call_site: str = None,
+        book: str = None,
+        session: str = None,
+        estimated: bool = False,
+        cached_tokens: int = 0,
+        cache_hit: bool = False,
+    ):
+        """Record an LLM call.
+
+        A call answered from the response cache (`cache_hit`) is only counted in `cache_hits`.
+        """
+        call = {
+            "time": time.time(),
+            "model": model or "unknown",
+            "call_site": call_site or "other",
+            "book": book,
+            "session": session,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_seconds": latency_seconds,
+            "estimated": estimated,
+            "cache_hit": cache_hit,
+        }
+        with self._lock:
+            self._calls.append(call)
+            _add(self._totals, call)
+            key = (call["call_site"], call["model"])
+            _add(self._call_sites.setdefault(key, _empty_counters()), call)
+            if book is not None:
+                _add(self._counters_of(self._books, book), call)
+            if session is not None:
+                _add(self._counters_of(self._sessions, session), call)
+
+    def book_usage(self, book: str):
+        """Return the counters of a book, e.g. to check its budget."""
+        with self._lock:
+            return dict(self._books.get(book, _empty_counters()))
+
+    def to_json(self):
+        """Return the aggregates and the most recent calls, as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                "totals": dict(self._totals),
+                "call_sites": [
+                    {"call_site": call_site, "model": model, **counters}
+                    for (call_site, model), counters in self._call_sites.items()
+                ],
+                "books": {book: dict(counters) for book, counters in self._books.items()},
+                "sessions": {
+                    session: dict(counters) for session, counters in self._sessions.items()
+                },
+                "calls": list(self._calls),
+            }
+
+    def to_prometheus(self):
+        """Return the aggregates in the Prometheus text exposition format."""
+        usage = self.to_json()
+        lines = []
+        for counter, description in [
+            ("calls", "Number of LLM calls."),
+            ("prompt_tokens", "Number of prompt tokens sent to the LLM."),
+            ("cached_tokens", "Number of prompt tokens served from the prompt cache of the provider."),
+            ("completion_tokens", "Number of completion tokens received from the LLM."),
+            ("latency_seconds", "Total duration of the LLM calls, in seconds."),
+            ("cache_hits", "Number of LLM calls answered from the response cache, not billed."),
+        ]:
+            for prefix, label_names, rows in [
+                ("bookjibe_llm", ("call_site", "model"), usage["call_sites"]),
+                (
+                    "bookjibe_book_llm",
+                    ("book",),
+                    [{"book": book, **c} for book, c in usage["books"].items()],
+                ),
+                (
+                    "bookjibe_session_llm",
+                    ("session",),
+                    [{"session": session, **c} for session, c in usage["sessions"].items()],
+                ),
+            ]:
+                name = f"{prefix}_{counter}_total"
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} counter")
+                for row in rows:
+                    labels = ",".join(
+                        f'{label}="{_escape_label(row[label])}"' for label in label_names
+                    )
+                    lines.append(f"{name}{{{labels}}} {row[counter]}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+            self._totals = _empty_counters()
+            self._call_sites.clear()
+            self._books.clear()
+            self._sessions.clear()
+
+
+_usage_tracker = UsageTracker()
+
+
+def get_usage_tracker():
+    """Get the usage tracker of the application."""
+    return _usage_tracker
+
+
+@functools.lru_cache(maxsize=None)
+def _get_callback_handler_class():
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class UsageCallbackHandler(BaseCallbackHandler):
+        """LangChain callback handler recording the LLM calls in a `UsageTracker`."""
+
+        # Called in the thread or the task of the LLM call, so that its context is available
+        run_inline = True
+
+        def __init__(self, tracker: UsageTracker):
+            self.tracker = tracker
+            self._runs = {}
+            self._lock = threading.Lock()
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            invocation_params = kwargs.get("invocation_params") or {}
+            model = (
+                invocation_params.get("model_name")
+                or invocation_params.get("model")
+                or serialized.get("id", [None])[-1]
+            )
+            run = {
+                "start": time.perf_counter(),
+                "prompt_tokens": sum(count_message_tokens(batch) for batch in messages),
+                "model": model,
+                "call_site": _call_site.get(),
+                "book": _book.get(),
+                "session": _session.get(),
+            }
+            with self._lock:
+                self._runs[run_id] = run
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            with self._lock:
+                run = self._runs.pop(run_id, None)
+            if run is None:
+                return
+            from bookjibe.cache import CACHE_HIT_KEY
+
+            generations = [generation for batch in response.generations for generation in batch]
+            if generations and all(
+                (generation.generation_info or {}).get(CACHE_HIT_KEY) for generation in generations
+            ):
+                self.tracker.record(
+                    prompt_tokens=0,
+                    completion_tokens=0,
+                    latency_seconds=time.perf_counter() - run["start"],
+                    model=run["model"],
+                    call_site=run["call_site"],
+                    book=run["book"],
+                    session=run["session"],
+                    cache_hit=True,
+                )
+                return
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            estimated = "prompt_tokens" not in token_usage
+            prompt_tokens_details = token_usage.get("prompt_tokens_details") or {}
+            cached_tokens = prompt_tokens_details.get("cached_tokens") or 0
+            if estimated:
+                prompt_tokens = run["prompt_tokens"]
+                completion_tokens = sum(count_tokens(generation.text) for generation in generations)
+            else:
+                prompt_tokens = token_usage["prompt_tokens"]
+                completion_tokens = token_usage.get("completion_tokens", 0)
+            self.tracker.record(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                latency_seconds=time.perf_counter() - run["start"],
+                model=(response.llm_output or {}).get("model_name") or run["model"],
+                call_site=run["call_site"],
+                book=run["book"],
+                session=run["session"],
+                estimated=estimated,
+                cached_tokens=cached_tokens,
+            )
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            with self._lock:
+                self._runs.pop(run_id, None)
+
+    return UsageCallbackHandler
+
+
+def get_usage_handler(tracker: UsageTracker = None):
+    """Create the LangChain callback handler recording the LLM calls in `tracker`.
+
+    Args:
+        tracker (UsageTracker): Defaults to the usage tracker of the application.
+    """
+    return _get_callback_handler_class()(tracker or get_usage_tracker())
@@ -1,25 +1,24 @@
-from typing import Union
+from typing import TYPE_CHECKING, Union
 from pathlib import Path
-import base64
-import pandas as pd
-import json
-import io
-from langchain import hub
-from langchain_core.prompts.prompt import PromptTemplate
-from langchain_core.prompts.chat import ChatPromptTemplate, SystemMessagePromptTemplate
-from langchain.memory import ConversationBufferMemory
-from langchain.chains.question_answering import load_qa_chain
+from bookjibe.chapter_index import ChapterIndex
+from bookjibe.prompt_library import read_prompt_file
+from bookjibe.usage import track_usage
 
+if TYPE_CHECKING:
+    from langchain.memory import ConversationBufferMemory
+    from langchain_core.prompts.chat import ChatPromptTemplate
 
 
 def get_prompt():
-    prompt = hub.pull("hwchase17/openai-functions-agent")
-    prompt.input_variables = ["agent_scratchpad", "input", "context"]
+    from bookjibe.prompts import get_prompt_template
+
+    prompt = get_prompt_template("hwchase17/openai-functions-agent")
+    prompt.input_variables = ["agent_scratchpad", "input", "context", "chat_history"]
     return prompt
 
 
 def create_chain_from_memory_and_prompt(
-    llm, prompt: ChatPromptTemplate, memory: ConversationBufferMemory = None
+    llm, prompt: "ChatPromptTemplate", memory: "ConversationBufferMemory" = None
 ):
     """Create a chain from a memory and a prompt.
 
@@ -31,24 +30,49 @@ def create_chain_from_memory_and_prompt(
     Returns:
         Chain: The chain that can be used to generate the next chapter.
     """
+    from langchain.chains.question_answering import load_qa_chain
+    from bookjibe.memory import BookMemory
+
     if memory is None:
-        memory = ConversationBufferMemory(memory_key="chat_history", input_key="input")
+        memory = BookMemory()
     chain = load_qa_chain(llm, chain_type="stuff", memory=memory, prompt=prompt)
     return chain
 
 
+def render_chain_messages(chain, inputs, history=None):
+    """Render the messages that a "stuff" chain would send to its LLM.
+
+    Args:
+        chain (StuffDocumentsChain): The chain, as created by `create_chain_from_memory_and_prompt`.
+        inputs (dict): The inputs that would be given to `chain.invoke`.
+        history (list): The messages of the history, instead of the ones of the memory of the chain.
+
+    Returns:
+        list: The messages of the prompt.
+    """
+    inputs = dict(inputs)
+    if history is not None:
+        inputs[chain.memory.memory_key] = history
+    elif chain.memory is not None:
+        inputs.update(chain.memory.load_memory_variables(inputs))
+    docs = inputs.pop(chain.input_key, [])
+    llm_inputs = chain._get_inputs(docs, **inputs)
+    prompts, _ = chain.llm_chain.prep_prompts([llm_inputs])
+    return prompts[0].to_messages()
+
+
 def get_human_prompt_from_file(file_path: Union[str, Path]):
     """Load the prompt from a file.
 
+    The files of the prompt folders are read from memory, see `bookjibe.prompt_library`.
+
     Args:
         file_path (str): The path to the file where the prompt is saved.
 
     Returns:
         str: The prompt to be used for the next chapter.
     """
-    with open(file_path, "r") as f:
-        human_prompt = f.read()
-    return human_prompt
+    return read_prompt_file(file_path)
 
 def check_if_name_in_message(messages):
     """Check if the name attribute is in the messages and is either "synopsis" or "chapterX" where X is any integer starting from 1."""
@@ -69,59 +93,70 @@ def get_last_chapter_number_from_messages(messages):
     If no AIMessage is found return 0.
 
     """
-    if check_if_name_in_message(messages):
-        max_chapter = 0
-        for message in messages:
-            if hasattr(message, "name") and message.name is not None and message.name.startswith("chapter"):
-                current_chapter = int(message.name.replace("chapter", ""))
-                if current_chapter > max_chapter:
-                    max_chapter = current_chapter
-        return max_chapter
-    else:
-        return 0
-        # return len([message for message in messages if message["type"] == "AIMessage"]) - 1
-
-def parse_file_contents(contents, filename):
-    """Parse the contents of a JSON file."""
-    content_type, content_string = contents.split(",")
-    decoded = base64.b64decode(content_string)
-    try:
-        if "json" in filename:
-            # Assume that the user uploaded a JSON file
-            return json.loads(decoded)
-        elif "csv" in filename:
-            # Assume that the user uploaded a CSV file
-            return pd.read_csv(io.StringIO(decoded.decode("utf-8")))
-    except Exception as e:
-        print(e)
-        return None
-
-def generate_prompt_logic(system_prompt_file, prompt_text, init_prompt_folder, output_name, llm, language):
-    """Generate the prompt logic."""
-    from langchain import hub
-    prompt_template = hub.pull("hwchase17/openai-functions-agent")
-    if language == "fr":
-        agree_message = "Oui cela me convient."
-    elif language == "en":
-        agree_message = "Yes, that works for me."
-    with open(system_prompt_file, "r") as f:
-        system_prompt_string = f.read()
+    return ChapterIndex().sync(messages).max_chapter
+
+agree_message = {
+    "fr": "Oui cela me convient.",
+    "en": "Yes, that works for me.",
+}
+
+
+def _prompt_generator_template(system_prompt_file):
+    """Get the prompt template of the prompt generator, with the system prompt of the file."""
+    from langchain_core.prompts.prompt import PromptTemplate
+    from langchain_core.prompts.chat import SystemMessagePromptTemplate
+    from bookjibe.prompts import get_prompt_template
+
+    prompt_template = get_prompt_template("hwchase17/openai-functions-agent")
+    system_prompt_string = read_prompt_file(system_prompt_file)
     system_prompt_template = SystemMessagePromptTemplate(
         prompt=PromptTemplate(input_variables=[], 
                             template=system_prompt_string))
     
     prompt_template.messages[0] = system_prompt_template
-    chain = prompt_template | llm 
-    ai_message = chain.invoke({'input': f"/PromptGenerator J'aimerais écrire un {prompt_text}", 'agent_scratchpad': []})
-    not_formatted_file = f"{init_prompt_folder}/{output_name}_specifications.txt"
-    formatted_file = f"{init_prompt_folder}/{output_name}_prompt.txt"
+    return prompt_template
 
+
+def _save_prompt_specifications(prompt_template, ai_message, init_prompt_folder, output_name):
+    """Save the specifications written by the prompt generator, and add them to the conversation."""
+    not_formatted_file = f"{init_prompt_folder}/{output_name}_specifications.txt"
     with open(not_formatted_file, "w") as f:
         f.write(ai_message.content)
     ai_message_rewritten = ai_message
     ai_message_rewritten.content = ai_message.content.replace("\n", " ")
     prompt_template.messages.append(ai_message_rewritten) 
-    chain_2 = prompt_template | llm
-    ai_message2 = chain_2.invoke({'input': agree_message, 'agent_scratchpad': []})
+
+
+def _save_prompt(ai_message, init_prompt_folder, output_name):
+    formatted_file = f"{init_prompt_folder}/{output_name}_prompt.txt"
     with open(formatted_file, "w") as f:
-        f.write(ai_message2.content)
\ No newline at end of file
+        f.write(ai_message.content)
+
+
+@track_usage("generate_prompt_logic")
+def generate_prompt_logic(system_prompt_file, prompt_text, init_prompt_folder, output_name, llm, language, on_progress=None):
+    """Generate the prompt logic.
+
+    `on_progress(progress, message)` is called, if given, once the specifications are written.
+    """
+    prompt_template = _prompt_generator_template(system_prompt_file)
+    chain = prompt_template | llm 
+    ai_message = chain.invoke({'input': f"/PromptGenerator J'aimerais écrire un {prompt_text}", 'agent_scratchpad': []})
+    _save_prompt_specifications(prompt_template, ai_message, init_prompt_folder, output_name)
+    if on_progress is not None:
+        on_progress(0.5, "Writing the prompt...")
+    chain_2 = prompt_template | llm
+    ai_message2 = chain_2.invoke({'input': agree_message[language], 'agent_scratchpad': []})
+    _save_prompt(ai_message2, init_prompt_folder, output_name)
+
+
+@track_usage("generate_prompt_logic")
+async def agenerate_prompt_logic(system_prompt_file, prompt_text, init_prompt_folder, output_name, llm, language):
+    """Generate the prompt logic, like `generate_prompt_logic`, without blocking while the LLM answers."""
+    prompt_template = _prompt_generator_template(system_prompt_file)
+    chain = prompt_template | llm 
+    ai_message = await chain.ainvoke({'input': f"/PromptGenerator J'aimerais écrire un {prompt_text}", 'agent_scratchpad': []})
+    _save_prompt_specifications(prompt_template, ai_message, init_prompt_folder, output_name)
+    chain_2 = prompt_template | llm
+    ai_message2 = await chain_2.ainvoke({'input': agree_message[language], 'agent_scratchpad': []})
+    _save_prompt(ai_message2, init_prompt_folder, output_name)
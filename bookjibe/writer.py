@@ -1,27 +1,69 @@
-from langchain.docstore.document import Document
-from langchain.memory import ConversationBufferMemory
-from bookjibe.llm import llm
-from langchain_core.messages import AIMessage, HumanMessage
 from pathlib import Path
+import asyncio
 import copy
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from pprint import pprint
-from typing import Union
+from typing import TYPE_CHECKING, Union
 import json
-import base64
-import pickle
-from bookjibe.settings import init_prompt_folder, language, temporary_folder
+from bookjibe.chapter_index import ChapterIndex
+from bookjibe.serialization import dump_book_state, load_book_state
+from bookjibe.settings import (
+    context_output_tokens,
+    context_trim_policy,
+    init_prompt_folder,
+    language,
+    memory_max_tokens,
+    memory_strategy,
+    memory_window_chapters,
+    openai_model,
+    prompt_layout,
+    temporary_folder,
+)
+from bookjibe.usage import track_usage
 from bookjibe.utils import (
     get_prompt,
     create_chain_from_memory_and_prompt,
     get_human_prompt_from_file,
-    get_last_chapter_number_from_messages,
+    render_chain_messages,
 )
 
+if TYPE_CHECKING:
+    from langchain.memory import ConversationBufferMemory
+
+# The chat model of the writers. When None, the default one of `bookjibe.llm` is created on first use.
+llm = None
+
+
+def _get_llm():
+    if llm is None:
+        from bookjibe.llm import get_default_llm
+
+        return get_default_llm()
+    return llm
+
+
+def _human_message(name, content):
+    from langchain_core.messages import HumanMessage
+
+    return HumanMessage(name=name, content=content)
+
+
+def _ai_message(name, content):
+    from langchain_core.messages import AIMessage
+
+    return AIMessage(name=name, content=content)
+
 init_chapter_prompt = {
     "en": "Write a section of chapter XXX of the story.",
     "fr": "Ecris une section de chapitre XXX de l'histoire.",
 }
 
+summary_prompt = {
+    "en": "Summarize this chapter of the story in a few sentences, keeping the names, places and events needed to write the next chapters:",
+    "fr": "Résume ce chapitre de l'histoire en quelques phrases, en gardant les noms, les lieux et les événements nécessaires pour écrire les chapitres suivants :",
+}
+
 
 def create_writer_from_book_data(book_data):
     """Generate a writer from the book data.
@@ -54,20 +96,86 @@ def create_writer_from_book_data(book_data):
     """
     writer = Writer()
     for item_name, item_value in book_data.items():
-        writer.chain.memory.chat_memory.messages.append(
-            HumanMessage(name=item_name, content=item_value["human_message"])
+        writer.initial_memory.chat_memory.messages.append(
+            _human_message(item_name, item_value["human_message"])
         )
-        writer.chain.memory.chat_memory.messages.append(
-            AIMessage(name=item_name, content=item_value["ai_message"])
+        writer.initial_memory.chat_memory.messages.append(
+            _ai_message(item_name, item_value["ai_message"])
         )
     return writer
 
-def serialize_writer(writer):
-    return base64.b64encode(pickle.dumps(writer)).decode("utf-8")
+def serialize_writer(writer, compression: str = "none"):
+    """Serialize the book of a writer in the compact format of `bookjibe.serialization`.
+
+    The book is not compressed by default: compressing it makes the payload about 5 times
+    smaller, but it is slower to dump and to load than the uncompressed one.
+    """
+    return dump_book_state(writer.to_state(), compression=compression)
 
 
 def deserialize_writer(serialized_writer):
-    return pickle.loads(base64.b64decode(serialized_writer))
+    """Rebuild a writer from the output of `serialize_writer`."""
+    return Writer.from_state(load_book_state(serialized_writer))
+
+def _trimmed_chapters(history, trimmed_history):
+    """Compare the history of a prompt before and after it was trimmed.
+
+    Returns:
+        tuple: The names of the chapters replaced by their summaries, and of the chapters dropped.
+    """
+    names = [message.name for message in history if message.type == "ai"]
+    full_names = {message.name for message in history if message.type == "human"}
+    kept_names = {message.name for message in trimmed_history}
+    kept_full_names = {message.name for message in trimmed_history if message.type == "human"}
+    summarized = [
+        name
+        for name in names
+        if name in full_names and name in kept_names and name not in kept_full_names
+    ]
+    dropped = [name for name in names if name not in kept_names]
+    return summarized, dropped
+
+
+def _candidate_requests(number_of_versions, max_requests=3):
+    """Plan the requests of the "multi_candidate" mode, see `Writer.generate_chapter_versions`.
+
+    It is a generator shared by the sync and the async modes: it yields the number of
+    completions to ask for and the number of the request, and is sent back the texts of the
+    completions. The duplicated texts are dropped, and the missing versions are asked again,
+    up to `max_requests` requests. Each request is sent under its own `llm_cache_variant`, so
+    that it is not answered with the cached completions of the previous one.
+
+    Returns:
+        list: The `number_of_versions` distinct texts, as the value of the `StopIteration`.
+
+    Raises:
+        RuntimeError: If the model did not give enough distinct completions.
+    """
+    candidates = []
+    for request in range(1, max_requests + 1):
+        texts = yield number_of_versions - len(candidates), request
+        for text in texts:
+            if text not in candidates:
+                candidates.append(text)
+        if len(candidates) >= number_of_versions:
+            return candidates[:number_of_versions]
+    raise RuntimeError(
+        f"The model gave {len(candidates)} distinct versions out of {number_of_versions} "
+        f"in {max_requests} requests"
+    )
+
+
+def _candidate_versions(inputs, candidates):
+    """Build the outputs of `Writer.generate_chapter_versions` from the texts of the versions."""
+    versions = {}
+    ai_messages = {}
+    human_messages = {}
+    for i, candidate in enumerate(candidates, start=1):
+        versions[i] = {**inputs, "output_text": candidate}
+        ai_messages[i] = candidate
+        human_messages[i] = inputs["input"]
+    return versions, ai_messages, human_messages
+
 
 def get_serialized_writer():
     writer = Writer()
@@ -80,30 +188,127 @@ def get_writer():
 
 class Writer:
     _chain = None
+    _chapter_index = None
+    # The journal where the changes of the book are saved, see `bookjibe.journal`
+    journal = None
+    # The id of the book, to account its LLM calls, see `bookjibe.usage`
+    book_id = None
 
-    def __init__(self, initial_memory: ConversationBufferMemory = None):
+    def __init__(self, initial_memory: "ConversationBufferMemory" = None):
         # self.llm = llm
         if initial_memory is None:
-            initial_memory = ConversationBufferMemory(memory_key="chat_history", input_key="input")
+            from bookjibe.memory import BookMemory
+
+            initial_memory = BookMemory(
+                strategy=memory_strategy,
+                window_chapters=memory_window_chapters,
+                max_tokens=memory_max_tokens,
+                stable_prefix=prompt_layout == "stable",
+            )
         self.initial_memory = initial_memory
         self.prompt = self._generate_prompt()
 
+    @property
+    def initial_memory(self):
+        return self._initial_memory
+
+    @initial_memory.setter
+    def initial_memory(self, memory: "ConversationBufferMemory"):
+        self._initial_memory = memory
+        self._chain = None
+
+    @property
+    def prompt(self):
+        return self._prompt
+
+    @prompt.setter
+    def prompt(self, prompt):
+        self._prompt = prompt
+        self._chain = None
+
     @property
     def chain(self):
-        if self._chain:
-            return self._chain
-        else:
-            return create_chain_from_memory_and_prompt(
-                llm=llm, prompt=self.prompt, memory=self.initial_memory
+        """The chain of the writer.
+
+        It is built on first access, and rebuilt when the memory or the prompt is replaced.
+        Building it creates the LLM client, so it is only used to call the model: the messages of
+        the book are read and written through `initial_memory`.
+        """
+        if self._chain is None:
+            self._chain = create_chain_from_memory_and_prompt(
+                llm=_get_llm(), prompt=self.prompt, memory=self.initial_memory
             )
+        return self._chain
+
+    def __getstate__(self):
+        # The chain is rebuilt from the memory and the prompt when needed
+        state = self.__dict__.copy()
+        state.pop("_chain", None)
+        state.pop("_chapter_index", None)
+        state.pop("journal", None)
+        return state
+
+    @property
+    def chapter_index(self):
+        """The index of the chapters in the messages of the book, see `ChapterIndex`."""
+        if self._chapter_index is None:
+            self._chapter_index = ChapterIndex()
+        return self._chapter_index.sync(self.initial_memory.chat_memory.messages)
 
     def _generate_prompt(self):
         return get_prompt()
 
-    def generate_book_story(
-        self, init_prompt_file: Union[str, Path], story_prompt: str
-    ):
-        """Generate a book idea using a chain."""
+    def to_state(self):
+        """Get the state of the book: its metadata and its ordered (name, human message, AI message) pairs.
+
+        Only the content of the book is kept, not the langchain objects, see `from_state`.
+        """
+        messages = self.initial_memory.chat_memory.messages
+        if len(messages) % 2:
+            raise ValueError("The book messages are not human/AI message pairs")
+        pairs = [
+            (human_message.name, human_message.content, ai_message.content)
+            for human_message, ai_message in zip(messages[::2], messages[1::2])
+        ]
+        metadata = {}
+        summaries = getattr(self.initial_memory, "summaries", None)
+        if summaries:
+            metadata["summaries"] = dict(summaries)
+        return {"metadata": metadata, "pairs": pairs}
+
+    @classmethod
+    def from_state(cls, state):
+        """Create a writer from the state of a book, as returned by `to_state`."""
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        writer = cls()
+        memory = writer.initial_memory
+        # The messages were validated when they were added to the book, they are rebuilt
+        # without validating them again
+        for name, human_message, ai_message in state["pairs"]:
+            memory.chat_memory.messages.append(
+                HumanMessage.construct(name=name, content=human_message)
+            )
+            memory.chat_memory.messages.append(AIMessage.construct(name=name, content=ai_message))
+        if "summaries" in state["metadata"]:
+            memory.summaries.update(state["metadata"]["summaries"])
+        return writer
+
+    @classmethod
+    def from_journal(cls, journal):
+        """Create a writer from the journal of a book. The next changes are saved in the journal."""
+        writer = cls.from_state(journal.load_state())
+        writer.journal = journal
+        writer.book_id = journal.path.stem
+        return writer
+
+    def _journal_last_pair(self):
+        if self.journal is not None:
+            human_message, ai_message = self.initial_memory.chat_memory.messages[-2:]
+            self.journal.add(ai_message.name, human_message.content, ai_message.content)
+
+    def _book_story_inputs(self, init_prompt_file, story_prompt):
+        """Build the chain inputs used to generate the book story."""
         print("Generating book story...")
         print(f"Init prompt file: {init_prompt_file}")
         init_prompt = get_human_prompt_from_file(
@@ -111,64 +316,96 @@ class Writer:
         )
         print("Init prompt:", init_prompt)
         print("Story prompt:", story_prompt)
-        return self.chain.invoke(
-            {
-                "input": f"{init_prompt} {story_prompt}",
-                "agent_scratchpad": [],
-                "input_documents": [],
-            }
-        )
+        return {
+            "input": f"{init_prompt} {story_prompt}",
+            "agent_scratchpad": [],
+            "input_documents": [],
+        }
+
+    @track_usage("generate_book_story")
+    def generate_book_story(
+        self, init_prompt_file: Union[str, Path], story_prompt: str
+    ):
+        """Generate a book idea using a chain."""
+        inputs = self._book_story_inputs(init_prompt_file, story_prompt)
+        _, memory, _ = self._fit_context(inputs)
+        response = self._call_chain(memory).invoke(inputs)
+        self._journal_last_pair()
+        return response
+
+    @track_usage("generate_book_story")
+    async def agenerate_book_story(
+        self, init_prompt_file: Union[str, Path], story_prompt: str
+    ):
+        """Generate a book idea, like `generate_book_story`, without blocking while the LLM answers."""
+        inputs = self._book_story_inputs(init_prompt_file, story_prompt)
+        _, memory, _ = await asyncio.to_thread(self._fit_context, inputs)
+        response = await self._call_chain(memory).ainvoke(inputs)
+        self._journal_last_pair()
+        return response
     
     def get_last_chapter_number(self):
-        messages = self.chain.memory.chat_memory.messages
-        return get_last_chapter_number_from_messages(messages)
+        return self.chapter_index.max_chapter
 
-    
     def get_chapter_numbers_list(self):
         """Get the list of chapter numbers from the messages. If there are no chapters, return an empty list."""
-        messages = self.chain.memory.chat_memory.messages
-        chapters = []
-        for message in messages:
-            if isinstance(message, AIMessage):
-                chapters.append(message.name)
-        return chapters
+        return list(self.chapter_index.ai_names)
 
     def get_chapter_ai_message(self, chapter_number):
         """Get the AI message of the chapter with the given number from the messages. If the chapter does not exist, return None."""
-        messages = self.chain.memory.chat_memory.messages
-        for message in messages:
-            if isinstance(message, AIMessage) and message.name == f"chapter{chapter_number}":
-                return message.content
-        return None
-    
+        i = self.chapter_index.ai_message_position(chapter_number)
+        if i is None:
+            return None
+        return self.initial_memory.chat_memory.messages[i].content
+
     def get_chapter_human_message(self, chapter_number):
         """Get the human message of the chapter with the given number from the messages. If the chapter does not exist, return None."""
-        messages = self.chain.memory.chat_memory.messages
-        for message in messages:
-            if isinstance(message, HumanMessage) and message.name == f"chapter{chapter_number}":
-                return message.content
-        return None
+        i = self.chapter_index.human_message_position(chapter_number)
+        if i is None:
+            return None
+        return self.initial_memory.chat_memory.messages[i].content
 
     def get_chapter(self, chapter_number):
         """Get the chapter with the given number from the messages. If the chapter does not exist, return None."""
-        messages = self.chain.memory.chat_memory.messages
-        for message in messages:
-            if isinstance(message, AIMessage) and message.name == f"chapter{chapter_number}":
-                return {"name": message.name, "content": message.content}
-        return None
-    
+        i = self.chapter_index.ai_message_position(chapter_number)
+        if i is None:
+            return None
+        message = self.initial_memory.chat_memory.messages[i]
+        return {"name": message.name, "content": message.content}
+
     def update_chapter_ai_message(self, chapter_number, current_chapter_text):
         """Update the AI message of the chapter with the given number in the messages."""
-        messages = self.chain.memory.chat_memory.messages
-        for i, message in enumerate(messages):
-            if isinstance(message, AIMessage) and message.name == f"chapter{chapter_number}":
-                print("within update\n", current_chapter_text)
-                messages[i] = AIMessage(name=f"chapter{chapter_number}", content=current_chapter_text)
-                break
-        print("messages\n", messages[i])
-        self.chain.memory.chat_memory.messages = messages
+        chapter_index = self.chapter_index
+        i = chapter_index.ai_message_position(chapter_number)
+        if i is not None:
+            chapter_index.replace_message(
+                i, _ai_message(f"chapter{chapter_number}", current_chapter_text)
+            )
+            if self.journal is not None:
+                self.journal.update(f"chapter{chapter_number}", current_chapter_text)
+            # The summary is outdated, it is computed again before the next generation
+            getattr(self.initial_memory, "summaries", {}).pop(f"chapter{chapter_number}", None)
         return self
-    
+
+    @track_usage("summarize_chapter")
+    def summarize_chapter(self, chapter_number):
+        """Compute the summary of a chapter and cache it in the memory.
+
+        The summaries replace the older chapters in the prompt with the "summary" memory strategy.
+        They are computed before the next generation, once the chapters are out of the window,
+        see `_fit_context`, so that accepting or editing a chapter does not wait for the LLM.
+        """
+        content = self.get_chapter_ai_message(chapter_number)
+        if content is None:
+            return None
+        summary = _get_llm().invoke(
+            [_human_message(None, f"{summary_prompt[language]}\n\n{content}")]
+        ).content
+        self.initial_memory.summaries[f"chapter{chapter_number}"] = summary
+        if self.journal is not None:
+            self.journal.summary(f"chapter{chapter_number}", summary)
+        return summary
+
     def save_book_to_file(self, file_path: Union[str, Path]):
         """Save the book to a file.
 
@@ -177,8 +414,8 @@ class Writer:
             chain (Chain): The chain that was used to generate the book.
 
         """
-        book = self.chain.memory.chat_memory.messages
-        chapters = [i.content for i in book if isinstance(i, AIMessage)]
+        book = self.initial_memory.chat_memory.messages
+        chapters = [i.content for i in book if i.type == "ai"]
 
         with open(file_path, "w") as f:
             f.write("\n".join(chapters))
@@ -216,16 +453,16 @@ class Writer:
         }
         """
         history = {}
-        messages = self.chain.memory.chat_memory.messages
+        messages = self.initial_memory.chat_memory.messages
         chapter_counter = 1
         for i, message in enumerate(messages):
-            if i < 2 and isinstance(message, AIMessage): # skip the first two messages which are the initial prompt and the first AI message, it describes the story but it is not the story itself.
+            if i < 2 and message.type == "ai": # skip the first two messages which are the initial prompt and the first AI message, it describes the story but it is not the story itself.
                 history["synopsys"] = {
                     "human_message": messages[i - 1].content,
                     "ai_message": message.content,
                 }
                  
-            if i>=2 and isinstance(message, AIMessage):
+            if i>=2 and message.type == "ai":
                 history[f"chapter{chapter_counter}"] = {
                     "human_message": messages[i - 1].content,
                     "ai_message": message.content,
@@ -236,31 +473,188 @@ class Writer:
         # with open(file_path, "w") as f:
         #     f.write(history)
 
-    def generate_chapter_versions(self, chapter_prompt, chapter, number_of_versions=2):
+    def _chapter_inputs(self, chapter_prompt, chapter):
+        """Build the chain inputs used to generate a version of the given chapter."""
+        from langchain_core.documents import Document
+
+        init_chapter_prompt_txt = init_chapter_prompt[language].replace(
+            "XXX", str(chapter)
+        )
+        return {
+            "input": f"{init_chapter_prompt_txt} {chapter_prompt}",
+            "agent_scratchpad": [],
+            "input_documents": [
+                Document(page_content=chapter_prompt, metadata={"source": "local"})
+            ],
+        }
+
+    def _fit_context(self, inputs):
+        """Fit the prompt of a call in the context window of the model, before it is sent.
+
+        If the prompt is too long, the oldest chapters of the history are replaced by their
+        summaries or dropped, see `bookjibe.memory.BookMemory.history_messages`. With the
+        "summarize" policy (`BOOKJIBE_CONTEXT_TRIM_POLICY`), the missing summaries are computed
+        first; with the "drop" policy, only the existing summaries are used.
+        With the "summary" memory strategy, the chapters that left the window since the last
+        call are summarized first, see `summarize_chapter`.
+        The memory of the book is left as it is, so that the calls of a writer shared by
+        several requests do not change each other's history.
+
+        Args:
+            inputs (dict): The inputs that will be given to the chain.
+
+        Returns:
+            tuple: The messages of the prompt, the memory to give to the chain of the call
+                (the memory of the book, or a copy of it that trims the history, see
+                `_call_chain`) and what was trimmed, as a dict with the "prompt_tokens",
+                "limit", "summarized" and "dropped" keys.
+
+        Raises:
+            ContextWindowError: If the prompt does not fit, even without its history.
+        """
+        from bookjibe.tokens import ContextWindowError, count_message_tokens, get_context_window
+
+        chain = self.chain
+        memory = self.initial_memory
+        if hasattr(memory, "missing_summaries"):
+            for name in memory.missing_summaries():
+                if name.startswith("chapter"):
+                    self.summarize_chapter(int(name[len("chapter") :]))
+        model = getattr(_get_llm(), "model_name", None) or openai_model
+        limit = get_context_window(model) - context_output_tokens
+        can_trim = hasattr(memory, "history_messages")
+        history = memory.history_messages(model=model) if can_trim else None
+        messages = render_chain_messages(chain, inputs, history)
+        prompt_tokens = count_message_tokens(messages, model)
+        report = {"prompt_tokens": prompt_tokens, "limit": limit, "summarized": [], "dropped": []}
+        if prompt_tokens <= limit:
+            return messages, memory, report
+        if not can_trim:
+            raise ContextWindowError(
+                f"The prompt has {prompt_tokens} tokens, more than the {limit} tokens available"
+            )
+
+        context_tokens = limit - (prompt_tokens - count_message_tokens(history, model))
+        if context_trim_policy == "summarize":
+            # Summarize the chapters that do not fit, so that their summaries replace them
+            _, dropped = _trimmed_chapters(history, memory.history_messages(context_tokens, model))
+            for name in dropped:
+                if name and name.startswith("chapter") and name not in memory.summaries:
+                    self.summarize_chapter(int(name[len("chapter") :]))
+        # The tokens may be counted differently for the model, tighten the budget if needed
+        for _ in range(3):
+            if context_tokens < 0:
+                break
+            trimmed_history = memory.history_messages(context_tokens, model)
+            messages = render_chain_messages(chain, inputs, trimmed_history)
+            prompt_tokens = count_message_tokens(messages, model)
+            if prompt_tokens <= limit:
+                break
+            context_tokens -= prompt_tokens - limit
+        if prompt_tokens > limit or context_tokens < 0:
+            raise ContextWindowError(
+                f"The prompt does not fit in the {limit} tokens available, even without its history"
+            )
+
+        summarized, dropped = _trimmed_chapters(history, trimmed_history)
+        report.update(prompt_tokens=prompt_tokens, summarized=summarized, dropped=dropped)
+        print(
+            f"The prompt was trimmed to {prompt_tokens} tokens to fit the context window of {model}. "
+            f"Summarized: {summarized}. Dropped: {dropped}."
+        )
+        # The copy shares the messages of the book, so that the chain still adds its answer to them
+        return messages, memory.copy(update={"context_tokens": context_tokens, "model": model}), report
+
+    def _call_chain(self, memory):
+        """Get the chain of a call, with the memory returned by `_fit_context`."""
+        if memory is self.initial_memory:
+            return self.chain
+        return create_chain_from_memory_and_prompt(llm=_get_llm(), prompt=self.prompt, memory=memory)
+
+    def _snapshot_chain(self, memory=None):
+        """Create a chain bound to a copy of the memory of the book, or of `memory`.
+
+        The copy can be invoked without touching the messages of the book.
+        """
+        from langchain.memory import ChatMessageHistory
+
+        if memory is None:
+            memory = self.initial_memory
+        snapshot = memory.copy(
+            update={
+                "chat_memory": ChatMessageHistory(
+                    messages=list(memory.chat_memory.messages)
+                )
+            }
+        )
+        return create_chain_from_memory_and_prompt(
+            llm=_get_llm(), prompt=self.prompt, memory=snapshot
+        )
+
+    @track_usage("generate_chapter_versions")
+    def generate_chapter_versions(
+        self, chapter_prompt, chapter, number_of_versions=2, mode="sequential"
+    ):
         """Generate versions for the next chapter of the book.
-        
+
         Args:
             chapter_prompt (str): The prompt to be used for the chapter.
             chapter (int): The number of the current chapter.
+            number_of_versions (int): The number of versions to generate.
+            mode (str): How the versions are generated.
+                "sequential" invokes the chain once per version, one after the other.
+                "concurrent" sends all the requests at once, each one against a snapshot
+                of the memory, so that it takes about one LLM round-trip.
+                "multi_candidate" sends the prompt once and asks the LLM for all the
+                versions as completions of that single request (`n` parameter).
+
+        Returns:
+            tuple: The chain outputs, the AI messages and the human messages, each as a dict
+                keyed by the version number (starting from 1).
         """
-        chain = self.chain
-        init_chapter_prompt_txt = init_chapter_prompt[language].replace(
-            "XXX", str(chapter)
-        )
+        from bookjibe.cache import llm_cache_variant
+
+        inputs = self._chapter_inputs(chapter_prompt, chapter)
+        messages, memory, _ = self._fit_context(inputs)
         versions = {}
         ai_messages = {}
         human_messages = {}
 
+        def invoke_version(chain, version):
+            # Each version has its own cached response
+            with llm_cache_variant(version):
+                return chain.invoke(inputs)
+
+        if mode == "concurrent":
+            chains = [self._snapshot_chain(memory) for _ in range(number_of_versions)]
+            with ThreadPoolExecutor(max_workers=number_of_versions) as executor:
+                futures = [
+                    executor.submit(copy_context().run, invoke_version, chain, i)
+                    for i, chain in enumerate(chains, start=1)
+                ]
+                for i, future in enumerate(futures, start=1):
+                    versions[i] = future.result()
+                    ai_messages[i] = versions[i]["output_text"]
+                    human_messages[i] = versions[i]["input"]
+            return versions, ai_messages, human_messages
+        elif mode == "multi_candidate":
+            from bookjibe.llm import generate_candidates
+
+            requests = _candidate_requests(number_of_versions)
+            try:
+                n, request = next(requests)
+                while True:
+                    with llm_cache_variant(("candidates", request)):
+                        texts = generate_candidates(messages, n=n, chat_model=_get_llm())
+                    n, request = requests.send(texts)
+            except StopIteration as stop:
+                return _candidate_versions(inputs, stop.value)
+        elif mode != "sequential":
+            raise ValueError(f"Unknown generation mode: {mode}")
+
+        chain = self._call_chain(memory)
         for i in range(1, number_of_versions + 1):
-            versions[i] = chain.invoke(
-                {
-                    "input": f"{init_chapter_prompt_txt} {chapter_prompt}",
-                    "agent_scratchpad": [],
-                    "input_documents": [
-                        Document(page_content=chapter_prompt, metadata={"source": "local"})
-                    ],
-                }
-            )
+            versions[i] = invoke_version(chain, i)
             ai_message = chain.memory.chat_memory.messages.pop(-1)
             ai_messages[i] = ai_message.content
             human_message = chain.memory.chat_memory.messages.pop(-1) 
@@ -268,14 +662,161 @@ class Writer:
 
         return versions, ai_messages, human_messages
 
+    @track_usage("generate_chapter_versions")
+    def stream_chapter_versions(
+        self, chapter_prompt, chapter, number_of_versions=2, on_token=None
+    ):
+        """Generate versions for the next chapter of the book, token by token.
+
+        The versions are streamed concurrently from the LLM, and `on_token` is called
+        with the version number and the new piece of text as soon as it is received.
+        Like the "concurrent" mode of `generate_chapter_versions`, the memory is left untouched.
+
+        Args:
+            chapter_prompt (str): The prompt to be used for the chapter.
+            chapter (int): The number of the current chapter.
+            number_of_versions (int): The number of versions to generate.
+            on_token (callable): Called as `on_token(version, token)` for each streamed token.
+
+        Returns:
+            tuple: The same as `generate_chapter_versions`.
+        """
+        from bookjibe.cache import llm_cache_variant
+
+        inputs = self._chapter_inputs(chapter_prompt, chapter)
+        messages, _, _ = self._fit_context(inputs)
+        chat_model = _get_llm()
+
+        def stream_version(version):
+            text = ""
+            # Each version is a request of its own, like in `generate_chapter_versions`
+            with llm_cache_variant(version):
+                for chunk in chat_model.stream(messages):
+                    text += chunk.content
+                    if on_token is not None:
+                        on_token(version, chunk.content)
+            return text
+
+        versions = {}
+        ai_messages = {}
+        human_messages = {}
+        with ThreadPoolExecutor(max_workers=number_of_versions) as executor:
+            futures = {
+                i: executor.submit(copy_context().run, stream_version, i)
+                for i in range(1, number_of_versions + 1)
+            }
+            for i, future in futures.items():
+                ai_messages[i] = future.result()
+                human_messages[i] = inputs["input"]
+                versions[i] = {**inputs, "output_text": ai_messages[i]}
+        return versions, ai_messages, human_messages
+
+    @track_usage("generate_chapter_versions")
+    async def agenerate_chapter_versions(
+        self, chapter_prompt, chapter, number_of_versions=2, mode="sequential"
+    ):
+        """Generate versions for the next chapter of the book, without blocking while the LLM answers.
+
+        It is the coroutine version of `generate_chapter_versions`, with the same modes, default
+        mode and outputs. In the "concurrent" mode, the versions are awaited together with `asyncio.gather`.
+        """
+        from bookjibe.cache import llm_cache_variant
+
+        inputs = self._chapter_inputs(chapter_prompt, chapter)
+        messages, memory, _ = await asyncio.to_thread(self._fit_context, inputs)
+        versions = {}
+        ai_messages = {}
+        human_messages = {}
+
+        async def invoke_version(chain, version):
+            # Each version has its own cached response
+            with llm_cache_variant(version):
+                return await chain.ainvoke(inputs)
+
+        if mode == "concurrent":
+            chains = [self._snapshot_chain(memory) for _ in range(number_of_versions)]
+            results = await asyncio.gather(
+                *(invoke_version(chain, i) for i, chain in enumerate(chains, start=1))
+            )
+            for i, result in enumerate(results, start=1):
+                versions[i] = result
+                ai_messages[i] = result["output_text"]
+                human_messages[i] = result["input"]
+            return versions, ai_messages, human_messages
+        elif mode == "multi_candidate":
+            from bookjibe.llm import agenerate_candidates
+
+            requests = _candidate_requests(number_of_versions)
+            try:
+                n, request = next(requests)
+                while True:
+                    with llm_cache_variant(("candidates", request)):
+                        texts = await agenerate_candidates(messages, n=n, chat_model=_get_llm())
+                    n, request = requests.send(texts)
+            except StopIteration as stop:
+                return _candidate_versions(inputs, stop.value)
+        elif mode != "sequential":
+            raise ValueError(f"Unknown generation mode: {mode}")
+
+        chain = self._call_chain(memory)
+        for i in range(1, number_of_versions + 1):
+            versions[i] = await invoke_version(chain, i)
+            ai_message = chain.memory.chat_memory.messages.pop(-1)
+            ai_messages[i] = ai_message.content
+            human_message = chain.memory.chat_memory.messages.pop(-1)
+            human_messages[i] = human_message.content
+
+        return versions, ai_messages, human_messages
+
+    @track_usage("generate_chapter_versions")
+    async def astream_chapter_versions(
+        self, chapter_prompt, chapter, number_of_versions=2, on_token=None
+    ):
+        """Generate versions for the next chapter of the book, token by token, like `stream_chapter_versions`.
+
+        The versions are streamed together from the event loop. `on_token` may be a function
+        or a coroutine function.
+        """
+        from bookjibe.cache import llm_cache_variant
+
+        inputs = self._chapter_inputs(chapter_prompt, chapter)
+        messages, _, _ = await asyncio.to_thread(self._fit_context, inputs)
+        chat_model = _get_llm()
+
+        async def stream_version(version):
+            text = ""
+            # Each version is a request of its own, like in `generate_chapter_versions`
+            with llm_cache_variant(version):
+                async for chunk in chat_model.astream(messages):
+                    text += chunk.content
+                    if on_token is not None:
+                        result = on_token(version, chunk.content)
+                        if asyncio.iscoroutine(result):
+                            await result
+            return text
+
+        texts = await asyncio.gather(
+            *(stream_version(i) for i in range(1, number_of_versions + 1))
+        )
+        versions = {}
+        ai_messages = {}
+        human_messages = {}
+        for i, text in enumerate(texts, start=1):
+            ai_messages[i] = text
+            human_messages[i] = inputs["input"]
+            versions[i] = {**inputs, "output_text": text}
+        return versions, ai_messages, human_messages
+
     def add_chapter_to_book_as_messages(self, chapter_number, human_message, ai_message): 
         """Add a chapter to the book as messages."""
-        self.chain.memory.chat_memory.messages.append(
-            HumanMessage(name=f"chapter{chapter_number}", content=human_message)
+        self.initial_memory.chat_memory.messages.append(
+            _human_message(f"chapter{chapter_number}", human_message)
         )
-        self.chain.memory.chat_memory.messages.append(
-            AIMessage(name=f"chapter{chapter_number}", content=ai_message)
+        self.initial_memory.chat_memory.messages.append(
+            _ai_message(f"chapter{chapter_number}", ai_message)
         )
+        if self.journal is not None:
+            self.journal.add(f"chapter{chapter_number}", human_message, ai_message)
 
 
     def generate_chapter(self, chapter_prompt, chapter, temporary_file_path=None):
@@ -290,6 +831,8 @@ class Writer:
             chain: The chain that can be used to generate the next chapter.
             next_chapter (int): The next chapter of the book.
         """
+        from langchain_core.documents import Document
+
         print("Generating chapter...")
         chain = self.chain
         temporary_file_path = Path(temporary_folder) / f"chapter{chapter}.txt"
@@ -353,7 +896,7 @@ class Writer:
 
     def update_chain_memory_with_messages_from_file(
         file_path: Union[str, Path],
-        chain_memory: ConversationBufferMemory,
+        chain_memory: "ConversationBufferMemory",
         keep_chapters: int = None,
     ):
         """Load the conversation history from a file and add to the chain memory.
@@ -385,9 +928,9 @@ class Writer:
             if keep_chapters is not None and chapter_number > keep_chapters:
                 break
             chain_memory.chat_memory.messages.append(
-                HumanMessage(messages["human_message"])
+                _human_message(None, messages["human_message"])
             )
-            chain_memory.chat_memory.messages.append(AIMessage(messages["ai_message"]))
+            chain_memory.chat_memory.messages.append(_ai_message(None, messages["ai_message"]))
         return chain_memory
 
     # def generate_book(chain, number_of_chapters, starting_chapter=1):
@@ -411,7 +954,7 @@ class Writer:
 
 
     def init_chain(
-        human_prompt_file: Union[str, Path], memory: ConversationBufferMemory = None
+        human_prompt_file: Union[str, Path], memory: "ConversationBufferMemory" = None
     ):
         """Initialize the chain with a prompt and a memory.
 
@@ -424,7 +967,7 @@ class Writer:
         """
         human_prompt_txt = get_human_prompt_from_file(human_prompt_file)
         prompt = get_prompt()
-        chain = create_chain_from_memory_and_prompt(llm, prompt)
+        chain = create_chain_from_memory_and_prompt(_get_llm(), prompt)
         prompt_story = input("Want to add something specific for the story: ")
         chain.invoke(
             {
@@ -0,0 +1,31 @@
+"""gunicorn configuration of the production server of the app.
+
+From the root folder:
+
+    gunicorn bookjibe.ui.wsgi:application
+
+The app is imported once by the master process (`preload_app`), then the worker processes
+are forked from it. Each worker serves `BOOKJIBE_WEB_THREADS` requests at the same time.
+Set the number of workers with `BOOKJIBE_WEB_WORKERS` rather than `--workers`, so that the
+app shares the state of its jobs between the workers, see `bookjibe.ui.jobs`.
+"""
+from bookjibe.settings import job_db, web_bind, web_threads, web_workers
+
+bind = web_bind
+workers = web_workers
+threads = web_threads
+worker_class = "gthread"
+preload_app = True
+# The LLM calls run in background jobs, the requests themselves are short
+timeout = 60
+keepalive = 5
+accesslog = "-"
+
+
+def on_starting(server):
+    if server.cfg.workers > 1 and job_db is None:
+        server.log.warning(
+            "%d workers without a shared job database: the progress of the jobs is lost when "
+            "it is polled from another worker. Set BOOKJIBE_WEB_WORKERS instead of --workers.",
+            server.cfg.workers,
+        )
@@ -0,0 +1,21 @@
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ["BOOKJIBE_LLM_CACHE"] = "0"
+os.environ["BOOKJIBE_TOKENIZER"] = "estimate"
+os.environ["BOOKJIBE_JOURNAL_FOLDER"] = tempfile.mkdtemp(prefix="bookjibe-journals-")
+
+from langchain_community.chat_models.fake import FakeListChatModel
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Replace the LLM used by the writer with a fake one."""
+    import bookjibe.writer
+
+    llm = FakeListChatModel(responses=["Once upon a time"])
+    monkeypatch.setattr(bookjibe.writer, "llm", llm)
+    return llm
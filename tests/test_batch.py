@@ -0,0 +1,59 @@
+import json
+
+import bookjibe.writer
+from bookjibe.batch import load_manifest, run_batch
+
+
+def write_manifest(tmp_path, books):
+    (tmp_path / "prompt.txt").write_text("Write a children's book.")
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(
+        json.dumps({"defaults": {"prompt_file": "prompt.txt", "versions": 2}, "books": books})
+    )
+    return manifest
+
+
+def test_run_batch(fake_llm, tmp_path, monkeypatch):
+    monkeypatch.setattr(bookjibe.writer, "init_prompt_folder", str(tmp_path))
+    manifest = write_manifest(
+        tmp_path,
+        [
+            {"name": "dragon", "description": "A dragon", "chapters": ["Night", "Day"]},
+            {"name": "princess", "description": "A princess", "chapters": ["Castle"]},
+        ],
+    )
+
+    results = run_batch(load_manifest(manifest), tmp_path / "books", workers=2)
+
+    assert [result["status"] for result in results] == ["done", "done"]
+    history = json.loads((tmp_path / "books" / "dragon.json").read_text())
+    assert list(history) == ["synopsys", "chapter1", "chapter2"]
+    assert (tmp_path / "books" / "princess.txt").exists()
+
+
+def test_run_batch_resumes_from_checkpoint(fake_llm, tmp_path, monkeypatch):
+    monkeypatch.setattr(bookjibe.writer, "init_prompt_folder", str(tmp_path))
+    monkeypatch.setattr(bookjibe.writer, "memory_strategy", "summary")
+    manifest = write_manifest(
+        tmp_path, [{"name": "dragon", "description": "A dragon", "chapters": ["Night", "Day"]}]
+    )
+    books = tmp_path / "books"
+    books.mkdir()
+    checkpoint = {
+        "metadata": {"summaries": {"chapter1": "The dragon naps"}},
+        "pairs": [
+            ["synopsis", "Write a story", "A dragon story"],
+            ["chapter1", "Night", "The dragon sleeps"],
+        ],
+    }
+    (books / "dragon.state.json").write_text(json.dumps(checkpoint))
+
+    (result,) = run_batch(load_manifest(manifest), books, workers=1)
+
+    state = json.loads((books / "dragon.state.json").read_text())
+    history = json.loads((books / "dragon.json").read_text())
+    assert result["chapters"] == 1
+    # The summary of the checkpoint is reused, the last chapter is still in the window
+    assert state["metadata"]["summaries"] == {"chapter1": "The dragon naps"}
+    assert history["chapter1"]["ai_message"] == "The dragon sleeps"
+    assert history["chapter2"]["ai_message"] == "Once upon a time"
@@ -0,0 +1,100 @@
+import pytest
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_core.globals import set_llm_cache
+
+from bookjibe.cache import DiskResponseCache, bypass_llm_cache, llm_cache_variant
+from bookjibe.writer import Writer
+
+
+@pytest.fixture
+def response_cache(tmp_path):
+    cache = DiskResponseCache(tmp_path / "llm_cache.sqlite")
+    set_llm_cache(cache)
+    yield cache
+    set_llm_cache(None)
+
+
+def test_cache_replays_responses(response_cache):
+    llm = FakeListChatModel(responses=["first", "second", "third"])
+
+    assert llm.invoke("Write a story").content == "first"
+    assert llm.invoke("Write a story").content == "first"
+    with llm_cache_variant(2):
+        assert llm.invoke("Write a story").content == "second"
+    with bypass_llm_cache():
+        assert llm.invoke("Write a story").content == "third"
+    assert llm.invoke("Write a story").content == "third"
+
+    assert response_cache.stats()["hits"] == 2
+    assert response_cache.stats()["misses"] == 3
+
+
+def test_cache_evicts_least_recently_used_responses(response_cache):
+    llm = FakeListChatModel(responses=["x" * 1000])
+    response_cache.max_bytes = 2500
+    for i in range(5):
+        llm.invoke(f"Prompt {i}")
+
+    assert response_cache.stats()["bytes"] <= 2500
+    assert 0 < response_cache.stats()["entries"] < 5
+
+
+def test_cache_keeps_chapter_versions_apart(fake_llm, response_cache):
+    fake_llm.responses = ["Version 1", "Version 2"]
+    writer = Writer()
+
+    _, ai_messages, _ = writer.generate_chapter_versions("A dragon", 1)
+    _, cached_ai_messages, _ = writer.generate_chapter_versions(
+        "A dragon", 1, mode="concurrent"
+    )
+
+    assert ai_messages == {1: "Version 1", 2: "Version 2"}
+    assert cached_ai_messages == ai_messages
+
+
+def test_batch_reuses_the_cache_unless_asked_not_to(fake_llm, response_cache, tmp_path, monkeypatch):
+    import json
+
+    import bookjibe.writer
+    from bookjibe.batch import run_batch
+
+    monkeypatch.setattr(bookjibe.writer, "init_prompt_folder", str(tmp_path))
+    (tmp_path / "prompt.txt").write_text("Write a children's book.")
+    fake_llm.responses = ["A dragon story", "Another dragon story"]
+    book = {
+        "name": "dragon", "prompt_file": "prompt.txt", "description": "A dragon",
+        "chapters": [], "versions": 1, "selection": "first", "mode": "concurrent",
+    }
+
+    def synopsis(folder, **kwargs):
+        run_batch([book], tmp_path / folder, workers=1, **kwargs)
+        return json.loads((tmp_path / folder / "dragon.json").read_text())["synopsys"]["ai_message"]
+
+    assert synopsis("first") == "A dragon story"
+    assert synopsis("cached") == "A dragon story"
+    assert synopsis("new", use_cache=False) == "Another dragon story"
+
+
+def test_multi_candidate_requests_are_not_served_from_the_cache(fake_llm, response_cache):
+    fake_llm.responses = ["Version 1", "Version 2"]
+    writer = Writer()
+
+    _, ai_messages, _ = writer.generate_chapter_versions("A dragon", 1, mode="multi_candidate")
+
+    assert ai_messages == {1: "Version 1", 2: "Version 2"}
+
+
+def test_cached_responses_are_not_accounted_as_billed(response_cache):
+    from bookjibe.usage import UsageTracker, get_usage_handler, usage_context
+
+    tracker = UsageTracker()
+    llm = FakeListChatModel(responses=["first"], callbacks=[get_usage_handler(tracker)])
+
+    with usage_context(book="dragon"):
+        llm.invoke("Write a story")
+        llm.invoke("Write a story")
+
+    totals = tracker.to_json()["totals"]
+    assert (totals["calls"], totals["cache_hits"]) == (1, 1)
+    assert tracker.book_usage("dragon")["prompt_tokens"] == totals["prompt_tokens"] > 0
+    assert 'bookjibe_book_llm_cache_hits_total{book="dragon"} 1' in tracker.to_prometheus()
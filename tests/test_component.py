@@ -0,0 +1,34 @@
+from bookjibe.ui.component import (
+    make_chapter_cache,
+    make_chapter_drop_down_list,
+    make_chapter_option,
+)
+from bookjibe.writer import create_writer_from_book_data
+
+
+def make_book():
+    return create_writer_from_book_data(
+        {
+            "synopsis": {"human_message": "Write a story", "ai_message": "A story"},
+            "chapter1": {"human_message": "Write chapter 1", "ai_message": "One"},
+            "chapter2": {"human_message": "Write chapter 2", "ai_message": "Two"},
+        }
+    )
+
+
+def test_chapter_cache_keyed_by_chapter_number(fake_llm):
+    writer = make_book()
+
+    assert make_chapter_cache(writer) == {
+        "1": {"human_message": "Write chapter 1", "ai_message": "One"},
+        "2": {"human_message": "Write chapter 2", "ai_message": "Two"},
+    }
+
+
+def test_chapter_options_match_the_appended_option(fake_llm):
+    writer = make_book()
+
+    dropdown = make_chapter_drop_down_list(writer)
+
+    assert dropdown.options == [make_chapter_option(1), make_chapter_option(2)]
+    assert make_chapter_option(3) == {"label": "Chapter 3", "value": 3}
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+HEAVY_MODULES = (
+    "openai",
+    "langchain_openai",
+    "langchain.memory",
+    "langchain.chains",
+    "pandas",
+)
+
+# Cumulative import time of bookjibe.writer, in microseconds (about 100000 measured)
+WRITER_IMPORT_BUDGET_US = 250_000
+
+
+def _cumulative_import_time(importtime_output, module):
+    # The lines of -X importtime are "import time: <self> | <cumulative> | <module>"
+    for line in importtime_output.splitlines():
+        if line.startswith("import time:") and line.split("|")[-1].strip() == module:
+            return int(line.split("|")[1])
+    raise AssertionError(f"{module} was not imported")
+
+
+def test_import_writer_is_lazy():
+    """Importing the writer does not load the LLM libraries nor create a client."""
+    code = (
+        "import sys\n"
+        "import bookjibe.writer, bookjibe.utils, bookjibe.llm\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == ""
+    assert _cumulative_import_time(result.stderr, "bookjibe.writer") < WRITER_IMPORT_BUDGET_US
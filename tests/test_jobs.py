@@ -0,0 +1,99 @@
+import threading
+import time
+
+from bookjibe.ui.jobs import JobManager, start_chapter_stream, get_job, remove_job
+from bookjibe.writer import Writer
+
+
+def test_job_manager_reports_progress_and_result():
+    manager = JobManager(max_workers=2)
+
+    def run(job, value):
+        job.set_progress(0.5, "Half way")
+        return value * 2
+
+    job = manager.get(manager.submit(run, 21))
+    job.done.wait(5)
+
+    assert job.state() == {"status": "done", "progress": 1.0, "message": "Half way"}
+    assert job.result == 42
+
+
+def test_job_manager_cancels_at_checkpoint():
+    manager = JobManager(max_workers=1)
+    started = threading.Event()
+    resume = threading.Event()
+
+    def run(job):
+        started.set()
+        resume.wait(5)
+        job.set_progress(0.5)
+        return "never collected"
+
+    job_id = manager.submit(run)
+    started.wait(5)
+    assert manager.cancel(job_id)
+    resume.set()
+    job = manager.get(job_id)
+    job.done.wait(5)
+
+    assert job.status == "cancelled"
+    assert job.result is None
+
+
+def test_start_chapter_stream(fake_llm):
+    writer = Writer()
+
+    job_id = start_chapter_stream(writer, "A dragon", 1)
+    job = get_job(job_id)
+    job.done.wait(5)
+    remove_job(job_id)
+
+    assert job.status == "done"
+    assert job.snapshot() == {1: "Once upon a time", 2: "Once upon a time"}
+    assert get_job(job_id) is None
+
+
+def test_job_polled_from_another_process(tmp_path):
+    db_path = tmp_path / "jobs.sqlite"
+    running = JobManager(max_workers=1, db_path=db_path)
+    polling = JobManager(max_workers=1, db_path=db_path)
+    resume = threading.Event()
+
+    def run(job):
+        job.append(1, "Once")
+        resume.wait(5)
+        return {"ai_messages": {"1": "Once"}}
+
+    job_id = running.submit(run, number_of_versions=1)
+    running.get(job_id).done.wait(0.2)
+    assert polling.get(job_id).state()["status"] == "running"
+    resume.set()
+    running.get(job_id).done.wait(5)
+
+    job = polling.get(job_id)
+    assert job.done.is_set()
+    assert job.snapshot() == {1: "Once"}
+    assert job.result == {"ai_messages": {"1": "Once"}}
+    polling.remove(job_id)
+    assert polling.get(job_id) is None
+
+
+def test_job_cancelled_from_another_process(tmp_path):
+    db_path = tmp_path / "jobs.sqlite"
+    running = JobManager(max_workers=1, db_path=db_path)
+    polling = JobManager(max_workers=1, db_path=db_path)
+    started = threading.Event()
+
+    def run(job):
+        started.set()
+        while True:
+            job.set_progress(0.5)
+            time.sleep(0.01)
+
+    job_id = running.submit(run)
+    started.wait(5)
+    assert polling.cancel(job_id)
+    running.get(job_id).done.wait(5)
+
+    assert polling.get(job_id).status == "cancelled"
@@ -0,0 +1,57 @@
+from bookjibe.journal import BookJournal
+from bookjibe.writer import Writer, create_writer_from_book_data
+
+
+def make_book(journal):
+    journal.add(None, "Write a story", "A dragon story")
+    writer = Writer.from_journal(journal)
+    writer.add_chapter_to_book_as_messages(1, "Night", "The dragon sleeps")
+    writer.add_chapter_to_book_as_messages(2, "Day", "The dragon flies")
+    writer.update_chapter_ai_message(1, "The dragon dreams")
+    return writer
+
+
+def test_journal_records_deltas(tmp_path):
+    journal = BookJournal(tmp_path / "book.jsonl")
+    writer = make_book(journal)
+
+    assert [record["op"] for record in journal.records()] == ["add", "add", "add", "update"]
+    assert Writer.from_journal(journal).to_state() == writer.to_state()
+
+
+def test_journal_drops_outdated_summary(tmp_path):
+    journal = BookJournal(tmp_path / "book.jsonl")
+    journal.add("chapter1", "Night", "The dragon sleeps")
+    journal.summary("chapter1", "The dragon naps")
+    journal.update("chapter1", "The dragon dreams")
+
+    assert journal.load_state()["metadata"] == {}
+
+
+def test_journal_skips_truncated_record(tmp_path):
+    journal = BookJournal(tmp_path / "book.jsonl")
+    make_book(journal)
+    with open(journal.path, "a") as f:
+        f.write('{"op": "add", "name": "chapter3", "human')
+
+    journal.update("chapter2", "The dragon lands")
+
+    pairs = journal.load_state()["pairs"]
+    assert [name for name, _, _ in pairs] == [None, "chapter1", "chapter2"]
+    assert pairs[2][2] == "The dragon lands"
+
+
+def test_journal_compact_and_export(tmp_path):
+    journal = BookJournal(tmp_path / "book.jsonl")
+    writer = make_book(journal)
+
+    journal.compact()
+    book_data = journal.export(tmp_path / "book.json")
+
+    assert len(journal.records()) == 3
+    assert list(book_data) == ["synopsis", "chapter1", "chapter2"]
+    assert book_data["chapter1"]["ai_message"] == "The dragon dreams"
+    assert (
+        create_writer_from_book_data(book_data).get_chapter_ai_message(2)
+        == writer.get_chapter_ai_message(2)
+    )
@@ -0,0 +1,43 @@
+import pytest
+from langchain_core.messages import HumanMessage
+
+from bookjibe.fake_llm import FakeChatOpenAI
+from bookjibe.llm import generate_candidates, get_llm
+
+
+def test_get_llm_fake_backend():
+    assert isinstance(get_llm("fake"), FakeChatOpenAI)
+    with pytest.raises(ValueError):
+        get_llm("unknown")
+
+
+def test_fake_chat_model():
+    llm = FakeChatOpenAI(output_tokens=20, cache=False)
+
+    streamed = [chunk.content for chunk in llm.stream("Write a story")]
+    candidates = generate_candidates(
+        [HumanMessage(content="Write a story")], n=3, chat_model=llm
+    )
+
+    assert len(streamed) == 20
+    assert len(candidates) == 3
+    assert all(len(candidate.split()) == 20 for candidate in candidates)
+
+
+def test_fake_chat_model_answers_do_not_depend_on_the_call_order():
+    from concurrent.futures import ThreadPoolExecutor
+    from contextvars import copy_context
+
+    from bookjibe.cache import llm_cache_variant
+
+    llm = FakeChatOpenAI(output_tokens=20, cache=False)
+
+    def answer(variant):
+        with llm_cache_variant(variant):
+            return llm.invoke("Write a story").content
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        answers = list(executor.map(lambda v: copy_context().run(answer, v), [1, 2, 1, 2]))
+
+    assert answers[0] == answers[2] == answer(1)
+    assert answers[1] == answers[3] != answers[0]
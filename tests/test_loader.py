@@ -0,0 +1,49 @@
+import base64
+import json
+
+from bookjibe.loader import (
+    iter_data_url_text,
+    iter_json_book_items,
+    load_writer_from_upload,
+)
+from bookjibe.writer import create_writer_from_book_data
+
+book_data = {
+    "synopsis": {"human_message": "Write a story", "ai_message": "Un dragon éveillé"},
+    "chapter1": {"human_message": "Night", "ai_message": 'The dragon says "{hello}"'},
+    "chapter2": {"human_message": "Day", "ai_message": "The dragon flies,\nfar away"},
+}
+
+
+def to_data_url(text, content_type="application/json"):
+    return f"data:{content_type};base64," + base64.b64encode(text.encode("utf-8")).decode()
+
+
+def test_json_items_split_in_small_chunks():
+    text = json.dumps(book_data, indent=2, ensure_ascii=False)
+    chunks = iter_data_url_text(to_data_url(text), chunk_size=8)
+
+    assert list(iter_json_book_items(chunks)) == [
+        (name, item["human_message"], item["ai_message"]) for name, item in book_data.items()
+    ]
+
+
+def test_load_json_matches_book_data():
+    writer = load_writer_from_upload(to_data_url(json.dumps(book_data)), "book.json")
+
+    assert writer.to_state() == create_writer_from_book_data(book_data).to_state()
+
+
+def test_load_csv():
+    text = 'name,human_message,ai_message\nsynopsis,Write a story,"A dragon,\nstory"\nchapter1,Night,The dragon sleeps\n'
+    writer = load_writer_from_upload(to_data_url(text, "text/csv"), "book.csv")
+
+    assert writer.to_state()["pairs"] == [
+        ("synopsis", "Write a story", "A dragon,\nstory"),
+        ("chapter1", "Night", "The dragon sleeps"),
+    ]
+
+
+def test_load_invalid_file():
+    assert load_writer_from_upload(to_data_url('{"synopsis": {"human'), "book.json") is None
+    assert load_writer_from_upload(to_data_url("[]"), "book.json") is None
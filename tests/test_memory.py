@@ -0,0 +1,98 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from bookjibe.memory import BookMemory
+from bookjibe.tokens import count_message_tokens
+from bookjibe.writer import Writer
+
+
+def make_memory(number_of_chapters, **kwargs):
+    memory = BookMemory(**kwargs)
+    memory.chat_memory.messages += [
+        HumanMessage(content="Write a story"),
+        AIMessage(content="The synopsis"),
+    ]
+    for i in range(1, number_of_chapters + 1):
+        memory.chat_memory.messages += [
+            HumanMessage(name=f"chapter{i}", content=f"Write chapter {i}"),
+            AIMessage(name=f"chapter{i}", content=f"Chapter {i} " * 100),
+        ]
+    return memory
+
+
+def test_buffer_strategy_keeps_all_messages():
+    memory = make_memory(5)
+    assert memory.history_messages() == memory.chat_memory.messages
+
+
+def test_window_strategy_keeps_synopsis_and_last_chapters():
+    memory = make_memory(50, strategy="window", window_chapters=2)
+
+    history = memory.history_messages()
+
+    assert [message.content for message in history[:2]] == [
+        "Write a story",
+        "The synopsis",
+    ]
+    assert [message.name for message in history[2:]] == ["chapter49"] * 2 + [
+        "chapter50"
+    ] * 2
+
+
+def test_summary_strategy_replaces_older_chapters():
+    memory = make_memory(4, strategy="summary", window_chapters=1)
+    memory.summaries.update({"chapter1": "Summary 1", "chapter3": "Summary 3"})
+
+    history = memory.history_messages()
+
+    assert [message.content for message in history[2:4]] == ["Summary 1", "Summary 3"]
+    assert [message.name for message in history[4:]] == ["chapter4", "chapter4"]
+
+
+def test_max_tokens_bounds_the_history():
+    memory = make_memory(50, strategy="buffer", max_tokens=1000)
+    history = memory.history_messages()
+    assert len(history) < 20
+    assert history[1].content == "The synopsis"
+    assert history[-1].name == "chapter50"
+
+
+def test_writer_summarizes_chapters_before_the_next_generation(fake_llm):
+    writer = Writer(initial_memory=BookMemory(strategy="summary", window_chapters=1))
+    writer.add_chapter_to_book_as_messages(0, "Write a story", "A story")
+    writer.add_chapter_to_book_as_messages(1, "Write chapter 1", "Chapter 1")
+    writer.add_chapter_to_book_as_messages(2, "Write chapter 2", "Chapter 2")
+
+    # Accepting a chapter does not wait for the LLM
+    assert writer.initial_memory.summaries == {}
+    assert fake_llm.i == 0
+
+    writer.generate_chapter_versions("A dragon", 3, number_of_versions=1)
+
+    assert writer.initial_memory.summaries == {"chapter1": "Once upon a time"}
+    assert Writer.from_state(writer.to_state()).initial_memory.summaries == {
+        "chapter1": "Once upon a time"
+    }
+
+    # Editing a chapter drops its outdated summary
+    writer.update_chapter_ai_message(1, "Chapter 1, edited")
+    assert writer.initial_memory.summaries == {}
+
+
+def test_stable_prefix_moves_by_whole_windows():
+    def chapter_names(memory):
+        return [message.name for message in memory.history_messages()[3::2]]
+
+    # The window starts at chapter 1 up to chapter 5, then at chapter 4
+    memory = make_memory(5, strategy="window", window_chapters=3, stable_prefix=True)
+    assert chapter_names(memory) == [f"chapter{i}" for i in range(1, 6)]
+    memory = make_memory(7, strategy="window", window_chapters=3, stable_prefix=True)
+    assert chapter_names(memory) == [f"chapter{i}" for i in range(4, 8)]
+    # 2 then 4 chapters fit in the budget, the others are dropped by whole windows of 3
+    memory = make_memory(7, strategy="buffer", window_chapters=3, stable_prefix=True)
+    messages = memory.chat_memory.messages
+    synopsis_tokens = count_message_tokens(messages[:2])
+    chapter_tokens = count_message_tokens(messages[2:4])
+    memory.max_tokens = synopsis_tokens + int(2.5 * chapter_tokens)
+    assert chapter_names(memory) == ["chapter7"]
+    memory.max_tokens = synopsis_tokens + int(4.5 * chapter_tokens)
+    assert chapter_names(memory) == ["chapter4", "chapter5", "chapter6", "chapter7"]
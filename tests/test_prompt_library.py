@@ -0,0 +1,60 @@
+import os
+import time
+
+import pytest
+
+from bookjibe.prompt_library import PromptLibrary
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def test_prompts_read_once_and_reread_when_changed(tmp_path):
+    path = tmp_path / "dragon_prompt.txt"
+    path.write_text("Write about a dragon.")
+    (tmp_path / "dragon_specifications.txt").write_text("Specifications")
+    library = PromptLibrary(tmp_path, watcher="off")
+    assert library.names("prompt.txt") == ["dragon_prompt.txt"]
+    assert library.get("dragon_prompt.txt") == "Write about a dragon."
+
+    # Same modification time and size: the file is not read again
+    stat = path.stat()
+    path.write_text("Write about a rabbit.")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert not library.refresh()
+    assert library.get("dragon_prompt.txt") == "Write about a dragon."
+
+    path.write_text("Write about a big dragon.")
+    assert library.refresh()
+    assert library.get("dragon_prompt.txt") == "Write about a big dragon."
+
+    path.unlink()
+    assert library.refresh()
+    with pytest.raises(FileNotFoundError):
+        library.get("dragon_prompt.txt")
+
+
+def test_unindexed_prompt_found_on_lookup(tmp_path):
+    library = PromptLibrary(tmp_path, watcher="off")
+    (tmp_path / "cat_prompt.txt").write_text("Write about a cat.")
+
+    assert library.get("cat_prompt.txt") == "Write about a cat."
+
+
+@pytest.mark.parametrize("watcher", ["auto", "poll"])
+def test_new_prompts_seen_by_the_watcher(tmp_path, watcher):
+    library = PromptLibrary(tmp_path, watcher=watcher, poll_interval=0.05)
+    assert library.names() == []
+
+    (tmp_path / "cat_prompt.txt").write_text("Write about a cat.")
+
+    try:
+        assert wait_for(lambda: library.names() == ["cat_prompt.txt"])
+    finally:
+        library.stop_watching()
@@ -0,0 +1,23 @@
+import json
+
+import bookjibe.prompts
+from bookjibe.prompts import bundled_prompt_folder, get_template_path, refresh_prompt_template
+
+
+def test_refreshed_template_saved_outside_the_package(tmp_path, monkeypatch):
+    from langchain import hub
+
+    name = "hwchase17/openai-functions-agent"
+    bundled_path = get_template_path(name)
+    bundled = bundled_path.read_text()
+    template = bookjibe.prompts.get_prompt_template(name)
+    monkeypatch.setattr(bookjibe.prompts, "prompt_template_folder", str(tmp_path))
+    monkeypatch.setattr(bookjibe.prompts, "_templates", {})
+    monkeypatch.setattr(hub, "pull", lambda _: template)
+
+    refresh_prompt_template(name)
+
+    assert bundled_path.parent == bundled_prompt_folder
+    assert bundled_path.read_text() == bundled
+    assert get_template_path(name) == tmp_path / "hwchase17__openai-functions-agent.json"
+    assert json.loads(get_template_path(name).read_text())["kwargs"]["input_variables"]
@@ -0,0 +1,168 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import HumanMessage
+
+import bookjibe.ratelimit
+from bookjibe.fake_llm import FakeChatOpenAI
+from bookjibe.ratelimit import RateLimiter, RateLimitError, rate_limited
+
+
+class TooManyRequests(Exception):
+    status_code = 429
+
+
+class FlakyChatModel(FakeChatOpenAI):
+    """Fake chat model answering 429 to its first requests."""
+
+    rate_limited_requests: int = 0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.rate_limited_requests:
+            self.rate_limited_requests -= 1
+            raise TooManyRequests()
+        return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.rate_limited_requests:
+            self.rate_limited_requests -= 1
+            raise TooManyRequests()
+        return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+class ServiceUnavailable(Exception):
+    status_code = 503
+
+
+class UnstableChatModel(FakeChatOpenAI):
+    """Fake chat model failing its first requests with transient errors: connection errors and 503."""
+
+    transient_errors: int = 0
+
+    def _raise_transient_error(self):
+        self.transient_errors -= 1
+        if self.transient_errors % 2:
+            raise openai.APIConnectionError(
+                request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+            )
+        raise ServiceUnavailable()
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.transient_errors:
+            self._raise_transient_error()
+        return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.transient_errors:
+            self._raise_transient_error()
+        return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = RateLimiter(
+        requests_per_minute=0, tokens_per_minute=0, max_concurrency=4, max_retries=3, backoff=0.01
+    )
+    monkeypatch.setattr(bookjibe.ratelimit, "_rate_limiter", limiter)
+    return limiter
+
+
+def test_rate_limiter_waits_for_tokens():
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=600)
+
+    with limiter.limit(600):
+        pass
+    start = time.monotonic()
+    with limiter.limit(5):
+        pass
+
+    assert time.monotonic() - start >= 0.4
+    assert limiter.metrics()["requests"] == 2
+
+
+def test_rate_limited_chat_model_retries(limiter):
+    llm = rate_limited(FlakyChatModel)(output_tokens=5, cache=False, rate_limited_requests=2)
+
+    answer = llm.invoke([HumanMessage(content="Write a story")])
+
+    metrics = limiter.metrics()
+    assert len(answer.content.split()) == 5
+    assert metrics["rate_limited"] == 2
+    assert metrics["retries"] == 2
+    assert metrics["successes"] == 1
+    assert metrics["in_flight"] == 0
+    assert 1 <= metrics["concurrency"] < 4
+
+
+def test_rate_limited_chat_model_gives_up(limiter):
+    llm = rate_limited(FlakyChatModel)(output_tokens=5, cache=False, rate_limited_requests=10)
+
+    with pytest.raises(RateLimitError):
+        llm.invoke([HumanMessage(content="Write a story")])
+    assert limiter.metrics()["rate_limited"] == 4
+
+
+def test_rate_limited_chat_model_async(limiter):
+    llm = rate_limited(FlakyChatModel)(output_tokens=5, cache=False, rate_limited_requests=1)
+
+    async def generate():
+        answer = await llm.ainvoke([HumanMessage(content="Write a story")])
+        chunks = [chunk.content async for chunk in llm.astream("Write a story")]
+        return answer, chunks
+
+    answer, chunks = asyncio.run(generate())
+
+    assert len(answer.content.split()) == 5
+    assert len(chunks) == 5
+    assert limiter.metrics()["retries"] == 1
+    assert limiter.metrics()["in_flight"] == 0
+
+
+def test_transient_errors_are_retried(limiter):
+    llm = rate_limited(UnstableChatModel)(output_tokens=5, cache=False, transient_errors=2)
+
+    answer = llm.invoke([HumanMessage(content="Write a story")])
+    llm.transient_errors = 1
+    asyncio.run(llm.ainvoke([HumanMessage(content="Write a story")]))
+
+    metrics = limiter.metrics()
+    assert len(answer.content.split()) == 5
+    assert metrics["failures"] == 3
+    assert metrics["retries"] == 3
+    assert metrics["rate_limited"] == 0
+    assert metrics["successes"] == 2
+    # The transient errors do not reduce the concurrency
+    assert metrics["concurrency"] == 4
+
+
+def test_transient_errors_are_raised_after_the_retries(limiter):
+    llm = rate_limited(UnstableChatModel)(output_tokens=5, cache=False, transient_errors=10)
+
+    with pytest.raises((openai.APIConnectionError, ServiceUnavailable)):
+        llm.invoke([HumanMessage(content="Write a story")])
+    assert limiter.metrics()["failures"] == 4
+
+
+def test_other_errors_are_not_retried(limiter):
+    class BadRequest(Exception):
+        status_code = 400
+
+    def request(usage):
+        raise BadRequest()
+
+    with pytest.raises(BadRequest):
+        limiter.call(request, 10)
+    assert limiter.metrics()["retries"] == 0
+
+
+def test_rate_limiter_prometheus_metrics(limiter):
+    with limiter.limit(10):
+        pass
+
+    metrics = limiter.to_prometheus()
+
+    assert "bookjibe_ratelimit_requests_total 1\n" in metrics
+    assert "# TYPE bookjibe_ratelimit_in_flight gauge" in metrics
@@ -0,0 +1,38 @@
+import pytest
+
+from bookjibe.serialization import dump_book_state, load_book_state
+from bookjibe.writer import Writer, deserialize_writer, serialize_writer
+
+
+@pytest.mark.parametrize("compression", ["none", "zlib"])
+def test_dump_and_load_book_state(compression):
+    state = {
+        "metadata": {"language": "fr"},
+        "pairs": [(None, "Écris une histoire", "Il était une fois"), ("chapter1", "", "")],
+    }
+
+    assert load_book_state(dump_book_state(state, compression=compression)) == state
+
+
+def test_load_book_state_rejects_other_data():
+    with pytest.raises(ValueError):
+        load_book_state(b"not a book state")
+
+
+def test_serialize_writer(fake_llm):
+    writer = Writer()
+    writer.add_chapter_to_book_as_messages(1, "Write chapter 1", "Chapter 1")
+
+    restored = deserialize_writer(serialize_writer(writer))
+
+    assert restored.chain.memory.chat_memory.messages == (
+        writer.chain.memory.chat_memory.messages
+    )
+
+
+def test_book_state_not_compressed_by_default():
+    from bookjibe.serialization import COMPRESSIONS
+
+    data = dump_book_state({"metadata": {}, "pairs": [("synopsis", "a", "b")]})
+
+    assert data[4] == COMPRESSIONS["none"]
@@ -0,0 +1,88 @@
+import time
+
+from bookjibe.ui.store import (
+    WriterSessionStore,
+    export_session_book,
+    get_session_writer,
+    save_session_writer,
+    writer_store,
+)
+from bookjibe.writer import Writer
+
+
+def test_store_evicts_least_recently_used(fake_llm):
+    store = WriterSessionStore(max_sessions=2)
+    writers = {session_id: Writer() for session_id in ("a", "b", "c")}
+    store.put("a", writers["a"])
+    store.put("b", writers["b"])
+    assert store.get("a") is writers["a"]
+
+    store.put("c", writers["c"])
+
+    assert store.get("b") is None
+    assert store.get("a") is writers["a"]
+    assert store.get("c") is writers["c"]
+
+
+def test_store_expires_sessions(fake_llm):
+    store = WriterSessionStore(ttl=0.01)
+    store.put("a", Writer())
+    time.sleep(0.02)
+    assert store.get("a") is None
+
+
+def test_store_reloads_sessions_from_sqlite(fake_llm, tmp_path):
+    db_path = tmp_path / "sessions.sqlite"
+    writer = Writer()
+    writer.add_chapter_to_book_as_messages(1, "Write chapter 1", "Chapter 1")
+    WriterSessionStore(db_path=db_path).put("a", writer)
+
+    restored = WriterSessionStore(db_path=db_path).get("a")
+
+    assert restored.get_chapter_ai_message(1) == "Chapter 1"
+
+
+def test_session_restored_from_journal(fake_llm):
+    writer = Writer()
+    writer.add_chapter_to_book_as_messages(1, "Night", "The dragon sleeps")
+    session = save_session_writer(None, writer)
+    writer.add_chapter_to_book_as_messages(2, "Day", "The dragon flies")
+    writer_store.delete(session["id"])
+
+    restored = get_session_writer(session)
+
+    assert restored is not writer
+    assert restored.to_state() == writer.to_state()
+
+
+def test_save_book_of_expired_session(fake_llm):
+    from bookjibe.journal import get_book_journal
+
+    writer = Writer()
+    writer.add_chapter_to_book_as_messages(1, "Night", "The dragon sleeps")
+    session = save_session_writer(None, writer)
+    writer_store.delete(session["id"])
+
+    # Restored from its journal
+    assert export_session_book(session) == {
+        "chapter1": {"human_message": "Night", "ai_message": "The dragon sleeps"}
+    }
+
+    writer_store.delete(session["id"])
+    get_book_journal(session["id"]).delete()
+
+    # Nothing left to save
+    assert export_session_book(session) is None
+
+
+def test_store_reloads_writer_changed_by_another_process(fake_llm, tmp_path):
+    db_path = tmp_path / "sessions.sqlite"
+    this_process = WriterSessionStore(db_path=db_path)
+    other_process = WriterSessionStore(db_path=db_path)
+    this_process.put("a", Writer(), revision=0)
+    writer = Writer()
+    writer.add_chapter_to_book_as_messages(1, "Write chapter 1", "Chapter 1")
+    other_process.put("a", writer, revision=1)
+
+    assert this_process.get("a", revision=0).get_last_chapter_number() == 0
+    assert this_process.get("a", revision=1).get_chapter_ai_message(1) == "Chapter 1"
@@ -0,0 +1,93 @@
+import asyncio
+import uuid
+
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_core.outputs import ChatGeneration, LLMResult
+from langchain_core.messages import AIMessage, HumanMessage
+
+import bookjibe.writer
+from bookjibe.usage import UsageTracker, get_usage_handler, usage_context
+from bookjibe.writer import Writer
+
+
+def use_tracked_llm(monkeypatch):
+    tracker = UsageTracker()
+    llm = FakeListChatModel(
+        responses=["Once upon a time"], callbacks=[get_usage_handler(tracker)]
+    )
+    monkeypatch.setattr(bookjibe.writer, "llm", llm)
+    return tracker
+
+
+def test_calls_accounted_to_call_site_book_and_session(monkeypatch):
+    tracker = use_tracked_llm(monkeypatch)
+    writer = Writer()
+    writer.book_id = "dragon"
+
+    with usage_context(session="abc"):
+        writer.generate_chapter_versions("A dragon", 1, number_of_versions=2, mode="concurrent")
+        writer.stream_chapter_versions("A dragon", 1, number_of_versions=2)
+
+    usage = tracker.to_json()
+    assert usage["totals"]["calls"] == 4
+    assert [(row["call_site"], row["calls"]) for row in usage["call_sites"]] == [
+        ("generate_chapter_versions", 4)
+    ]
+    assert usage["books"]["dragon"]["completion_tokens"] > 0
+    assert usage["sessions"]["abc"] == usage["books"]["dragon"]
+    assert all(call["estimated"] for call in usage["calls"])
+
+
+def test_async_calls_accounted(monkeypatch):
+    tracker = use_tracked_llm(monkeypatch)
+    writer = Writer()
+    writer.book_id = "dragon"
+
+    asyncio.run(writer.astream_chapter_versions("A dragon", 1, number_of_versions=2))
+
+    assert tracker.book_usage("dragon")["calls"] == 2
+    assert tracker.to_json()["calls"][0]["call_site"] == "generate_chapter_versions"
+
+
+def test_api_token_usage_and_prometheus_export():
+    tracker = UsageTracker()
+    handler = get_usage_handler(tracker)
+    run_id = uuid.uuid4()
+
+    with usage_context(call_site="generate_book_story", book='my "book"'):
+        handler.on_chat_model_start(
+            {}, [[HumanMessage(content="Hello")]], run_id=run_id,
+            invocation_params={"model_name": "gpt-3.5-turbo"},
+        )
+    handler.on_llm_end(
+        LLMResult(
+            generations=[[ChatGeneration(message=AIMessage(content="Hi"))]],
+            llm_output={"token_usage": {"prompt_tokens": 12, "completion_tokens": 3}},
+        ),
+        run_id=run_id,
+    )
+
+    call = tracker.to_json()["calls"][0]
+    assert (call["prompt_tokens"], call["completion_tokens"], call["estimated"]) == (12, 3, False)
+    text = tracker.to_prometheus()
+    assert (
+        'bookjibe_llm_prompt_tokens_total{call_site="generate_book_story",model="gpt-3.5-turbo"} 12'
+        in text
+    )
+    assert 'bookjibe_book_llm_calls_total{book="my \\"book\\""} 1' in text
+
+
+def test_cached_tokens_of_repeated_prefix():
+    from bookjibe.fake_llm import FakeChatOpenAI
+
+    tracker = UsageTracker()
+    llm = FakeChatOpenAI(output_tokens=5, cache=False, callbacks=[get_usage_handler(tracker)])
+    history = [HumanMessage(content="A long synopsis. " * 400), AIMessage(content="Yes.")]
+
+    llm.invoke(history + [HumanMessage(content="Write chapter 1")])
+    llm.invoke(history + [HumanMessage(content="Write chapter 1, again")])
+
+    first, second = tracker.to_json()["calls"]
+    assert first["cached_tokens"] == 0
+    assert 0 < second["cached_tokens"] < second["prompt_tokens"]
+    assert second["cached_tokens"] % 128 == 0
@@ -0,0 +1,44 @@
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from bookjibe.utils import (
+    create_chain_from_memory_and_prompt,
+    generate_prompt_logic,
+    get_prompt,
+    render_chain_messages,
+)
+
+
+def test_render_chain_messages(fake_llm):
+    chain = create_chain_from_memory_and_prompt(fake_llm, get_prompt())
+    inputs = {"input": "Write a story", "agent_scratchpad": [], "input_documents": []}
+
+    messages = render_chain_messages(chain, inputs)
+
+    assert messages == [
+        SystemMessage(content="You are a helpful assistant"),
+        HumanMessage(content="Write a story"),
+    ]
+
+
+def test_get_prompt_returns_independent_copies():
+    prompt = get_prompt()
+    prompt.messages.pop(0)
+
+    assert len(get_prompt().messages) == 4
+
+
+def test_generate_prompt_logic(fake_llm, tmp_path):
+    system_prompt_file = tmp_path / "prompt_generator.txt"
+    system_prompt_file.write_text("You write prompts.")
+
+    generate_prompt_logic(
+        system_prompt_file,
+        "roman pour enfants",
+        init_prompt_folder=tmp_path,
+        output_name="roman",
+        llm=fake_llm,
+        language="fr",
+    )
+
+    assert (tmp_path / "roman_specifications.txt").read_text() == "Once upon a time"
+    assert (tmp_path / "roman_prompt.txt").read_text() == "Once upon a time"
@@ -1,3 +1,211 @@
+import asyncio
+
+import pytest
+from langchain.memory import ConversationBufferMemory
+
+import bookjibe.writer
+from bookjibe.writer import Writer, create_writer_from_book_data
+
+
 def test_writer():
     """Test the writer module."""
-    assert 1 == 1
\ No newline at end of file
+    assert 1 == 1
+
+
+def test_generate_chapter_versions_concurrent(fake_llm):
+    writer = Writer()
+    writer.add_chapter_to_book_as_messages(1, "Write chapter 1", "Chapter 1")
+    messages = list(writer.chain.memory.chat_memory.messages)
+
+    sequential = writer.generate_chapter_versions("A dragon", 2, number_of_versions=3)
+    concurrent = writer.generate_chapter_versions(
+        "A dragon", 2, number_of_versions=3, mode="concurrent"
+    )
+
+    assert concurrent[1] == sequential[1]
+    assert concurrent[2] == sequential[2]
+    assert writer.chain.memory.chat_memory.messages == messages
+
+
+def test_generate_chapter_versions_multi_candidate(fake_llm):
+    # The fake model gives one completion per request, the missing versions are asked again
+    fake_llm.responses = ["One", "One", "Two", "Three"]
+    writer = Writer()
+    messages = list(writer.chain.memory.chat_memory.messages)
+
+    versions, ai_messages, human_messages = writer.generate_chapter_versions(
+        "A dragon", 1, number_of_versions=2, mode="multi_candidate"
+    )
+
+    assert ai_messages == {1: "One", 2: "Two"}
+    assert fake_llm.i == 3
+    assert human_messages[1] == versions[1]["input"]
+    assert writer.chain.memory.chat_memory.messages == messages
+
+
+def test_multi_candidate_gives_up_without_distinct_versions(fake_llm):
+    writer = Writer()
+
+    with pytest.raises(RuntimeError):
+        writer.generate_chapter_versions("A dragon", 1, number_of_versions=2, mode="multi_candidate")
+    with pytest.raises(RuntimeError):
+        asyncio.run(
+            writer.agenerate_chapter_versions(
+                "A dragon", 1, number_of_versions=2, mode="multi_candidate"
+            )
+        )
+
+
+def test_stream_chapter_versions(fake_llm):
+    writer = Writer()
+    messages = list(writer.chain.memory.chat_memory.messages)
+    tokens = {1: [], 2: []}
+
+    _, ai_messages, human_messages = writer.stream_chapter_versions(
+        "A dragon", 1, on_token=lambda version, token: tokens[version].append(token)
+    )
+
+    assert ai_messages == {1: "Once upon a time", 2: "Once upon a time"}
+    assert "".join(tokens[1]) == ai_messages[1]
+    assert len(tokens[2]) > 1
+    assert writer.chain.memory.chat_memory.messages == messages
+
+
+def test_chain_is_cached_until_memory_is_replaced(fake_llm):
+    writer = Writer()
+    chain = writer.chain
+    assert writer.chain is chain
+
+    writer.initial_memory = ConversationBufferMemory(
+        memory_key="chat_history", input_key="input"
+    )
+
+    assert writer.chain is not chain
+    assert writer.chain.memory.chat_memory is writer.initial_memory.chat_memory
+
+
+def test_chapter_index_follows_the_messages(fake_llm):
+    writer = create_writer_from_book_data(
+        {
+            "synopsis": {"human_message": "Write a story", "ai_message": "A story"},
+            "chapter1": {"human_message": "Write chapter 1", "ai_message": "One"},
+        }
+    )
+    assert writer.get_last_chapter_number() == 1
+
+    writer.add_chapter_to_book_as_messages(2, "Write chapter 2", "Two")
+    writer.update_chapter_ai_message(2, "Two, edited")
+    writer.generate_chapter_versions("A dragon", 3)
+
+    assert writer.get_last_chapter_number() == 2
+    assert writer.get_chapter_human_message(2) == "Write chapter 2"
+    assert writer.get_chapter(2) == {"name": "chapter2", "content": "Two, edited"}
+    assert writer.get_chapter_ai_message(3) is None
+    assert writer.get_chapter_numbers_list() == ["synopsis", "chapter1", "chapter2"]
+
+
+def test_book_is_read_and_written_without_the_llm(monkeypatch):
+    def no_llm():
+        raise AssertionError("The LLM client was created")
+
+    monkeypatch.setattr(bookjibe.writer, "_get_llm", no_llm)
+    writer = create_writer_from_book_data(
+        {"synopsis": {"human_message": "Write a story", "ai_message": "A story"}}
+    )
+    writer.add_chapter_to_book_as_messages(1, "Write chapter 1", "One")
+    writer.update_chapter_ai_message(1, "One, edited")
+
+    restored = Writer.from_state(writer.to_state())
+
+    assert restored.get_last_chapter_number() == 1
+    assert restored.get_chapter_ai_message(1) == "One, edited"
+    assert restored.get_chapter_human_message(1) == "Write chapter 1"
+
+
+def test_agenerate_chapter_versions(fake_llm):
+    writer = Writer()
+    writer.add_chapter_to_book_as_messages(1, "Write chapter 1", "Chapter 1")
+    messages = list(writer.chain.memory.chat_memory.messages)
+
+    async def generate():
+        return await asyncio.gather(
+            writer.agenerate_chapter_versions(
+                "A dragon", 2, number_of_versions=3, mode="concurrent"
+            ),
+            writer.agenerate_chapter_versions(
+                "A dragon", 2, number_of_versions=1, mode="multi_candidate"
+            ),
+            writer.astream_chapter_versions("A dragon", 2, number_of_versions=2),
+        )
+
+    concurrent, multi_candidate, streamed = asyncio.run(generate())
+    sequential = asyncio.run(writer.agenerate_chapter_versions("A dragon", 2))
+
+    assert concurrent[1] == {i: "Once upon a time" for i in (1, 2, 3)}
+    assert sequential[1] == {i: "Once upon a time" for i in (1, 2)}
+    assert multi_candidate[1] == {1: "Once upon a time"}
+    assert streamed[1] == {i: "Once upon a time" for i in (1, 2)}
+    assert writer.chain.memory.chat_memory.messages == messages
+
+
+def test_agenerate_book_story(fake_llm, tmp_path, monkeypatch):
+    monkeypatch.setattr(bookjibe.writer, "init_prompt_folder", str(tmp_path))
+    (tmp_path / "prompt.txt").write_text("Write a children's book.")
+    writer = Writer()
+
+    asyncio.run(writer.agenerate_book_story("prompt.txt", "A dragon"))
+
+    assert [message.content for message in writer.chain.memory.chat_memory.messages] == [
+        "Write a children's book. A dragon",
+        "Once upon a time",
+    ]
+
+
+def make_long_book(monkeypatch, context_window=1000):
+    import bookjibe.tokens
+    from bookjibe.memory import BookMemory
+
+    monkeypatch.setattr(bookjibe.tokens, "context_window", context_window)
+    monkeypatch.setattr(bookjibe.writer, "context_output_tokens", 100)
+    writer = Writer(BookMemory(strategy="buffer"))
+    writer.add_chapter_to_book_as_messages(0, "Write the synopsis", "A dragon story")
+    for i in range(1, 6):
+        writer.add_chapter_to_book_as_messages(i, f"Write chapter {i}", "word " * 300)
+    return writer
+
+
+def test_prompt_trimmed_to_context_window(fake_llm, monkeypatch):
+    writer = make_long_book(monkeypatch)
+
+    messages, memory, report = writer._fit_context(writer._chapter_inputs("A dragon", 6))
+    writer.generate_chapter_versions("A dragon", 6, number_of_versions=2, mode="concurrent")
+
+    assert report["prompt_tokens"] <= report["limit"] == 900
+    assert report["dropped"] == ["chapter1", "chapter2", "chapter3"]
+    assert report["summarized"] == []
+    assert memory.history_messages() == messages[1:-1]
+    # The memory of the book, shared by the calls, is not trimmed
+    assert writer.initial_memory.context_tokens is None
+    assert len(writer.initial_memory.history_messages()) == 12
+
+
+def test_prompt_trimmed_with_summaries(fake_llm, monkeypatch):
+    monkeypatch.setattr(bookjibe.writer, "context_trim_policy", "summarize")
+    writer = make_long_book(monkeypatch)
+
+    _, _, report = writer._fit_context(writer._chapter_inputs("A dragon", 6))
+    writer.stream_chapter_versions("A dragon", 6, number_of_versions=1)
+
+    assert report["summarized"] == ["chapter1", "chapter2", "chapter3"]
+    assert report["dropped"] == []
+    assert writer.initial_memory.summaries["chapter1"] == "Once upon a time"
+
+
+def test_prompt_too_long_is_not_sent(fake_llm, monkeypatch):
+    from bookjibe.tokens import ContextWindowError
+
+    writer = make_long_book(monkeypatch, context_window=300)
+
+    with pytest.raises(ContextWindowError):
+        writer.generate_chapter_versions("word " * 1000, 6, number_of_versions=1)
+    assert fake_llm.i == 0